@@ -1,8 +1,17 @@
 # encoding:utf-8
 
+import sys
+
+if "--profile-startup" in sys.argv:
+    # 需在导入其他模块前开启，才能记录完整的导入耗时
+    from common import startup_profiler
+
+    startup_profiler.install()
+else:
+    startup_profiler = None
+
 import os
 import signal
-import sys
 import time
 
 from channel import channel_factory
@@ -31,9 +40,13 @@ def sigterm_handler_wrap(_signo):
 
 def start_channel(channel_name: str):
     channel = channel_factory.create_channel(channel_name)
+    if startup_profiler:
+        startup_profiler.mark("channel created")
     if channel_name in ["wx", "wxy", "terminal", "wechatmp","wechatmp_service", "wechatcom_app", "wework",
                         "wechatcom_service", "wxpad", "web",  const.FEISHU, const.DINGTALK]:
         PluginManager().load_plugins()
+        if startup_profiler:
+            startup_profiler.mark("plugins loaded")
 
     if conf().get("use_linkai"):
         try:
@@ -41,6 +54,10 @@ def start_channel(channel_name: str):
             threading.Thread(target=linkai_client.start, args=(channel,)).start()
         except Exception as e:
             pass
+    if startup_profiler:
+        # channel.startup()通常会一直运行，在此之前输出导入耗时
+        startup_profiler.mark("channel startup")
+        startup_profiler.report()
     channel.startup()
 
 
@@ -48,6 +65,8 @@ def run():
     try:
         # load config
         load_config()
+        if startup_profiler:
+            startup_profiler.mark("config loaded")
         # ctrl + c
         sigterm_handler_wrap(signal.SIGINT)
         # kill signal
@@ -15,3 +15,12 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    def reply_stream(self, query, context: Context = None):
+        """
+        流式回复，返回增量文本的生成器，不支持流式或不适合流式时返回None，由调用方改用reply
+        生成器在收到任何内容前失败时抛出bot.stream.StreamNotStarted
+        :param query: received message
+        :return: iterator of text deltas
+        """
+        return None
@@ -1,7 +1,6 @@
 # encoding:utf-8
 
 import base64
-import time
 
 import openai
 import openai.error
@@ -9,13 +8,15 @@ import requests
 from common import const
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
+from bot.stream import can_stream, iter_chat_deltas, stream_with_session
 from bot.openai.open_ai_image import OpenAIImage
 from bot.openai.open_ai_vision import OpenAIVision
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.deadline import DeadlineExceeded, deadline_sleep, deadline_timeout
 from common.log import logger
-from common.token_bucket import TokenBucket
+from common.token_bucket import KeyedTokenBucket
 from common import memory, utils, const
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
@@ -32,7 +33,8 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
         if proxy:
             openai.proxy = proxy
         if conf().get("rate_limit_chatgpt"):
-            self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
+            # 按api key分别限流，用户设置的私有api key不占用默认key的额度
+            self.tb4chatgpt = KeyedTokenBucket(conf().get("rate_limit_chatgpt", 20))
         conf_model = conf().get("model") or "gpt-3.5-turbo"
         self.sessions = SessionManager(ChatGPTSession, model=conf().get("model") or "gpt-3.5-turbo")
         # o1相关模型不支持system prompt，暂时用文心模型的session
@@ -82,9 +84,6 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             if model:
                 new_args = self.args.copy()
                 new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
 
             reply_content = self.reply_text(session_id, session, api_key, args=new_args)
             logger.debug(
@@ -117,6 +116,27 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+        args = self.args.copy()
+        if context.get("gpt_model"):
+            args["model"] = context.get("gpt_model")
+        if args["model"] in [const.O1, const.O1_MINI]:
+            return None  # o1模型不支持流式输出
+        api_key = context.get("openai_api_key")
+
+        def open_stream(session):
+            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token(api_key):
+                raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            # 与普通请求相同，请求超时不超过消息剩余的处理时间
+            request_args = dict(args, request_timeout=deadline_timeout(args.get("request_timeout")))
+            response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, stream=True, **request_args)
+            return iter_chat_deltas(response)
+
+        logger.info("[CHATGPT] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="CHATGPT")
+
     def reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -126,7 +146,7 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
         :return: {}
         """
         try:
-            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
+            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token(api_key):
                 raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
             # if api_key == None, the default openai.api_key will be used
             if args is None:
@@ -134,6 +154,10 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             res = self.do_vision_completion_if_need(session_id, session.messages[-1]['content'])
             if res:
                 return res
+            # 请求超时不超过消息剩余的处理时间
+            request_timeout = deadline_timeout(args.get("request_timeout"))
+            if request_timeout != args.get("request_timeout"):
+                args = dict(args, request_timeout=request_timeout)
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
             # logger.debug("[CHATGPT] response={}".format(response))
             # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
@@ -184,6 +208,8 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
                 "completion_tokens": response["usage"]["completion_tokens"],
                 "content": content,
             }
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             need_retry = retry_count < 2
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
@@ -191,22 +217,22 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
                 logger.warn("[CHATGPT] RateLimitError: {}".format(e))
                 result["content"] = "提问太快啦，请休息一下再问我吧"
                 if need_retry:
-                    time.sleep(20)
+                    deadline_sleep(20)
             elif isinstance(e, openai.error.Timeout):
                 logger.warn("[CHATGPT] Timeout: {}".format(e))
                 result["content"] = "我没有收到你的消息"
                 if need_retry:
-                    time.sleep(5)
+                    deadline_sleep(5)
             elif isinstance(e, openai.error.APIError):
                 logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
                 result["content"] = "请再问我一次"
                 if need_retry:
-                    time.sleep(10)
+                    deadline_sleep(10)
             elif isinstance(e, openai.error.APIConnectionError):
                 logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
                 result["content"] = "我连接不到你的网络"
                 if need_retry:
-                    time.sleep(5)
+                    deadline_sleep(5)
             else:
                 logger.exception("[CHATGPT] Exception: {}".format(e))
                 need_retry = False
@@ -10,6 +10,7 @@ from bot.bot import Bot
 from bot.openai.open_ai_image import OpenAIImage
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 from bot.session_manager import SessionManager
+from bot.stream import can_stream, stream_with_session
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -73,6 +74,25 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                     reply = Reply(ReplyType.ERROR, retstring)
                 return reply
 
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+
+        def open_stream(session):
+            events = self.claudeClient.messages.create(
+                model=self._model_mapping(conf().get("model")),
+                max_tokens=4096,
+                system=conf().get("character_desc", ""),
+                messages=session.messages,
+                stream=True
+            )
+            for event in events:
+                if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                    yield event.delta.text
+
+        logger.info("[CLAUDE_API] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="CLAUDE_API")
+
     def reply_text(self, session: BaiduWenxinSession, retry_count=0):
         try:
             actual_model = self._model_mapping(conf().get("model"))
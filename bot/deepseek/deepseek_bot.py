@@ -3,8 +3,9 @@
 import time
 import openai
 from bot.bot import Bot
-from bot.deepseek.deepseek_session import DeepSeekSession
+from bot.deepseek.deepseek_session import DeepseekSession
 from bot.session_manager import SessionManager
+from bot.stream import can_stream, iter_chat_deltas, stream_with_session
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -15,7 +16,7 @@ class DeepSeekBot(Bot):
     def __init__(self):
         super().__init__()
         # 初始化会话管理器
-        self.sessions = SessionManager(DeepSeekSession, model=conf().get("model") or "deepseek")
+        self.sessions = SessionManager(DeepseekSession, model=conf().get("model") or "deepseek")
         self.api_key = conf().get("deepseek_api_key")
         self.api_base = conf().get("deepseek_api_base")
         # 获取当前选择的模型
@@ -82,3 +83,20 @@ class DeepSeekBot(Bot):
         else:
             reply = Reply(ReplyType.ERROR, "暂不支持其他类型的消息")
             return reply
+
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+        args = dict(self.args, stream=True)
+
+        def open_stream(session):
+            response = openai.ChatCompletion.create(
+                api_key=self.api_key,
+                api_base=self.api_base,
+                messages=session.messages,
+                **args
+            )
+            return iter_chat_deltas(response)
+
+        logger.info("[DEEPSEEK] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="DEEPSEEK")
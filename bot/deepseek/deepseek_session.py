@@ -9,6 +9,7 @@ class DeepseekSession(Session):
         self.reset()
 
     def reset(self):
+        self.reset_count += 1
         self.messages = []
         system_prompt = self.system_prompt
         if system_prompt:
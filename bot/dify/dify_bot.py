@@ -1,7 +1,6 @@
 # encoding:utf-8
 import io
 import os
-import mimetypes
 import threading
 import json
 
@@ -14,10 +13,13 @@ from lib.dify.dify_client import DifyClient, ChatClient
 from bot.dify.dify_session import DifySession, DifySessionManager
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
+from common.deadline import DeadlineExceeded, check_deadline, closing_on_cancel, deadline_timeout
 from common.log import logger
 from common import const, memory
 from common.utils import parse_markdown_text, print_red
 from common.tmp_dir import TmpDir
+from common.tmp_cleaner import register_tmp_file
+from common.image_prep import prepare_vision_image
 from config import conf
 
 UNKNOWN_ERROR_MSG = "我暂时遇到了一些问题，请您稍后重试~"
@@ -83,6 +85,7 @@ class DifyBot(Bot):
 
             reply, err = self._reply(query, session, context)
             if err != None:
+                context["no_reply_cache"] = True  # 错误提示不能进入回复缓存
                 dify_error_reply = conf().get("dify_error_reply", None)
                 error_msg = dify_error_reply if dify_error_reply else err
                 reply = Reply(ReplyType.TEXT, error_msg)
@@ -136,6 +139,8 @@ class DifyBot(Bot):
                 friendly_error_msg = "[DIFY] 当前应用类型设置错误，目前仅支持 agent, chatbot, chatflow, workflow"
                 return None, friendly_error_msg
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             error_info = f"[DIFY] Exception: {e}"
             logger.exception(error_info)
@@ -245,7 +250,7 @@ class DifyBot(Bot):
 
     def _download_file(self, url):
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=deadline_timeout(60))
             response.raise_for_status()
             parsed_url = urlparse(url)
             logger.debug(f"Downloading file from {url}")
@@ -256,6 +261,7 @@ class DifyBot(Bot):
             file_path = os.path.join(TmpDir().path(), file_name)
             with open(file_path, 'wb') as file:
                 file.write(response.content)
+            register_tmp_file(file_path)
             return file_path
         except Exception as e:
             logger.error(f"Error downloading {url}: {e}")
@@ -263,7 +269,7 @@ class DifyBot(Bot):
 
     def _download_image(self, url):
         try:
-            pic_res = requests.get(url, stream=True)
+            pic_res = requests.get(url, stream=True, timeout=deadline_timeout(60))
             pic_res.raise_for_status()
             image_storage = io.BytesIO()
             size = 0
@@ -383,13 +389,13 @@ class DifyBot(Bot):
         path = img_cache.get("path")
         msg.prepare()
 
-        with open(path, 'rb') as file:
-            file_name = os.path.basename(path)
-            file_type, _ = mimetypes.guess_type(file_name)
-            files = {
-                'file': (file_name, file, file_type)
-            }
-            response = dify_client.file_upload(user=session.get_user(), files=files)
+        # 上传缩放、压缩后的图片，同一张图片只处理一次
+        image = prepare_vision_image(path)
+        file_name = "{}.{}".format(os.path.splitext(os.path.basename(path))[0], image.ext)
+        files = {
+            'file': (file_name, image.data, image.mime)
+        }
+        response = dify_client.file_upload(user=session.get_user(), files=files)
 
         if response.status_code != 200 and response.status_code != 201:
             error_info = f"[DIFY] response text={response.text} status_code={response.status_code} when upload file"
@@ -457,12 +463,19 @@ class DifyBot(Bot):
     # TODO: 异步返回events
     def _handle_sse_response(self, response: requests.Response):
         events = []
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
-                event = self._parse_sse_event(decoded_line)
-                if event:
-                    events.append(event)
+        try:
+            # 消息被取消或到期时关闭连接，结束读取
+            with closing_on_cancel(response):
+                for line in response.iter_lines():
+                    if line:
+                        decoded_line = line.decode('utf-8')
+                        event = self._parse_sse_event(decoded_line)
+                        if event:
+                            events.append(event)
+        except Exception:
+            check_deadline()
+            raise
+        check_deadline()
 
         merged_message = []
         accumulated_agent_message = ''
@@ -1,5 +1,5 @@
 from common.expired_dict import ExpiredDict
-from config import conf
+from config import conf, conf_snapshot
 
 
 class DifySession(object):
@@ -48,10 +48,11 @@ class DifySession(object):
         self._room_name = room_name if room_name is not None else ''
 
     def count_user_message(self):
-        if conf().get("dify_conversation_max_messages", 5) <= 0:
+        max_messages = conf_snapshot().dify_conversation_max_messages
+        if max_messages <= 0:
             # 当设置的最大消息数小于等于0，则不限制
             return
-        if self._user_message_counter >= conf().get("dify_conversation_max_messages", 5):
+        if self._user_message_counter >= max_messages:
             self._user_message_counter = 0
             # FIXME: dify目前不支持设置历史消息长度，暂时使用超过5条清空会话的策略，缺点是没有滑动窗口，会突然丢失历史消息
             self._conversation_id = ''
@@ -0,0 +1,280 @@
+"""
+OpenAI兼容接口的公共HTTP传输层，各bot的chat/completions请求都经过这里
+- 按base url复用keep-alive连接池
+- 连接失败、超时、429和5xx时按指数退避加随机抖动重试，响应带Retry-After时按其等待
+- 按provider限制同时进行的请求数
+- 对冲请求：超过配置的时间仍未返回时再发一个相同的请求，取先返回的结果，用于削减慢请求的长尾
+- 记录每个provider的延迟和错误数，可通过 #stats 查看
+- 处在消息的截止时间内时，超时时间不超过剩余时间，退避等待期间被取消则立即结束
+"""
+
+import asyncio
+import email.utils
+import functools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from common.deadline import current_deadline, deadline_sleep
+from common.log import logger
+from config import conf
+
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class _ProviderStats(object):
+    __slots__ = ("requests", "errors", "retries", "hedged", "hedge_wins", "inflight", "latencies", "last_error")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.inflight = 0
+        self.latencies = deque(maxlen=512)  # 最近请求的耗时，单位秒
+        self.last_error = ""
+
+
+def _retry_after(response):
+    """解析Retry-After，支持秒数和HTTP日期两种格式"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class HttpTransport(object):
+    def __init__(self):
+        self.sessions = {}  # scheme://host -> requests.Session
+        self.semaphores = {}  # provider -> BoundedSemaphore，未限制的provider为None
+        self.stats_by_provider = {}
+        self.lock = threading.Lock()
+        self._hedge_executor = None
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        key = "{}://{}".format(parts.scheme, parts.netloc)
+        session = self.sessions.get(key)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            with self.lock:
+                session = self.sessions.get(key)
+                if session is None:
+                    pool_size = conf().get("http_pool_size", 10)
+                    session = requests.Session()
+                    session.mount(key, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+                    self.sessions[key] = session
+        return session
+
+    def _semaphore(self, provider):
+        if provider not in self.semaphores:
+            with self.lock:
+                if provider not in self.semaphores:
+                    limit = (conf().get("http_provider_concurrency") or {}).get(provider, 0)
+                    self.semaphores[provider] = threading.BoundedSemaphore(limit) if limit else None
+        return self.semaphores[provider]
+
+    def _stats(self, provider):
+        stats = self.stats_by_provider.get(provider)
+        if stats is None:
+            with self.lock:
+                stats = self.stats_by_provider.setdefault(provider, _ProviderStats())
+        return stats
+
+    def _executor(self):
+        if self._hedge_executor is None:
+            with self.lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="http-hedge")
+        return self._hedge_executor
+
+    def post(self, provider, url, json=None, headers=None, timeout=None, stream=False, retries=None, **kwargs):
+        """
+        发送POST请求，失败时按配置重试
+        :param provider: provider名称，用于并发限制、对冲配置和统计，如 "moonshot"
+        :param stream: 流式请求不做对冲，只在收到响应头之前重试
+        :return: 最后一次的响应，重试用尽后仍失败时返回失败的响应；所有尝试都发生网络异常时抛出最后一个异常
+        """
+        return self.request("POST", provider, url, json=json, headers=headers, timeout=timeout,
+                            stream=stream, retries=retries, **kwargs)
+
+    def request(self, method, provider, url, timeout=None, stream=False, retries=None, **kwargs):
+        if retries is None:
+            retries = conf().get("http_max_retries", 2)
+        stats = self._stats(provider)
+        hedge_after = 0 if stream else (conf().get("http_hedge_after") or {}).get(provider, 0)
+        semaphore = self._semaphore(provider)
+        deadline = current_deadline()
+        attempt = 0
+        while True:
+            if deadline is not None:
+                timeout = deadline.timeout(timeout)
+            if semaphore is not None:
+                semaphore.acquire()
+            with self.lock:
+                stats.inflight += 1
+            begin = time.monotonic()
+            response, error = None, None
+            try:
+                if hedge_after:
+                    # 并发额度交给第一个请求，由它结束时释放
+                    response = self._hedged(provider, hedge_after, method, url, timeout, stream, kwargs, semaphore)
+                else:
+                    response = self._session(url).request(method, url, timeout=timeout, stream=stream, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                if semaphore is not None and not hedge_after:
+                    semaphore.release()
+            with self.lock:
+                stats.inflight -= 1
+                stats.requests += 1
+                stats.latencies.append(time.monotonic() - begin)
+
+            failed = error is not None or response.status_code in RETRY_STATUS
+            if not failed:
+                return response
+            retry_after = _retry_after(response)
+            if attempt >= retries or (retry_after is not None and retry_after > conf().get("http_backoff_max", 20)):
+                with self.lock:
+                    stats.errors += 1
+                    stats.last_error = str(error) if error is not None else "status_code={}".format(response.status_code)
+                if error is not None:
+                    raise error
+                return response
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            attempt += 1
+            with self.lock:
+                stats.retries += 1
+            logger.warning("[HttpTransport] {} request failed ({}), retry {} in {:.1f}s".format(
+                provider, error or response.status_code, attempt, delay))
+            if response is not None:
+                response.close()
+            deadline_sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt):
+        base = conf().get("http_backoff_base", 1.0)
+        return min(conf().get("http_backoff_max", 20), base * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _hedged(self, provider, hedge_after, method, url, timeout, stream, kwargs, semaphore):
+        """
+        先发一个请求，hedge_after秒后仍未返回则再发一个，取先成功返回的结果，另一个的响应到达后关闭
+        每个请求各占一个并发额度，直到请求结束才释放，落选的请求仍在进行时也计入并发数
+        :param semaphore: 调用方已获取的并发额度，由第一个请求持有
+        """
+        send = functools.partial(self._session(url).request, method, url, timeout=timeout, stream=stream, **kwargs)
+        executor = self._executor()
+        try:
+            first = executor.submit(send)
+        except Exception:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        if semaphore is not None:
+            first.add_done_callback(lambda f: semaphore.release())
+        done, _ = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+        if semaphore is not None and not semaphore.acquire(blocking=False):
+            return first.result()  # 没有空闲的并发额度时不对冲
+        stats = self._stats(provider)
+        with self.lock:
+            stats.hedged += 1
+        try:
+            second = executor.submit(send)
+        except Exception:
+            if semaphore is not None:
+                semaphore.release()
+            return first.result()
+        if semaphore is not None:
+            second.add_done_callback(lambda f: semaphore.release())
+        pending = {first, second}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code not in RETRY_STATUS:
+                    result = future
+                    break
+            if result is not None:
+                break
+        if result is None:
+            result = first  # 都失败时按第一个请求的结果处理重试
+        elif result is second:
+            with self.lock:
+                stats.hedge_wins += 1
+        for future in (first, second):
+            if future is not result:
+                future.add_done_callback(_close_response)
+        return result.result()
+
+    async def apost(self, provider, url, json=None, headers=None, timeout=None, stream=False, retries=None, **kwargs):
+        """post的协程版本，请求在线程池中执行，不阻塞事件循环"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.post, provider, url, json=json, headers=headers, timeout=timeout, stream=stream, retries=retries, **kwargs))
+
+    def stats(self):
+        """每个provider的请求数、错误数和延迟分位数"""
+        result = {}
+        with self.lock:
+            for provider, stats in list(self.stats_by_provider.items()):
+                result[provider] = {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "hedged": stats.hedged,
+                    "hedge_wins": stats.hedge_wins,
+                    "inflight": stats.inflight,
+                    "latencies": list(stats.latencies),
+                    "last_error": stats.last_error,
+                }
+        for item in result.values():
+            latencies = item.pop("latencies")
+            item["p50"] = _percentile(latencies, 0.5)
+            item["p95"] = _percentile(latencies, 0.95)
+        return result
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
+
+
+def post(provider, url, **kwargs):
+    """通过公共传输层发送POST请求，参数见HttpTransport.post"""
+    return get_transport().post(provider, url, **kwargs)
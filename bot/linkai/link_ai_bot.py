@@ -8,13 +8,15 @@ import config
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.session_manager import SessionManager
+from bot import http_transport
+from bot.stream import StreamNotStarted, can_stream, open_sse
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, pconf
 import threading
-from common import memory, utils
-import base64
+from common import memory
+from common.image_prep import prepare_vision_image
 import os
 
 class LinkAIBot(Bot):
@@ -44,27 +46,16 @@ class LinkAIBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def _chat(self, query, context, retry_count=0) -> Reply:
+    def _chat(self, query, context) -> Reply:
         """
-        发起对话请求
+        发起对话请求，网络异常和5xx由传输层重试
         :param query: 请求提示词
         :param context: 对话上下文
-        :param retry_count: 当前递归重试次数
         :return: 回复
         """
-        if retry_count > 2:
-            # exit from retry 2 times
-            logger.warn("[LINKAI] failed after maximum number of retry times")
-            return Reply(ReplyType.TEXT, "请再问我一次吧")
-
         try:
             # load config
-            if context.get("generate_breaked_by"):
-                logger.info(f"[LINKAI] won't set appcode because a plugin ({context['generate_breaked_by']}) affected the context")
-                app_code = None
-            else:
-                plugin_app_code = self._find_group_mapping_code(context)
-                app_code = context.kwargs.get("app_code") or plugin_app_code or conf().get("linkai_app_code")
+            app_code = self._get_app_code(context)
             linkai_api_key = conf().get("linkai_api_key")
 
             session_id = context["session_id"]
@@ -83,48 +74,15 @@ class LinkAIBot(Bot):
             if session_message[0].get("role") == "system":
                 if app_code or model == "wenxin":
                     session_message.pop(0)
-            body = {
-                "app_code": app_code,
-                "messages": session_message,
-                "model": model,     # 对话模型的名称, 支持 gpt-3.5-turbo, gpt-3.5-turbo-16k, gpt-4, wenxin, xunfei
-                "temperature": conf().get("temperature"),
-                "top_p": conf().get("top_p", 1),
-                "frequency_penalty": conf().get("frequency_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
-                "presence_penalty": conf().get("presence_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
-                "session_id": session_id,
-                "sender_id": session_id,
-                "channel_type": conf().get("channel_type", "wx")
-            }
-            try:
-                from linkai import LinkAIClient
-                client_id = LinkAIClient.fetch_client_id()
-                if client_id:
-                    body["client_id"] = client_id
-                    # start: client info deliver
-                    if context.kwargs.get("msg"):
-                        body["session_id"] = context.kwargs.get("msg").from_user_id
-                        if context.kwargs.get("msg").is_group:
-                            body["is_group"] = True
-                            body["group_name"] = context.kwargs.get("msg").from_user_nickname
-                            body["sender_name"] = context.kwargs.get("msg").actual_user_nickname
-                        else:
-                            if body.get("channel_type") in ["wechatcom_app"]:
-                                body["sender_name"] = context.kwargs.get("msg").from_user_id
-                            else:
-                                body["sender_name"] = context.kwargs.get("msg").from_user_nickname
-
-            except Exception as e:
-                pass
-            file_id = context.kwargs.get("file_id")
-            if file_id:
-                body["file_id"] = file_id
+            body = self._build_chat_body(context, app_code, session_id, session_message, model)
+            file_id = body.get("file_id")
             logger.info(f"[LINKAI] query={query}, app_code={app_code}, model={body.get('model')}, file_id={file_id}")
             headers = {"Authorization": "Bearer " + linkai_api_key}
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = http_transport.post("linkai", base_url + "/v1/chat/completions", json=body, headers=headers,
+                                      timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -158,23 +116,93 @@ class LinkAIBot(Bot):
                 logger.error(f"[LINKAI] chat failed, status_code={res.status_code}, "
                              f"msg={error.get('message')}, type={error.get('type')}")
 
-                if res.status_code >= 500:
-                    # server error, need retry
-                    time.sleep(2)
-                    logger.warn(f"[LINKAI] do retry, times={retry_count}")
-                    return self._chat(query, context, retry_count + 1)
-
                 error_reply = "提问太快啦，请休息一下再问我吧"
-                if res.status_code == 409:
+                if res.status_code >= 500:
+                    error_reply = "请再问我一次吧"
+                elif res.status_code == 409:
                     error_reply = "这个问题我还没有学会，请问我其它问题吧"
                 return Reply(ReplyType.TEXT, error_reply)
 
         except Exception as e:
             logger.exception(e)
-            # retry
-            time.sleep(2)
-            logger.warn(f"[LINKAI] do retry, times={retry_count}")
-            return self._chat(query, context, retry_count + 1)
+            return Reply(ReplyType.TEXT, "请再问我一次吧")
+
+    def reply_stream(self, query, context: Context = None):
+        if not can_stream(query, context) or context.kwargs.get("file_id"):
+            return None
+        if self._get_app_code(context):
+            return None  # 应用会返回知识库引用、插件结果和图片等附加内容，仍走普通请求
+        return self._chat_stream(query, context)
+
+    def _chat_stream(self, query, context):
+        session_id = context["session_id"]
+        session_message = self.sessions.session_msg_query(query, session_id)
+        model = conf().get("model")
+        if session_message[0].get("role") == "system" and model == "wenxin":
+            session_message.pop(0)
+        body = self._build_chat_body(context, None, session_id, session_message, model)
+        headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
+        base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
+        logger.info(f"[LINKAI] stream query={query}, model={model}")
+        parts = []
+        try:
+            for delta in open_sse("linkai", base_url + "/v1/chat/completions", headers, body, timeout=conf().get("request_timeout", 180)):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            if not parts:
+                raise StreamNotStarted(e) from e
+            raise
+        reply_content = "".join(parts)
+        if reply_content:
+            # 提问只在收到完整回复后和回复一起写入会话
+            self.sessions.session_reply(reply_content, session_id, query=query)
+            logger.info(f"[LINKAI] stream reply={reply_content}")
+
+    def _get_app_code(self, context):
+        if context.get("generate_breaked_by"):
+            logger.info(f"[LINKAI] won't set appcode because a plugin ({context['generate_breaked_by']}) affected the context")
+            return None
+        plugin_app_code = self._find_group_mapping_code(context)
+        return context.kwargs.get("app_code") or plugin_app_code or conf().get("linkai_app_code")
+
+    def _build_chat_body(self, context, app_code, session_id, session_message, model):
+        body = {
+            "app_code": app_code,
+            "messages": session_message,
+            "model": model,     # 对话模型的名称, 支持 gpt-3.5-turbo, gpt-3.5-turbo-16k, gpt-4, wenxin, xunfei
+            "temperature": conf().get("temperature"),
+            "top_p": conf().get("top_p", 1),
+            "frequency_penalty": conf().get("frequency_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
+            "presence_penalty": conf().get("presence_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
+            "session_id": session_id,
+            "sender_id": session_id,
+            "channel_type": conf().get("channel_type", "wx")
+        }
+        try:
+            from linkai import LinkAIClient
+            client_id = LinkAIClient.fetch_client_id()
+            if client_id:
+                body["client_id"] = client_id
+                # start: client info deliver
+                if context.kwargs.get("msg"):
+                    body["session_id"] = context.kwargs.get("msg").from_user_id
+                    if context.kwargs.get("msg").is_group:
+                        body["is_group"] = True
+                        body["group_name"] = context.kwargs.get("msg").from_user_nickname
+                        body["sender_name"] = context.kwargs.get("msg").actual_user_nickname
+                    else:
+                        if body.get("channel_type") in ["wechatcom_app"]:
+                            body["sender_name"] = context.kwargs.get("msg").from_user_id
+                        else:
+                            body["sender_name"] = context.kwargs.get("msg").from_user_nickname
+
+        except Exception as e:
+            pass
+        file_id = context.kwargs.get("file_id")
+        if file_id:
+            body["file_id"] = file_id
+        return body
 
     def _process_image_msg(self, app_code: str, session_id: str, query:str, img_cache: dict):
         try:
@@ -214,38 +242,27 @@ class LinkAIBot(Bot):
 
     def _build_vision_msg(self, query: str, path: str):
         try:
-            suffix = utils.get_path_suffix(path)
-            with open(path, "rb") as file:
-                base64_str = base64.b64encode(file.read()).decode('utf-8')
-                messages = [{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": query
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/{suffix};base64,{base64_str}"
-                            }
+            image = prepare_vision_image(path)
+            messages = [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": query
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image.data_url
                         }
-                    ]
-                }]
-                return messages
+                    }
+                ]
+            }]
+            return messages
         except Exception as e:
             logger.exception(e)
 
-    def reply_text(self, session: ChatGPTSession, app_code="", retry_count=0) -> dict:
-        if retry_count >= 2:
-            # exit from retry 2 times
-            logger.warn("[LINKAI] failed after maximum number of retry times")
-            return {
-                "total_tokens": 0,
-                "completion_tokens": 0,
-                "content": "请再问我一次吧"
-            }
-
+    def reply_text(self, session: ChatGPTSession, app_code="") -> dict:
         try:
             body = {
                 "app_code": app_code,
@@ -262,8 +279,8 @@ class LinkAIBot(Bot):
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = http_transport.post("linkai", base_url + "/v1/chat/completions", json=body, headers=headers,
+                                      timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -282,24 +299,19 @@ class LinkAIBot(Bot):
                 logger.error(f"[LINKAI] chat failed, status_code={res.status_code}, "
                              f"msg={error.get('message')}, type={error.get('type')}")
 
-                if res.status_code >= 500:
-                    # server error, need retry
-                    time.sleep(2)
-                    logger.warn(f"[LINKAI] do retry, times={retry_count}")
-                    return self.reply_text(session, app_code, retry_count + 1)
-
                 return {
                     "total_tokens": 0,
                     "completion_tokens": 0,
-                    "content": "提问太快啦，请休息一下再问我吧"
+                    "content": "请再问我一次吧" if res.status_code >= 500 else "提问太快啦，请休息一下再问我吧"
                 }
 
         except Exception as e:
             logger.exception(e)
-            # retry
-            time.sleep(2)
-            logger.warn(f"[LINKAI] do retry, times={retry_count}")
-            return self.reply_text(session, app_code, retry_count + 1)
+            return {
+                "total_tokens": 0,
+                "completion_tokens": 0,
+                "content": "请再问我一次吧"
+            }
 
     def _fetch_app_info(self, app_code: str):
         headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
@@ -451,6 +463,7 @@ class LinkAISessionManager(SessionManager):
         session.add_reply(reply)
         try:
             max_tokens = conf().get("conversation_max_tokens", 2500)
+            self.compact(session, max_tokens)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug(f"[LinkAI] chat history, before tokens={total_tokens}, now tokens={tokens_cnt}")
         except Exception as e:
@@ -1,17 +1,16 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 from bot.bot import Bot
 from bot.session_manager import SessionManager
+from bot.stream import can_stream, open_sse, stream_with_session
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
-import requests
+from bot import http_transport
 
 
 # ZhipuAI对话模型API
@@ -56,9 +55,6 @@ class MoonshotBot(Bot):
             new_args = self.args.copy()
             if model:
                 new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
 
             reply_content = self.reply_text(session, args=new_args)
             logger.debug(
@@ -82,12 +78,29 @@ class MoonshotBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session: MoonshotSession, args=None, retry_count=0) -> dict:
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+        args = self.args.copy()
+        if context.get("moonshot_model"):
+            args["model"] = context.get("moonshot_model")
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.api_key
+        }
+
+        def open_stream(session):
+            body = dict(args, messages=session.messages)
+            return open_sse("moonshot", self.base_url, headers, body, timeout=conf().get("request_timeout", 180))
+
+        logger.info("[MOONSHOT_AI] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="MOONSHOT_AI")
+
+    def reply_text(self, session: MoonshotSession, args=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
-        :param retry_count: retry count
         :return: {}
         """
         try:
@@ -99,11 +112,8 @@ class MoonshotBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
-                self.base_url,
-                headers=headers,
-                json=body
-            )
+            res = http_transport.post("moonshot", self.base_url, headers=headers, json=body,
+                                      timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 response = res.json()
                 return {
@@ -117,30 +127,13 @@ class MoonshotBot(Bot):
                 logger.error(f"[MOONSHOT_AI] chat failed, status_code={res.status_code}, "
                              f"msg={error.get('message')}, type={error.get('type')}")
 
+                # 5xx和429已经在传输层按退避重试过
                 result = {"completion_tokens": 0, "content": "提问太快啦，请休息一下再问我吧"}
-                need_retry = False
-                if res.status_code >= 500:
-                    # server error, need retry
-                    logger.warn(f"[MOONSHOT_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
-                elif res.status_code == 401:
+                if res.status_code == 401:
                     result["content"] = "授权失败，请检查API Key是否正确"
                 elif res.status_code == 429:
                     result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
-                else:
-                    need_retry = False
-
-                if need_retry:
-                    time.sleep(3)
-                    return self.reply_text(session, args, retry_count + 1)
-                else:
-                    return result
+                return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
-                return self.reply_text(session, args, retry_count + 1)
-            else:
-                return result
+            return {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
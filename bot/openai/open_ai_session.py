@@ -1,6 +1,5 @@
 from bot.session_manager import Session
 from common.log import logger
-import tiktoken
 import json
 
 
@@ -61,6 +60,8 @@ class OpenAISession(Session):
 def num_tokens_from_messages(messages, model: str) -> int:
     """Returns the number of tokens used by a list of messages."""
     try:
+        import tiktoken
+
         encoding = tiktoken.get_encoding("cl100k_base")  # 使用通用的编码器
     except Exception as e:
         logger.warn(f"Failed to get encoding: {e}")
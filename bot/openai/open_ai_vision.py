@@ -1,9 +1,7 @@
-import base64
-
-import requests
-
+from bot import http_transport
 from common.log import logger
-from common import const, utils, memory
+from common import const, memory
+from common.image_prep import prepare_vision_image
 from config import conf
 
 # OPENAI提供的图像识别接口
@@ -38,8 +36,8 @@ class OpenAIVision(object):
         headers = {"Authorization": "Bearer " + conf().get("open_ai_api_key", "")}
         # do http request
         base_url = conf().get("open_ai_api_base", "https://api.openai.com/v1")
-        res = requests.post(url=base_url + "/chat/completions", json=payload, headers=headers,
-                            timeout=conf().get("request_timeout", 180))
+        res = http_transport.post("openai", base_url + "/chat/completions", json=payload, headers=headers,
+                                  timeout=conf().get("request_timeout", 180))
         if res.status_code == 200:
             return res.json(), None
         else:
@@ -47,9 +45,7 @@ class OpenAIVision(object):
             return None, res.text
 
     def build_vision_msg(self, query: str, path: str):
-        suffix = utils.get_path_suffix(path)
-        with open(path, "rb") as file:
-            base64_str = base64.b64encode(file.read()).decode('utf-8')
+        image = prepare_vision_image(path)
         messages = [{
             "role": "user",
             "content": [
@@ -60,7 +56,7 @@ class OpenAIVision(object):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/{suffix};base64,{base64_str}"
+                        "url": image.data_url
                     }
                 }
             ]
@@ -0,0 +1,152 @@
+"""
+会话记忆压缩
+会话的token数超过conversation_max_tokens的一定比例时，在后台用便宜的模型把较早的几轮对话总结成一段摘要，
+摘要附在system prompt之后，原来的这几轮对话从会话中移除，使每轮请求的prompt保持在较小的规模
+- 总结在后台线程中进行，不增加用户这一轮的等待时间；摘要在该会话下一次提问或回复时写入会话
+- 总结完成前会话超长时仍按原来的方式丢弃最早的消息，摘要写入时已被丢弃的消息同样视为已总结
+- 只处理第一条消息为system prompt的会话
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bot import http_transport
+from common.log import logger
+from config import conf
+
+_PROMPT = (
+    "请把下面的对话总结成一段简洁的摘要，保留用户的身份、偏好、提到的事实、约定和尚未解决的问题，"
+    "省略寒暄和重复内容，不超过{max_chars}字，只输出摘要本身。\n\n{history}"
+)
+_SUMMARY_TITLE = "以下是之前对话的摘要：\n"
+
+
+class _CompactState(object):
+    __slots__ = ("generation", "reset_count", "running", "summary", "covered", "pending")
+
+    def __init__(self):
+        self.generation = 0  # 会话被重置时加一，重置前提交的总结结果作废
+        self.reset_count = 0  # 上次检查时会话的重置次数
+        self.running = False  # 是否有进行中的总结任务
+        self.summary = ""  # 已写入会话的摘要
+        self.covered = ()  # 待写入的摘要覆盖的消息
+        self.pending = None  # 待写入的摘要
+
+
+class SessionCompactor(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=conf().get("conversation_compact_workers", 2),
+                                           thread_name_prefix="session-compact")
+        self.compacted = 0
+        self.failed = 0
+
+    @staticmethod
+    def _state(session) -> _CompactState:
+        state = getattr(session, "compact_state", None)
+        if state is None:
+            state = session.compact_state = _CompactState()
+            state.reset_count = getattr(session, "reset_count", 0)
+        return state
+
+    def maybe_compact(self, session, max_tokens):
+        """写入已完成的摘要，并在会话超过阈值时提交新的总结任务"""
+        if not session.messages or session.messages[0].get("role") != "system":
+            return
+        state = self._state(session)
+        reset_count = getattr(session, "reset_count", 0)
+        if (reset_count != state.reset_count
+                or session.messages[0].get("content") != self._system_content(session, state.summary)):
+            # 会话已被重置或更换了system prompt，之前的摘要和进行中的总结结果作废
+            with self.lock:
+                state.generation += 1
+                state.reset_count = reset_count
+                state.summary, state.pending, state.covered = "", None, ()
+        self._apply(session, state)
+        try:
+            tokens = session.calc_tokens()
+        except Exception as e:
+            logger.debug("[SessionCompactor] calc tokens failed: {}".format(e))
+            return
+        if tokens < max_tokens * conf().get("conversation_compact_ratio", 0.8):
+            return
+        keep = conf().get("conversation_compact_keep_turns", 2) * 2
+        covered = session.messages[1:-keep] if keep else session.messages[1:]
+        if len(covered) < 2:
+            return
+        with self.lock:
+            if state.running:
+                return
+            state.running = True
+        self.executor.submit(self._summarize, session, state, state.generation, tuple(covered), state.summary)
+
+    def _apply(self, session, state):
+        with self.lock:
+            if state.pending is None:
+                return
+            summary, covered = state.pending, state.covered
+            state.pending, state.covered = None, ()
+        # 总结期间被丢弃的消息不在会话中，新加入的消息不在覆盖范围内，按对象比较只移除被总结的消息
+        covered_ids = set(map(id, covered))
+        session.messages[1:] = [m for m in session.messages[1:] if id(m) not in covered_ids]
+        state.summary = summary
+        session.messages[0] = {"role": "system", "content": self._system_content(session, summary)}
+        self.compacted += 1
+        logger.info("[SessionCompactor] session {} compacted {} messages into {} chars".format(
+            session.session_id, len(covered), len(summary)))
+
+    @staticmethod
+    def _system_content(session, summary):
+        if not summary:
+            return session.system_prompt
+        return "{}\n\n{}{}".format(session.system_prompt, _SUMMARY_TITLE, summary).lstrip()
+
+    def _summarize(self, session, state, generation, covered, previous):
+        summary = None
+        try:
+            summary = self._request_summary(covered, previous)
+        except Exception as e:
+            logger.warning("[SessionCompactor] summarize session {} failed: {}".format(session.session_id, e))
+        with self.lock:
+            state.running = False
+            if not summary:
+                self.failed += 1
+            elif generation == state.generation:
+                state.pending, state.covered = summary, covered
+
+    def _request_summary(self, covered, previous):
+        lines = []
+        if previous:
+            lines.append("[之前的摘要] {}".format(previous))
+        for message in covered:
+            role = "用户" if message.get("role") == "user" else "助手"
+            lines.append("[{}] {}".format(role, message.get("content")))
+        max_chars = conf().get("conversation_compact_max_chars", 300)
+        payload = {
+            "model": conf().get("conversation_compact_model", "gpt-4o-mini"),
+            "messages": [{"role": "user", "content": _PROMPT.format(max_chars=max_chars, history="\n".join(lines))}],
+            "temperature": 0.2,
+        }
+        api_key = conf().get("conversation_compact_api_key") or conf().get("open_ai_api_key", "")
+        base_url = conf().get("conversation_compact_api_base") or conf().get("open_ai_api_base", "https://api.openai.com/v1")
+        res = http_transport.post("openai", base_url + "/chat/completions", json=payload,
+                                  headers={"Authorization": "Bearer " + api_key}, timeout=60)
+        if res.status_code != 200:
+            raise Exception("status_code={}, msg={}".format(res.status_code, res.text[:200]))
+        return res.json()["choices"][0]["message"]["content"].strip()
+
+    def stats(self):
+        return {"compacted": self.compacted, "failed": self.failed}
+
+
+_compactor = None
+_compactor_lock = threading.Lock()
+
+
+def get_compactor() -> SessionCompactor:
+    global _compactor
+    if _compactor is None:
+        with _compactor_lock:
+            if _compactor is None:
+                _compactor = SessionCompactor()
+    return _compactor
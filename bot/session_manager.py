@@ -7,6 +7,7 @@ class Session(object):
     def __init__(self, session_id, system_prompt=None):
         self.session_id = session_id
         self.messages = []
+        self.reset_count = 0  # 重置次数，后台任务据此判断会话在任务期间是否被重置
         if system_prompt is None:
             self.system_prompt = conf().get("character_desc", "")
         else:
@@ -14,6 +15,7 @@ class Session(object):
 
     # 重置会话
     def reset(self):
+        self.reset_count += 1
         system_item = {"role": "system", "content": self.system_prompt}
         self.messages = [system_item]
 
@@ -61,11 +63,20 @@ class SessionManager(object):
         session = self.sessions[session_id]
         return session
 
+    def compact(self, session, max_tokens):
+        """开启记忆压缩时，写入已完成的摘要，并在会话接近上限时在后台总结较早的对话"""
+        if not conf().get("conversation_compact", False):
+            return
+        from bot.session_compactor import get_compactor
+
+        get_compactor().maybe_compact(session, max_tokens)
+
     def session_query(self, query, session_id):
         session = self.build_session(session_id)
         session.add_query(query)
         try:
             max_tokens = conf().get("conversation_max_tokens", 1000)
+            self.compact(session, max_tokens)
             total_tokens = session.discard_exceeding(max_tokens, None)
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
@@ -77,6 +88,7 @@ class SessionManager(object):
         session.add_reply(reply)
         try:
             max_tokens = conf().get("conversation_max_tokens", 1000)
+            self.compact(session, max_tokens)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
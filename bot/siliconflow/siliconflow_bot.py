@@ -1,10 +1,11 @@
 # encoding:utf-8
 
 import time
-import requests
+from bot import http_transport
 from bot.bot import Bot
 from bot.siliconflow.siliconflow_session import SiliconFlowSession
 from bot.session_manager import SessionManager
+from bot.stream import can_stream, open_sse, stream_with_session
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -65,11 +66,8 @@ class SiliconFlowBot(Bot):
             "messages": messages
         }
         
-        response = requests.post(
-            self.api_base,
-            headers=headers,
-            json=data
-        )
+        response = http_transport.post("siliconflow", self.api_base, headers=headers, json=data,
+                                       timeout=conf().get("request_timeout", 180))
         
         if response.status_code != 200:
             raise Exception(f"API调用失败: {response.status_code} - {response.text}")
@@ -132,3 +130,18 @@ class SiliconFlowBot(Bot):
                 return Reply(ReplyType.ERROR, f"SiliconFlow API 调用失败: {str(e)}")
         else:
             return Reply(ReplyType.ERROR, "暂不支持其他类型的查询")
+
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        def open_stream(session):
+            body = dict(self.args, messages=session.build_messages())
+            return open_sse("siliconflow", self.api_base, headers, body, timeout=conf().get("request_timeout", 180))
+
+        logger.info("[SILICONFLOW] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="SILICONFLOW")
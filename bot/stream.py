@@ -0,0 +1,123 @@
+"""
+流式回复的公共处理
+bot的reply_stream返回增量文本的生成器，生成器在第一次迭代时才发起请求；
+完整收到回复后才写入会话记录，中途失败或调用方提前结束时撤回本轮提问
+"""
+
+import json
+
+from bot import http_transport
+from bridge.context import Context, ContextType
+from common import memory
+from common.deadline import check_deadline, closing_on_cancel
+from common.log import logger
+from config import conf
+
+
+class StreamNotStarted(Exception):
+    """流式请求在收到任何内容之前失败，调用方可以改用普通请求"""
+
+
+def can_stream(query, context: Context) -> bool:
+    """只有普通的文字对话才使用流式回复，指令和带图片的识图请求仍走普通请求"""
+    if not conf().get("stream_reply", False):
+        return False
+    if context is None or context.type != ContextType.TEXT or not query:
+        return False
+    if query.startswith("#") or query in conf().get("clear_memory_commands", ["#清除记忆"]):
+        return False
+    if memory.USER_IMAGE_CACHE.get(context.get("session_id")):
+        return False
+    return True
+
+
+def iter_sse_data(response):
+    """
+    逐条解析SSE响应中的data字段，收到[DONE]时结束
+    :param response: stream=True的requests响应
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            logger.warning("[Stream] invalid sse data: {}".format(data[:200]))
+
+
+def _field(obj, key):
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def iter_chat_deltas(chunks):
+    """从OpenAI兼容接口的流式响应块中取出增量文本，兼容dict和SDK返回的对象"""
+    for chunk in chunks:
+        error = _field(chunk, "error")
+        if error:
+            raise Exception("stream error: {}".format(_field(error, "message") or error))
+        choices = _field(chunk, "choices")
+        if not choices:
+            continue
+        delta = _field(choices[0], "delta")
+        content = _field(delta, "content") if delta else None
+        if content:
+            yield content
+
+
+def open_sse(provider, url, headers, body, timeout=None):
+    """以流式方式请求OpenAI兼容接口，返回增量文本的生成器"""
+    res = http_transport.post(provider, url, headers=headers, json=dict(body, stream=True), stream=True, timeout=timeout)
+    if res.status_code != 200:
+        text = res.text
+        res.close()
+        raise Exception("status_code={}, msg={}".format(res.status_code, text[:500]))
+    try:
+        # 被取消或到期时关闭连接，使阻塞的读取立即结束
+        with closing_on_cancel(res):
+            try:
+                yield from iter_chat_deltas(iter_sse_data(res))
+            finally:
+                # 连接被关闭时读取可能正常结束，不能当作完整的回复
+                check_deadline()
+    finally:
+        res.close()
+
+
+def _rollback(session, query):
+    if session.messages and session.messages[-1].get("role") == "user" and session.messages[-1].get("content") == query:
+        session.messages.pop()
+
+
+def stream_with_session(sessions, query, session_id, open_stream, tag="BOT"):
+    """
+    在会话中提问并流式返回回复
+    :param sessions: SessionManager
+    :param open_stream: 传入session，返回增量文本的迭代器
+    """
+    session = sessions.session_query(query, session_id)
+    logger.debug("[{}] stream session query={}".format(tag, session.messages))
+    parts = []
+    completed = False
+    try:
+        for delta in open_stream(session):
+            parts.append(delta)
+            yield delta
+        completed = True
+    except Exception as e:
+        if not parts:
+            logger.warning("[{}] stream failed before any content: {}".format(tag, e))
+            raise StreamNotStarted(e) from e
+        logger.warning("[{}] stream interrupted after {} chars: {}".format(tag, sum(map(len, parts)), e))
+        raise
+    finally:
+        content = "".join(parts)
+        if completed and content:
+            sessions.session_reply(content, session_id)
+            logger.info("[{}] stream reply={}".format(tag, content))
+        else:
+            _rollback(session, query)
@@ -7,6 +7,7 @@ from bot.bot import Bot
 from bot.zhipuai.zhipu_ai_session import ZhipuAISession
 from bot.zhipuai.zhipu_ai_image import ZhipuAIImage
 from bot.session_manager import SessionManager
+from bot.stream import can_stream, iter_chat_deltas, stream_with_session
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -76,3 +77,14 @@ class ZhipuAIBot(Bot, ZhipuAIImage):
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
+
+    def reply_stream(self, query, context=None):
+        if not can_stream(query, context):
+            return None
+
+        def open_stream(session):
+            response = self.client.chat.completions.create(messages=session.messages, stream=True, **self.args)
+            return iter_chat_deltas(response)
+
+        logger.info("[ZHIPU_AI] stream query={}".format(query))
+        return stream_with_session(self.sessions, query, context["session_id"], open_stream, tag="ZHIPU_AI")
@@ -1,12 +1,20 @@
+import time
+
 from bot.bot_factory import create_bot
+from bridge.chat_router import ChatRouter, parse_route_key
 from bridge.context import Context
-from bridge.reply import Reply
+from bridge.reply_cache import ReplyCache
+from bridge.reply import Reply, ReplyType
 from common import const
+from common.deadline import check_deadline
 from common.log import logger
 from common.singleton import singleton
+from common.token_bucket import KeyedTokenBucket, TokenBucket
 from config import conf
 from translate.factory import create_translator
+from translate.translate_cache import CachedTranslator
 from voice.factory import create_voice
+from voice.voice_service import VoiceService
 
 
 @singleton
@@ -73,26 +81,144 @@ class Bridge(object):
 
         self.bots = {}
         self.chat_bots = {}
+        self._init_rate_limiters()
+        self.chat_router = None
+        if conf().get("chat_fallback_bots") or conf().get("chat_route_rules"):
+            self.chat_router = ChatRouter(
+                self.btype["chat"],
+                fallbacks=conf().get("chat_fallback_bots", []),
+                rules=conf().get("chat_route_rules", {}),
+                get_bot=self._get_chat_bot,
+            )
+        self.reply_cache = None
+        if conf().get("reply_cache_enabled", False):
+            self.reply_cache = ReplyCache(
+                conf().get("reply_cache_rules", {}),
+                ttl=conf().get("reply_cache_ttl", 3600),
+                max_size=conf().get("reply_cache_max_size", 1000),
+            )
+
+    def _init_rate_limiters(self):
+        """
+        对话限流，对所有bot生效：全局限流在令牌不足时等待，按用户/群的限流不等待直接拒绝
+        """
+        rate = conf().get("rate_limit_chat", 0)
+        self.tb4chat = TokenBucket(rate, timeout=conf().get("rate_limit_wait_timeout", 10)) if rate else None
+        user_rate = conf().get("rate_limit_chat_per_user", 0)
+        self.tb4user = KeyedTokenBucket(user_rate, timeout=0) if user_rate else None
+        group_rate = conf().get("rate_limit_chat_per_group", 0)
+        self.tb4group = KeyedTokenBucket(group_rate, timeout=0) if group_rate else None
+
+    def _acquire_chat_token(self, context: Context) -> bool:
+        if context is not None:
+            if context.get("chat_token_acquired"):
+                return True  # 流式请求失败后改用普通请求，已占用过令牌
+            cmsg = context.get("msg")
+            isgroup = context.get("isgroup", False)
+            if self.tb4group and isgroup:
+                if not self.tb4group.get_token(context.get("receiver")):
+                    logger.warning("[Bridge] group rate limit exceeded, group={}".format(context.get("receiver")))
+                    return False
+            if self.tb4user:
+                user_id = getattr(cmsg, "actual_user_id" if isgroup else "from_user_id", None) or context.get("session_id")
+                if not self.tb4user.get_token(user_id):
+                    logger.warning("[Bridge] user rate limit exceeded, user={}".format(user_id))
+                    return False
+        if self.tb4chat and not self.tb4chat.get_token():
+            logger.warning("[Bridge] chat rate limit exceeded")
+            return False
+        return True
 
     # 模型对应的接口
     def get_bot(self, typename):
         if self.bots.get(typename) is None:
             logger.info("create bot {} for {}".format(self.btype[typename], typename))
             if typename == "text_to_voice":
-                self.bots[typename] = create_voice(self.btype[typename])
+                self.bots[typename] = VoiceService(create_voice(self.btype[typename]), self.btype[typename])
             elif typename == "voice_to_text":
-                self.bots[typename] = create_voice(self.btype[typename])
+                self.bots[typename] = VoiceService(create_voice(self.btype[typename]), self.btype[typename])
             elif typename == "chat":
                 self.bots[typename] = create_bot(self.btype[typename])
             elif typename == "translate":
-                self.bots[typename] = create_translator(self.btype[typename])
+                translator = create_translator(self.btype[typename])
+                if conf().get("translate_cache_enabled", True):
+                    translator = CachedTranslator(translator, self.btype[typename])
+                self.bots[typename] = translator
         return self.bots[typename]
 
     def get_bot_type(self, typename):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        cache_key = None
+        if self.reply_cache is not None:
+            # 缓存命中时不调用bot，也不占用限流令牌
+            cache_key = self.reply_cache.make_key(self.get_bot("chat"), self.btype["chat"], query, context)
+            if cache_key is not None:
+                reply = self.reply_cache.get(cache_key)
+                if reply is not None:
+                    logger.info("[Bridge] reply cache hit, app={}".format(cache_key.app))
+                    return reply
+        if not self._acquire_chat_token(context):
+            return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+        check_deadline()  # 排队或等待令牌期间已到期、被取消的消息不再请求bot
+        if self.chat_router is not None:
+            reply = self.chat_router.reply(query, context)
+        else:
+            reply = self.get_bot("chat").reply(query, context)
+        if cache_key is not None:
+            self.reply_cache.put(cache_key, reply, context)
+        return reply
+
+    def fetch_reply_stream(self, query, context: Context):
+        """
+        流式获取回复
+        :return: 增量文本的迭代器；bot不支持流式时返回None，调用方改用fetch_reply_content；被限流时返回错误回复
+        """
+        bot_type = None
+        begin = time.monotonic()
+        if self.chat_router is not None:
+            # 开始输出后无法再切换bot，流式回复只请求路由排在最前的bot，失败时由调用方改用普通请求进行故障转移
+            bot_type = self.chat_router.candidates(context)[0]
+            stream = self._get_chat_bot(bot_type).reply_stream(query, context)
+        else:
+            stream = self.get_bot("chat").reply_stream(query, context)
+        if stream is None:
+            return None
+        cache_key = None
+        if self.reply_cache is not None:
+            cache_key = self.reply_cache.make_key(self.get_bot("chat"), self.btype["chat"], query, context)
+            if cache_key is not None:
+                reply = self.reply_cache.get(cache_key)
+                if reply is not None:
+                    logger.info("[Bridge] reply cache hit, app={}".format(cache_key.app))
+                    stream.close()
+                    return iter([reply.content])
+        if not self._acquire_chat_token(context):
+            stream.close()
+            return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+        context["chat_token_acquired"] = True
+        try:
+            check_deadline()
+        except Exception:
+            stream.close()
+            raise
+        if bot_type is not None:
+            stream = self.chat_router.track_stream(bot_type, stream, begin)
+        if cache_key is not None:
+            return self._cache_stream(cache_key, stream, context)
+        return stream
+
+    def _cache_stream(self, cache_key, stream, context):
+        """完整收到回复后写入缓存，中途失败的不缓存"""
+        parts = []
+        try:
+            for delta in stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            stream.close()
+        self.reply_cache.put(cache_key, Reply(ReplyType.TEXT, "".join(parts)), context)
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
@@ -103,9 +229,23 @@ class Bridge(object):
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
 
+    def fetch_translate_batch(self, texts, from_lang="", to_lang="en") -> list:
+        """批量翻译，返回与texts顺序一致的译文列表"""
+        return self.get_bot("translate").translate_batch(texts, from_lang, to_lang)
+
+    def _get_chat_bot(self, bot_type: str):
+        """bot_type为路由键，即bot类型或 bot类型:模型"""
+        if bot_type == self.btype["chat"]:
+            return self.get_bot("chat")
+        return self.find_chat_bot(bot_type)
+
     def find_chat_bot(self, bot_type: str):
         if self.chat_bots.get(bot_type) is None:
-            self.chat_bots[bot_type] = create_bot(bot_type)
+            real_type, model = parse_route_key(bot_type)
+            bot = create_bot(real_type)
+            if model:
+                _set_bot_model(bot, model)
+            self.chat_bots[bot_type] = bot
         return self.chat_bots.get(bot_type)
 
     def reset_bot(self):
@@ -113,3 +253,17 @@ class Bridge(object):
         重置bot路由
         """
         self.__init__()
+
+
+def _set_bot_model(bot, model):
+    """
+    为单独指定了模型的备用bot设置模型，只支持请求参数保存在self.args中的bot
+    """
+    args = getattr(bot, "args", None)
+    if not isinstance(args, dict) or "model" not in args:
+        raise Exception("{} does not support a separate model".format(type(bot).__name__))
+    args["model"] = model
+    sessions = getattr(bot, "sessions", None)
+    if sessions is not None and hasattr(sessions, "session_args"):
+        sessions.session_args["model"] = model  # 按模型计算会话的token数
+    logger.info("[Bridge] {} uses model {}".format(type(bot).__name__, model))
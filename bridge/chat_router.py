@@ -0,0 +1,271 @@
+"""
+对话bot的路由和故障转移
+- 按配置持有一组有序的bot，首选bot出错或超时未返回时转给下一个
+- 记录每个bot最近的延迟(p50/p95)和错误率，连续失败的bot暂时降到最后
+- 可选对短问题同时请求两个bot，取先返回的结果，另一个的结果丢弃
+- 可按群名或会话配置使用的bot列表
+- 备用bot可单独指定模型，路由中以"bot类型:模型"区分
+- 流式回复只请求排在最前的bot，同样记录其健康状况
+bot的调用是阻塞的，超时或落选的请求无法中断，只是不再等待它的结果；
+消息的截止时间会带到执行请求的线程中，消息被取消时立即停止等待
+"""
+
+import fnmatch
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common import const
+from common.deadline import DeadlineExceeded, bind_deadline, current_deadline
+from common.log import logger
+from config import conf
+
+
+class _Health(object):
+    __slots__ = ("samples", "failures", "open_until", "calls", "errors", "timeouts", "wins")
+
+    def __init__(self):
+        self.samples = deque(maxlen=100)  # (耗时, 是否成功)
+        self.failures = 0  # 连续失败次数
+        self.open_until = 0.0  # 在此之前降级
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.wins = 0  # 故障转移或并发请求时被采用的次数
+
+
+# 不使用全局model配置的bot，作为备用时不需要单独指定模型
+_OWN_MODEL_BOTS = (const.DIFY, const.COZE, const.XUNFEI, const.QWEN)
+
+
+def parse_route_key(key: str):
+    """路由键拆分为(bot类型, 模型)，未单独指定模型时模型为None"""
+    bot_type, _, model = key.partition(":")
+    return bot_type, model or None
+
+
+def _route_key(entry, primary: str):
+    """
+    配置中的bot类型或{"bot_type": ..., "model": ...}转换为路由键，无法使用时返回None
+    bot都按全局的model配置选择模型，与首选bot类型不同的备用bot需单独指定模型，否则会把首选bot的模型名发给其他服务商
+    """
+    if isinstance(entry, dict):
+        bot_type, model = entry.get("bot_type"), entry.get("model")
+    else:
+        bot_type, model = entry, None
+    if not bot_type:
+        logger.warning("[ChatRouter] invalid bot entry: {}".format(entry))
+        return None
+    if model:
+        return "{}:{}".format(bot_type, model)
+    if bot_type != primary and bot_type not in _OWN_MODEL_BOTS and conf().get("model"):
+        logger.warning("[ChatRouter] ignore {}: bot type differs from {}, set its model like "
+                       "{{\"bot_type\": \"{}\", \"model\": \"...\"}}".format(bot_type, primary, bot_type))
+        return None
+    return bot_type
+
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class ChatRouter(object):
+    def __init__(self, primary: str, fallbacks=None, rules=None, get_bot=None):
+        """
+        :param primary: 首选bot类型
+        :param fallbacks: 依次备用的bot，bot类型或{"bot_type": bot类型, "model": 模型}
+        :param rules: 路由规则 {"group:群名通配符" / "session:会话id通配符": [bot...]}，bot的写法同fallbacks
+        :param get_bot: 按路由键获取bot实例
+        """
+        self.pool = [primary] + [t for t in self._route_keys(fallbacks, primary) if t != primary]
+        self.rules = {pattern: self._route_keys(pool, primary) for pattern, pool in (rules or {}).items()}
+        self.get_bot = get_bot
+        self.failover_timeout = conf().get("chat_failover_timeout", 0)
+        self.race_max_chars = conf().get("chat_race_max_chars", 0)
+        self.by_latency = conf().get("chat_route_by_latency", False)
+        self.max_failures = conf().get("chat_circuit_failures", 3)
+        self.cooldown = conf().get("chat_circuit_cooldown", 60)
+        self.health = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=conf().get("chat_router_workers", 8), thread_name_prefix="chat-router")
+
+    @staticmethod
+    def _route_keys(entries, primary):
+        keys = []
+        for entry in entries or []:
+            key = _route_key(entry, primary)
+            if key is not None and key not in keys:
+                keys.append(key)
+        return keys
+
+    def _health(self, bot_type):
+        health = self.health.get(bot_type)
+        if health is None:
+            with self.lock:
+                health = self.health.setdefault(bot_type, _Health())
+        return health
+
+    def candidates(self, context: Context):
+        """按规则和健康状况排序后的bot类型列表"""
+        pool = self._match_rule(context) or self.pool
+        now = time.monotonic()
+        healthy = [t for t in pool if self._health(t).open_until <= now]
+        degraded = [t for t in pool if t not in healthy]
+        if self.by_latency and len(healthy) > 1:
+            # 没有样本的bot排在配置的位置，不参与按延迟排序
+            def latency(t):
+                samples = [cost for cost, ok in self._health(t).samples if ok]
+                return _percentile(samples, 0.5) if samples else 0.0
+            healthy.sort(key=latency)
+        return healthy + degraded
+
+    def _match_rule(self, context: Context):
+        if not self.rules or context is None:
+            return None
+        keys = ["session:" + str(context.get("session_id"))]
+        if context.get("isgroup", False):
+            group_name = getattr(context.get("msg"), "other_user_nickname", None)
+            if group_name:
+                keys.insert(0, "group:" + group_name)
+        for pattern, pool in self.rules.items():
+            if pool and any(fnmatch.fnmatchcase(key, pattern) for key in keys):
+                return pool
+        return None
+
+    def reply(self, query, context: Context) -> Reply:
+        candidates = self.candidates(context)
+        race = (self.race_max_chars and context is not None and context.type == ContextType.TEXT
+                and len(query) <= self.race_max_chars and len(candidates) > 1)
+        if len(candidates) == 1 and not self.failover_timeout:
+            return self._call(candidates[0], query, context)
+        return self._reply_with_failover(candidates, query, context, 2 if race else 1)
+
+    def _call(self, bot_type, query, context):
+        """调用bot并记录耗时和结果"""
+        health = self._health(bot_type)
+        begin = time.monotonic()
+        reply, ok = None, False
+        try:
+            reply = self.get_bot(bot_type).reply(query, context)
+            ok = reply is not None and reply.type != ReplyType.ERROR
+            return reply
+        except DeadlineExceeded:
+            ok = None
+            raise
+        except Exception as e:
+            logger.exception("[ChatRouter] {} reply failed: {}".format(bot_type, e))
+            return None
+        finally:
+            if ok is not None:  # 被取消的请求不计入健康统计
+                self._record(bot_type, health, time.monotonic() - begin, ok)
+
+    def track_stream(self, bot_type, stream, begin):
+        """包装流式回复，输出结束时按整体耗时记录健康状况，中途出错计为失败，被取消或提前关闭的不计入"""
+        health = self._health(bot_type)
+        ok = False
+        try:
+            for delta in stream:
+                yield delta
+            ok = True
+        except (DeadlineExceeded, GeneratorExit):
+            ok = None
+            raise
+        finally:
+            stream.close()
+            if ok is not None:
+                self._record(bot_type, health, time.monotonic() - begin, ok)
+
+    def _record(self, bot_type, health, cost, ok):
+        with self.lock:
+            health.calls += 1
+            health.samples.append((cost, ok))
+            if ok:
+                health.failures = 0
+                health.open_until = 0.0
+                return
+            health.errors += 1
+            health.failures += 1
+            if health.failures >= self.max_failures and health.open_until <= time.monotonic():
+                health.open_until = time.monotonic() + self.cooldown
+                logger.warning("[ChatRouter] {} failed {} times in a row, degraded for {}s".format(
+                    bot_type, health.failures, self.cooldown))
+
+    def _reply_with_failover(self, candidates, query, context, parallel):
+        deadline = current_deadline()
+        cancelled = Future()  # 消息被取消或到期时完成，用于结束等待
+        if deadline is None:
+            return self._wait_replies(candidates, query, context, parallel, cancelled)
+        on_cancel = lambda: cancelled.set_result(None)
+        deadline.on_cancel(on_cancel)
+        try:
+            return self._wait_replies(candidates, query, context, parallel, cancelled)
+        finally:
+            deadline.remove_callback(on_cancel)
+            if cancelled.done():
+                logger.info("[ChatRouter] stop waiting for reply: {}".format(deadline.reason))
+
+    def _wait_replies(self, candidates, query, context, parallel, cancelled):
+        remaining = list(candidates)
+        running = {}  # future -> bot类型
+        last_reply = None
+
+        def start_next():
+            bot_type = remaining.pop(0)
+            running[self.executor.submit(bind_deadline(self._call), bot_type, query, context)] = bot_type
+
+        for _ in range(min(parallel, len(remaining))):
+            start_next()
+        while running:
+            timeout = self.failover_timeout if (remaining and self.failover_timeout) else None
+            done, _ = wait(list(running) + [cancelled], timeout=timeout, return_when=FIRST_COMPLETED)
+            if cancelled.done():
+                raise DeadlineExceeded("cancelled while waiting for {}".format(list(running.values())))
+            if not done:
+                # 超时未返回，启动下一个bot，同时继续等待已发出的请求
+                for bot_type in running.values():
+                    self._health(bot_type).timeouts += 1
+                logger.warning("[ChatRouter] {} not replied in {}s, failover to {}".format(
+                    list(running.values()), self.failover_timeout, remaining[0]))
+                start_next()
+                continue
+            for future in done:
+                bot_type = running.pop(future)
+                try:
+                    reply = future.result()
+                except DeadlineExceeded:
+                    continue
+                if reply is not None and reply.type != ReplyType.ERROR:
+                    if len(candidates) > 1 and (running or bot_type != candidates[0]):
+                        self._health(bot_type).wins += 1
+                        logger.info("[ChatRouter] reply from {}, discard {}".format(bot_type, list(running.values())))
+                    return reply
+                last_reply = reply or last_reply
+                if remaining:
+                    logger.warning("[ChatRouter] {} failed, failover to {}".format(bot_type, remaining[0]))
+                    start_next()
+        return last_reply or Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+
+    def stats(self):
+        result = {}
+        now = time.monotonic()
+        for bot_type in list(self.health):
+            health = self.health[bot_type]
+            samples = list(health.samples)
+            costs = [cost for cost, _ in samples]
+            result[bot_type] = {
+                "calls": health.calls,
+                "errors": health.errors,
+                "timeouts": health.timeouts,
+                "wins": health.wins,
+                "error_rate": sum(1 for _, ok in samples if not ok) / len(samples) if samples else 0.0,
+                "p50": _percentile(costs, 0.5),
+                "p95": _percentile(costs, 0.95),
+                "degraded": health.open_until > now,
+            }
+        return result
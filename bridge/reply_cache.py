@@ -0,0 +1,265 @@
+"""
+对话回复缓存，按应用配置开启
+缓存键为(应用, 会话上下文摘要, 归一化后的问题)，分为两级：
+- 精确匹配：归一化后的问题完全相同
+- 相似匹配：问题的字符n-gram向量余弦相似度不低于配置的阈值，只在同一应用、同一上下文的缓存中查找
+有会话状态的应用默认不缓存，规则中配置context后才缓存：
+- none: 不区分会话，适合问答类应用
+- session: 键中包含当前会话历史的摘要，只有会话状态相同时才会命中
+"""
+
+import fnmatch
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common import const, memory
+from common.log import logger
+from config import conf
+
+# 没有会话状态的应用，同样的问题总是得到同样的回答
+STATELESS_APPS = ("dify:workflow",)
+
+_SPACES = re.compile(r"\s+")
+_CJK_SPACES = re.compile(r"\s*([^\x00-\x7f])\s*")  # 中文之间的空格没有意义
+_TRAILING = "?？!！。.~～ ,，"
+
+
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = _CJK_SPACES.sub(r"\1", _SPACES.sub(" ", text))
+    return text.strip().rstrip(_TRAILING)
+
+
+def _grams(text):
+    """字符二元组的词频，单字问题使用单字"""
+    if len(text) < 2:
+        return {text: 1} if text else {}
+    grams = {}
+    for i in range(len(text) - 1):
+        gram = text[i:i + 2]
+        grams[gram] = grams.get(gram, 0) + 1
+    return grams
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:16]
+
+
+class CacheKey(object):
+    __slots__ = ("app", "partition", "text", "rule")
+
+    def __init__(self, app, partition, text, rule):
+        self.app = app
+        self.partition = partition
+        self.text = text
+        self.rule = rule
+
+
+class _Entry(object):
+    __slots__ = ("content", "expire_at", "grams", "norm")
+
+    def __init__(self, content, expire_at, grams, norm):
+        self.content = content
+        self.expire_at = expire_at
+        self.grams = grams
+        self.norm = norm
+
+
+class _Partition(object):
+    """同一应用、同一上下文的缓存条目，按n-gram建倒排索引用于相似匹配"""
+
+    __slots__ = ("entries", "postings")
+
+    def __init__(self):
+        self.entries = {}  # 归一化的问题 -> _Entry
+        self.postings = {}  # n-gram -> 问题集合
+
+    def add(self, text, entry):
+        self.entries[text] = entry
+        for gram in entry.grams:
+            self.postings.setdefault(gram, set()).add(text)
+
+    def remove(self, text):
+        entry = self.entries.pop(text, None)
+        if entry is None:
+            return
+        for gram in entry.grams:
+            texts = self.postings.get(gram)
+            if texts is not None:
+                texts.discard(text)
+                if not texts:
+                    del self.postings[gram]
+
+    def nearest(self, grams, norm, threshold, now):
+        candidates = set()
+        for gram in grams:
+            candidates.update(self.postings.get(gram, ()))
+        best, best_score = None, threshold
+        for text in candidates:
+            entry = self.entries[text]
+            if entry.expire_at <= now:
+                continue
+            dot = sum(count * entry.grams.get(gram, 0) for gram, count in grams.items())
+            score = dot / (norm * entry.norm)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best, best_score
+
+
+class ReplyCache(object):
+    def __init__(self, rules: dict, ttl=3600, max_size=1000):
+        self.rules = rules or {}
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (分区, 问题) -> _Entry，按最近使用排序
+        self.partitions = {}
+        self.rule_cache = {}
+        self.lock = threading.Lock()
+        self.counters = {}  # 应用 -> [精确命中, 相似命中, 未命中, 写入]
+
+    def match_rule(self, app):
+        """返回应用对应的规则，未配置时返回None"""
+        if app not in self.rule_cache:
+            rule = self.rules.get(app)
+            if rule is None:
+                for pattern, value in self.rules.items():
+                    if fnmatch.fnmatchcase(app, pattern):
+                        rule = value
+                        break
+            self.rule_cache[app] = rule
+        return self.rule_cache[app]
+
+    def make_key(self, bot, bot_type, query, context: Context):
+        """
+        计算缓存键，不适合缓存时返回None
+        需在调用bot之前计算，会话上下文为提问前的状态
+        """
+        if context is None or context.type != ContextType.TEXT or not query:
+            return None
+        if query.startswith("#") or query.startswith(conf().get("plugin_trigger_prefix", "$")):
+            return None  # 指令
+        session_id = context.get("session_id")
+        if memory.USER_IMAGE_CACHE.get(session_id):
+            return None  # 本轮会带上图片识图
+        if bot_type == const.DIFY:
+            app = "dify:" + (getattr(bot, "current_app_type", None) or context.get("dify_app_type") or "")
+            secret = context.get("dify_api_key") or conf().get("dify_api_key", "")
+        else:
+            app = "{}:{}".format(bot_type, context.get("gpt_model") or conf().get("model") or "")
+            secret = ""
+        rule = self.match_rule(app)
+        if rule is None:
+            return None
+        mode = rule.get("context") or ("none" if app in STATELESS_APPS else None)
+        if mode == "none":
+            state = None
+        elif mode == "session":
+            state = self._session_state(bot, session_id)
+        else:
+            return None  # 有会话状态的应用未配置context，不缓存
+        text = normalize_query(query)
+        if not text:
+            return None
+        return CacheKey(app, (app, _digest(secret), _digest(state)), text, rule)
+
+    @staticmethod
+    def _session_state(bot, session_id):
+        sessions = getattr(getattr(bot, "sessions", None), "sessions", None)
+        if sessions is None or session_id not in sessions:
+            return None
+        session = sessions[session_id]
+        messages = getattr(session, "messages", None)
+        if messages is not None:
+            return messages
+        if hasattr(session, "get_conversation_id"):
+            return session.get_conversation_id()
+        return None
+
+    def get(self, key: CacheKey):
+        now = time.monotonic()
+        exact_key = (key.partition, key.text)
+        with self.lock:
+            entry = self.entries.get(exact_key)
+            if entry is not None and entry.expire_at > now:
+                self.entries.move_to_end(exact_key)
+                self._count(key.app, 0)
+                return Reply(ReplyType.TEXT, entry.content)
+            if entry is not None:
+                self._remove(exact_key)
+            threshold = key.rule.get("similarity", 0)
+            partition = self.partitions.get(key.partition)
+            if threshold and partition is not None:
+                grams = _grams(key.text)
+                norm = math.sqrt(sum(c * c for c in grams.values())) or 1.0
+                entry, score = partition.nearest(grams, norm, threshold, now)
+                if entry is not None:
+                    logger.debug("[ReplyCache] similar hit, app={}, score={:.2f}".format(key.app, score))
+                    self._count(key.app, 1)
+                    return Reply(ReplyType.TEXT, entry.content)
+            self._count(key.app, 2)
+        return None
+
+    def put(self, key: CacheKey, reply: Reply, context: Context = None):
+        """只缓存正常的文本回复"""
+        if reply is None or reply.type != ReplyType.TEXT or not reply.content:
+            return
+        if context is not None and context.get("no_reply_cache"):
+            return
+        grams = _grams(key.text)
+        norm = math.sqrt(sum(c * c for c in grams.values())) or 1.0
+        entry = _Entry(reply.content, time.monotonic() + key.rule.get("ttl", self.ttl), grams, norm)
+        exact_key = (key.partition, key.text)
+        with self.lock:
+            self._remove(exact_key)
+            self.entries[exact_key] = entry
+            partition = self.partitions.get(key.partition)
+            if partition is None:
+                partition = self.partitions[key.partition] = _Partition()
+            partition.add(key.text, entry)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+            self._count(key.app, 3)
+
+    def _remove(self, exact_key):
+        """需持有锁"""
+        if self.entries.pop(exact_key, None) is None:
+            return
+        partition_key, text = exact_key
+        partition = self.partitions.get(partition_key)
+        if partition is not None:
+            partition.remove(text)
+            if not partition.entries:
+                del self.partitions[partition_key]
+
+    def _count(self, app, index):
+        counters = self.counters.get(app)
+        if counters is None:
+            counters = self.counters[app] = [0, 0, 0, 0]
+        counters[index] += 1
+
+    def stats(self):
+        """每个应用的命中率"""
+        with self.lock:
+            result = {"size": len(self.entries), "apps": {}}
+            for app, (hits, similar, misses, stores) in self.counters.items():
+                total = hits + similar + misses
+                result["apps"][app] = {
+                    "hits": hits,
+                    "similar_hits": similar,
+                    "misses": misses,
+                    "stores": stores,
+                    "hit_rate": (hits + similar) / total if total else 0.0,
+                }
+            return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.partitions.clear()
@@ -3,25 +3,39 @@ import re
 import threading
 import time
 from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import Future
 import requests
 import json
 import uuid
 
 from bridge.context import *
 from bridge.reply import *
+from bot.stream import StreamNotStarted
 from channel.channel import Channel
-from common.dequeue import Dequeue
-from common import memory
+from common.burst_coalescer import BurstCoalescer
+from common.deadline import Deadline, DeadlineExceeded, current_deadline, deadline_timeout
+from common.session_registry import SessionRegistry
+from common.fair_scheduler import FairScheduler, OVERFLOW_DROP_OLDEST, PRIORITY_ADMIN, PRIORITY_GROUP, PRIORITY_PRIVATE
+from common.paragraph_chunker import ParagraphChunker
+from common.handler_pool import HandlerPools, WORKLOAD_LLM, WORKLOAD_MEDIA, WORKLOAD_PLUGIN, WORKLOAD_VOICE
+from common import memory, startup_profiler
+from common.tmp_cleaner import acquire_tmp_file, register_tmp_file, release_tmp_file
 from plugins import *
+from config import conf_snapshot
 from database.group_members_db import get_group_member_from_db, save_group_members_to_db
 
-try:
-    from voice.audio_convert import any_to_wav
-except Exception as e:
-    pass
+handler_pools = HandlerPools()  # 处理消息的线程池，按负载类型分为llm/media/voice/plugin
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+_CONTEXT_FILE_TYPES = (ContextType.IMAGE, ContextType.VOICE, ContextType.FILE, ContextType.VIDEO)
+_REPLY_FILE_TYPES = (ReplyType.VOICE, ReplyType.IMAGE, ReplyType.FILE, ReplyType.VIDEO)
+_TMP_DIR = os.path.abspath("./tmp")
+
+
+def _local_file(msg_type, content, file_types):
+    """content为tmp目录下的文件时返回其路径"""
+    if msg_type in file_types and isinstance(content, str) and os.path.abspath(content).startswith(_TMP_DIR + os.sep):
+        return content
+    return None
 
 def get_group_member_display_name(group_id, wxid, bot_wxid=None, api_base_url=None):
     """
@@ -93,7 +107,7 @@ def download_image_to_tmp(url):
     filename = f"{uuid.uuid4().hex}{ext}"
     save_path = os.path.join(tmp_dir, filename)
     try:
-        resp = requests.get(url, timeout=10)
+        resp = requests.get(url, timeout=deadline_timeout(10))
         resp.raise_for_status()
         with open(save_path, "wb") as f:
             f.write(resp.content)
@@ -106,11 +120,34 @@ def download_image_to_tmp(url):
 class ChatChannel(Channel):
     name = None  # 登录的用户名
     user_id = None  # 登录的用户id
-    futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
-    sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
-    lock = threading.Lock()  # 用于控制对sessions的访问
 
     def __init__(self):
+        # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉
+        # 正在执行的消息登记其截止时间，重置会话时取消，进行中的请求在下一个检查点中止
+        self.registry = SessionRegistry()
+        # 跨会话的公平调度器，负责会话内并发控制、优先级和队列长度限制
+        self.scheduler = FairScheduler(
+            weights={
+                PRIORITY_PRIVATE: conf().get("private_chat_weight", 2),
+                PRIORITY_GROUP: conf().get("group_chat_weight", 1),
+            },
+            session_max_running=conf().get("concurrency_in_session", 4),
+            group_max_running=conf().get("concurrency_in_group", 0),
+            session_max_queued=conf().get("session_queue_max_size", 0),
+            max_queued=conf().get("queue_max_size", 0),
+            overflow_policy=conf().get("queue_overflow_policy", OVERFLOW_DROP_OLDEST),
+            merge_func=self._merge_context,
+        )
+        # 连续消息合并，窗口为0时不启用
+        self.coalescer = None
+        burst_window = conf().get("burst_merge_window", 0)
+        if burst_window and burst_window > 0:
+            self.coalescer = BurstCoalescer(
+                window=burst_window,
+                max_wait=conf().get("burst_merge_max_wait", 5),
+                merge_func=self._merge_context,
+                flush_func=self._enqueue,
+            )
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
@@ -131,11 +168,14 @@ class ChatChannel(Channel):
         # origin_ctype用于第二步文本回复时，判断是否需要匹配前缀，如果是私聊的语音，就不需要匹配前缀
         if "origin_ctype" not in context:
             context["origin_ctype"] = ctype
+        # 整个消息处理过程使用同一份配置快照，处理中重载配置不会读到不一致的配置
+        if "conf" not in context:
+            context["conf"] = conf_snapshot()
+        snapshot = context["conf"]
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -145,24 +185,14 @@ class ChatChannel(Channel):
                 group_id = cmsg.other_user_id
                 context["group_name"] = group_name
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
+                if (
+                        snapshot.all_group_white_listed
+                        or group_name in snapshot.group_name_white_list
+                        or check_contain(group_name, snapshot.group_name_keyword_white_list)
                 ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
                     session_id = f"{cmsg.actual_user_id}@@{group_id}" # 当群聊未共享session时，session_id为user_id与group_id的组合，用于区分不同群聊以及单聊
                     context["is_shared_session_group"] = False  # 默认为非共享会话群
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if snapshot.all_group_in_one_session or group_name in snapshot.group_chat_in_one_session:
                         session_id = group_id
                         context["is_shared_session_group"] = True  # 如果是共享会话群，设置为True
                 else:
@@ -177,20 +207,20 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not snapshot.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
         # 消息内容匹配过程，并处理content
         if ctype == ContextType.TEXT:
-            nick_name_black_list = conf().get("nick_name_black_list", [])
+            nick_name_black_list = snapshot.nick_name_black_list
             if context.get("isgroup", False):  # 群聊
                 # wxpad/gewe风格：实际发言人是自己，直接 return None
                 if context["msg"].actual_user_id == self.user_id or context["msg"].from_user_id == self.user_id:
                     logger.debug(f"[chat_channel] skip self message in group: actual_user_id={context['msg'].actual_user_id}, self_user_id={self.user_id}")
                     return None
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = check_prefix(content, snapshot.group_chat_prefix)
+                match_contain = check_contain(content, snapshot.group_chat_keyword)
                 logger.debug(f"[chat_channel] group check: content={content}, match_prefix={match_prefix}, match_contain={match_contain}, is_at={context['msg'].is_at}")
                 flag = False
                 if match_prefix is not None or match_contain is not None:
@@ -199,12 +229,11 @@ class ChatChannel(Channel):
                         content = content.replace(match_prefix, "", 1).strip()
                 if context["msg"].is_at:
                     nick_name = context["msg"].actual_user_nickname
-                    nick_name_black_list = conf().get("nick_name_black_list", [])
                     if nick_name and nick_name in nick_name_black_list:
                         logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                         return None
                     logger.info("[chat_channel]receive group at")
-                    if not conf().get("group_at_off", False):
+                    if not snapshot.group_at_off:
                         flag = True
                     self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
                     pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
@@ -232,7 +261,7 @@ class ChatChannel(Channel):
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = check_prefix(content, snapshot.single_chat_prefix)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif self.channel_type == 'wechatcom_app':
@@ -243,19 +272,17 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = check_prefix(content, snapshot.image_create_prefix)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
-                    "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and snapshot.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
-                    "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and snapshot.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         else:
             # 为有价值的消息类型提供直接触发机制（非TEXT类型）
@@ -275,17 +302,54 @@ class ChatChannel(Channel):
         if context is None or not context.content:
             return
         logger.debug("[chat_channel] ready to handle context: {}".format(context))
-        # reply的构建步骤
-        reply = self._generate_reply(context)
-
-        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+        deadline = context.get("deadline") or Deadline()
+        if deadline.done():
+            logger.warning("[chat_channel] context {} before handling, skip: {}".format(deadline.reason, context.content))
+            return
+        session_id = context.get("session_id")
+        self.registry.add(session_id, deadline)
+        # 处理期间持有消息附带的临时文件，避免被清理
+        tmp_file = _local_file(context.type, context.content, _CONTEXT_FILE_TYPES)
+        if tmp_file:
+            acquire_tmp_file(tmp_file, owner=session_id)
+        try:
+            with deadline.activate():
+                # reply的构建步骤
+                reply = self._generate_reply(context)
 
-        # reply的包装步骤
-        if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
+                logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
 
-            # reply的发送步骤
-            self._send_reply(context, reply)
+                # reply的包装步骤
+                if reply and reply.content:
+                    if deadline.done():
+                        logger.warning("[chat_channel] reply {}, discard: {}".format(deadline.reason, reply))
+                        return
+                    reply = self._decorate_reply(context, reply)
+
+                    # reply的发送步骤
+                    self._send_reply(context, reply)
+        except DeadlineExceeded as e:
+            logger.warning("[chat_channel] context aborted ({}): {}".format(e, context.content))
+        finally:
+            self.registry.remove(session_id, deadline)
+            if tmp_file:
+                release_tmp_file(tmp_file)
+
+    def _select_workload(self, context: Context) -> str:
+        """
+        根据context类型选择处理线程池，插件可在ON_RECEIVE_MESSAGE中设置context["workload"]指定
+        """
+        workload = context.get("workload")
+        if workload:
+            return workload
+        if context.type == ContextType.VOICE:
+            return WORKLOAD_VOICE
+        if context.type in [ContextType.IMAGE, ContextType.VIDEO, ContextType.FILE, ContextType.IMAGE_CREATE]:
+            return WORKLOAD_MEDIA
+        if context.type == ContextType.TEXT and isinstance(context.content, str):
+            if context.content.startswith("#") or context.content.startswith(conf_snapshot().plugin_trigger_prefix):
+                return WORKLOAD_PLUGIN
+        return WORKLOAD_LLM
 
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         # 插件优先处理
@@ -306,15 +370,14 @@ class ChatChannel(Channel):
             # 获取原始内容（未去除前缀的内容）
             raw_content = context["msg"].content if hasattr(context["msg"], "content") else context.content
             # 检查是否是插件命令
-            plugin_prefix = conf().get("plugin_trigger_prefix", "$")
-            is_plugin_command = raw_content.startswith(plugin_prefix)
+            snapshot = context.get("conf") or conf_snapshot()
+            is_plugin_command = raw_content.startswith(snapshot.plugin_trigger_prefix)
             # 检查是否有群聊前缀
-            group_prefixes = conf().get("group_chat_prefix", ["@bot"])
-            has_group_prefix = any(raw_content.startswith(prefix) for prefix in group_prefixes if prefix)
+            has_group_prefix = any(raw_content.startswith(prefix) for prefix in snapshot.group_chat_prefix if prefix)
             # 检查是否被@
             is_at = hasattr(context["msg"], "is_at") and context["msg"].is_at
             # 检查是否包含关键词
-            has_keyword = check_contain(raw_content, conf().get("group_chat_keyword", []))
+            has_keyword = check_contain(raw_content, snapshot.group_chat_keyword)
             # 检查是否是有价值的消息类型（这些类型可以无前缀触发）
             valuable_types = [ContextType.SHARING, ContextType.FILE, ContextType.VIDEO, ContextType.IMAGE]
             is_valuable_type = context.type in valuable_types
@@ -330,7 +393,11 @@ class ChatChannel(Channel):
             logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
-                reply = super().build_reply_content(context.content, context)
+                reply = None
+                if context.type == ContextType.TEXT and self._should_stream(context):
+                    reply = self._build_stream_reply(context)
+                if reply is None:
+                    reply = super().build_reply_content(context.content, context)
             elif context.type == ContextType.VOICE:  # 语音消息
                 cmsg = context["msg"]
                 cmsg.prepare()
@@ -346,6 +413,7 @@ class ChatChannel(Channel):
                 
                 wav_path = os.path.splitext(file_path)[0] + ".wav"
                 try:
+                    from voice.audio_convert import any_to_wav
                     any_to_wav(file_path, wav_path)
                 except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
                     logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
@@ -386,6 +454,61 @@ class ChatChannel(Channel):
                 return
         return reply
 
+    def _should_stream(self, context: Context) -> bool:
+        if not conf().get("stream_reply", False):
+            return False
+        # 语音回复需要完整的文本再合成
+        return context.get("desire_rtype") != ReplyType.VOICE
+
+    def _build_stream_reply(self, context: Context):
+        """
+        流式生成回复，每完成一段就发送出去，返回最后一段作为回复走正常的包装和发送
+        bot不支持流式时返回None，改用普通请求
+        """
+        stream = super().build_reply_stream(context.content, context)
+        if stream is None or isinstance(stream, Reply):
+            return stream
+        chunker = ParagraphChunker(conf().get("stream_reply_min_chars", 80), conf().get("stream_reply_max_chars", 600))
+        sent = 0
+        pending = None  # 最近完成的一段，收到下一段或流结束后才发送，保证最后一段带后缀
+        deadline = context.get("deadline")
+        try:
+            for delta in stream:
+                if deadline is not None:
+                    deadline.check()
+                for chunk in chunker.feed(delta):
+                    if pending is not None:
+                        # 只有第一段带@和前缀，只有最后一段带后缀
+                        context["stream_part"] = (sent == 0, False)
+                        self._send_reply(context, self._decorate_reply(context, Reply(ReplyType.TEXT, pending)))
+                        sent += 1
+                    pending = chunk
+        except StreamNotStarted as e:
+            if deadline is not None and deadline.done():
+                raise DeadlineExceeded(deadline.reason) from e
+            logger.warning("[chat_channel] reply stream failed, fallback to normal reply: {}".format(e))
+            return None
+        except DeadlineExceeded:
+            if hasattr(stream, "close"):
+                stream.close()  # 结束生成器，关闭进行中的流式响应并撤回本轮提问
+            raise
+        except Exception as e:
+            if deadline is not None and deadline.done():
+                raise DeadlineExceeded(deadline.reason) from e
+            logger.error("[chat_channel] reply stream interrupted: {}".format(e))
+            if not sent and pending is None and not chunker.buffer:
+                return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+        tail = chunker.flush()
+        if pending is not None and tail:
+            context["stream_part"] = (sent == 0, False)
+            self._send_reply(context, self._decorate_reply(context, Reply(ReplyType.TEXT, pending)))
+            sent += 1
+        elif pending is not None:
+            tail = pending
+        context["stream_part"] = (sent == 0, True)
+        logger.debug("[chat_channel] reply stream finished, {} parts sent".format(sent))
+        return Reply(ReplyType.TEXT, tail)
+
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -396,6 +519,7 @@ class ChatChannel(Channel):
             )
             reply = e_context["reply"]
             desire_rtype = context.get("desire_rtype")
+            snapshot = context.get("conf") or conf_snapshot()
             if not e_context.is_pass() and reply and reply.type:
                 if reply.type in self.NOT_SUPPORT_REPLYTYPE:
                     logger.error("[chat_channel]reply type not support: " + str(reply.type))
@@ -417,8 +541,9 @@ class ChatChannel(Channel):
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
+                    first_part, last_part = context.get("stream_part") or (True, True)
                     if context.get("isgroup", False):
-                        if not conf().get("no_need_at", False):
+                        if not snapshot.no_need_at and first_part:
                             # 新增：自动查群成员接口/缓存获取@名称
                             at_name = None
                             try:
@@ -430,11 +555,10 @@ class ChatChannel(Channel):
                             if not at_name:
                                 at_name = context["msg"].actual_user_nickname or context["msg"].from_user_nickname or "群成员"
                             reply_text = f"@{at_name}\n" + reply_text.strip()
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + conf().get(
-                            "group_chat_reply_suffix", "")
+                        prefix, suffix = snapshot.group_chat_reply_prefix, snapshot.group_chat_reply_suffix
                     else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get(
-                            "single_chat_reply_suffix", "")
+                        prefix, suffix = snapshot.single_chat_reply_prefix, snapshot.single_chat_reply_suffix
+                    reply_text = (prefix if first_part else "") + reply_text + (suffix if last_part else "")
                     reply.content = reply_text
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
@@ -465,6 +589,10 @@ class ChatChannel(Channel):
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
         try:
             self.send(reply, context)
+            # 发送完成的语音、图片等文件交给临时文件清理器，到期后删除
+            reply_file = _local_file(reply.type, reply.content, _REPLY_FILE_TYPES)
+            if reply_file and os.path.exists(reply_file):
+                register_tmp_file(reply_file, owner=context.get("session_id"))
         except Exception as e:
             logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
             if isinstance(e, NotImplementedError):
@@ -478,7 +606,7 @@ class ChatChannel(Channel):
     def _build_friend_request_reply(self, context):
         if isinstance(context.content, dict) and "Content" in context.content:
             logger.info("friend request content: {}".format(context.content["Content"]))
-            if context.content["Content"] in conf().get("accept_friend_commands", []):
+            if context.content["Content"] in conf_snapshot().accept_friend_commands:
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=True)
             else:
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=False)
@@ -504,71 +632,92 @@ class ChatChannel(Channel):
                 logger.info("Worker cancelled, session_id = {}".format(session_id))
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
-            with self.lock:
-                self.sessions[session_id][1].release()
+            self.registry.remove(session_id, worker)
+            self.scheduler.done(session_id)
 
         return func
 
+    def _merge_context(self, old: Context, new: Context):
+        """合并同一会话的连续文本消息，用于连续消息合并和队列溢出时的merge策略，无法合并时返回None"""
+        if old.type != ContextType.TEXT or new.type != ContextType.TEXT:
+            return None
+        if not self._is_mergeable(old) or not self._is_mergeable(new):
+            return None  # 管理员指令和插件指令不合并
+        old.content = old.content + "\n" + new.content
+        return old
+
+    def _is_mergeable(self, context: Context) -> bool:
+        """只合并普通文本消息，管理员指令和插件指令需要单独处理"""
+        if context.type != ContextType.TEXT or not isinstance(context.content, str):
+            return False
+        if context.content.startswith("#") or context.content.startswith(conf_snapshot().plugin_trigger_prefix):
+            return False
+        return True
+
+    def _burst_key(self, context: Context):
+        # 共享会话的群里不同成员的消息不能合并，因此同时以发送者区分
+        cmsg = context.get("msg")
+        sender = getattr(cmsg, "actual_user_id", None) or getattr(cmsg, "from_user_id", None)
+        return context.get("session_id", 0), sender
+
     def produce(self, context: Context):
+        startup_profiler.on_message()
+        if context.get("deadline") is None:
+            # 消息的截止时间从收到时开始计算，包括排队等待的时间
+            context["deadline"] = Deadline(conf().get("reply_deadline", 0) or None)
+        if self.coalescer is None:
+            return self._enqueue(context)
+        key = self._burst_key(context)
+        if self._is_mergeable(context):
+            self.coalescer.put(key, context)
+        else:
+            # 先处理缓存中的消息，保证消息顺序
+            self.coalescer.flush(key)
+            self._enqueue(context)
+
+    def _enqueue(self, context: Context):
         session_id = context.get("session_id", 0)
-        with self.lock:
-            if session_id not in self.sessions:
-                self.sessions[session_id] = [
-                    Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
-                ]
-            if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
-            else:
-                self.sessions[session_id][0].put(context)
+        # 群id与优先级无关，会话由管理命令创建时也要按群会话归类，受群并发上限约束
+        group_id = context.get("receiver") if context.get("isgroup", False) else None
+        if context.type == ContextType.TEXT and context.content.startswith("#"):
+            priority = PRIORITY_ADMIN  # 优先处理管理命令
+        elif group_id:
+            priority = PRIORITY_GROUP
+        else:
+            priority = PRIORITY_PRIVATE
+        dropped = self.scheduler.put(session_id, context, priority=priority, group_id=group_id)
+        if dropped is not None:
+            logger.warning("[chat_channel] session {} queue full, drop context: {}".format(session_id, dropped))
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，按公平调度器给出的顺序从消息队列中取出消息并处理
     def consume(self):
         while True:
-            with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+            session_id, future = None, None
+            try:
+                session_id, context = self.scheduler.get()
+                logger.debug("[chat_channel] consume context: {}".format(context))
+                future: Future = handler_pools.submit(self._select_workload(context), self._handle, context)
+                self.registry.add(session_id, future)
+                future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+            except Exception as e:
+                # 消费线程只有一个，不能因为单条消息的异常退出
+                logger.exception("[chat_channel] consume error: {}".format(e))
+                if session_id is not None and future is None:
+                    self.scheduler.done(session_id)  # 未能提交的消息释放会话的执行名额
 
-    # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
+    # 取消session_id对应的所有任务，排队的消息直接丢弃，正在执行的消息通过截止时间取消
     def cancel_session(self, session_id):
-        with self.lock:
-            if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+        # 不取消发起取消的指令自身
+        self.registry.cancel(session_id, exclude=current_deadline())
+        cnt = self.scheduler.cancel(session_id)
+        if cnt > 0:
+            logger.info("Cancel {} messages in session {}".format(cnt, session_id))
 
     def cancel_all_session(self):
-        with self.lock:
-            for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+        self.registry.cancel_all(exclude=current_deadline())
+        for session_id, cnt in self.scheduler.cancel_all().items():
+            if cnt > 0:
+                logger.info("Cancel {} messages in session {}".format(cnt, session_id))
 
 
 def check_prefix(content, prefix_list):
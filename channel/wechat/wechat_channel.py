@@ -184,7 +184,8 @@ class WechatChannel(ChatChannel):
             time.sleep(2)
             self.auto_login_times += 1
             if self.auto_login_times < 3:
-                chat_channel.handler_pool._shutdown = False
+                for executor in chat_channel.handler_pools.executors():
+                    executor._shutdown = False
                 self.startup()
         except Exception as e:
             pass
@@ -1,35 +1,26 @@
 import os
 import time
 import json
+import logging
 import threading
 import uuid
 import base64
 import requests
-import tempfile
-import urllib.request
-from pydub import AudioSegment
 from io import BytesIO
-import pysilk
-import subprocess
-from PIL import Image
 import io
-import qrcode
 import sys
-import websocket
 import urllib.parse
-import mimetypes
-import shutil
 
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, get_group_member_display_name
 from channel.wxpad.wxpad_message import WechatPadProMessage as WxpadMessage
-from common.log import logger
+from common.log import logger, truncate
 from common.singleton import singleton
 from common.tmp_dir import TmpDir
-from config import conf, save_config
+from common.image_prep import prepare_image
+from config import conf, conf_snapshot, save_config
 from lib.wxpad.client import WxpadClient
-from voice.audio_convert import mp3_to_silk
 
 MAX_UTF8_LEN = 2048
 ROBOT_STAT_PATH = os.path.join(os.path.dirname(__file__), '../../resource/robot_stat.json')
@@ -457,6 +448,7 @@ class WxpadChannel(ChatChannel):
             logger.info(f"[wxpad] 连接WebSocket: {ws_url}")
 
             # 创建WebSocket连接
+            import websocket
             self.ws = websocket.WebSocketApp(
                 ws_url,
                 on_open=self._on_ws_open,
@@ -481,7 +473,7 @@ class WxpadChannel(ChatChannel):
     def _on_ws_message(self, ws, message):
         """WebSocket消息接收回调"""
         try:
-            logger.debug(f"[wxpad] 收到WebSocket消息: {message}")
+            logger.debug("[wxpad] 收到WebSocket消息: %s", message)
 
             # 解析消息
             data = json.loads(message)
@@ -496,10 +488,10 @@ class WxpadChannel(ChatChannel):
                     # 简化显示信息，不调用API获取昵称
                     if "@chatroom" in from_user:
                         # 群聊消息 - 只显示ID，避免重复API调用
-                        logger.info(f"[wxpad] 处理WebSocket消息: from={from_user}, type={msg_type}")
+                        logger.info("[wxpad] 处理WebSocket消息: from=%s, type=%s", from_user, msg_type)
                     else:
                         # 私聊消息 - 只显示ID，避免重复API调用
-                        logger.info(f"[wxpad] 处理WebSocket消息: from={from_user}, type={msg_type}")
+                        logger.info("[wxpad] 处理WebSocket消息: from=%s, type=%s", from_user, msg_type)
 
                     # 转换并处理消息
                     standard_msg = self._convert_message(data)
@@ -508,7 +500,7 @@ class WxpadChannel(ChatChannel):
                     logger.error(f"[wxpad] 处理WebSocket消息异常: {e}")
             elif isinstance(data, list):
                 # 多条消息处理
-                logger.info(f"[wxpad] 收到 {len(data)} 条WebSocket消息")
+                logger.info("[wxpad] 收到 %d 条WebSocket消息", len(data))
                 for i, msg in enumerate(data):
                     try:
                         from_user = self._extract_str(msg.get('from_user_name', {}))
@@ -517,10 +509,10 @@ class WxpadChannel(ChatChannel):
                         # 简化显示信息，不调用API获取昵称
                         if "@chatroom" in from_user:
                             # 群聊消息 - 只显示ID，避免重复API调用
-                            logger.info(f"[wxpad] 处理消息 {i+1}: from={from_user}, type={msg_type}")
+                            logger.info("[wxpad] 处理消息 %d: from=%s, type=%s", i + 1, from_user, msg_type)
                         else:
                             # 私聊消息 - 只显示ID，避免重复API调用
-                            logger.info(f"[wxpad] 处理消息 {i+1}: from={from_user}, type={msg_type}")
+                            logger.info("[wxpad] 处理消息 %d: from=%s, type=%s", i + 1, from_user, msg_type)
 
                         # 转换并处理消息
                         standard_msg = self._convert_message(msg)
@@ -576,23 +568,23 @@ class WxpadChannel(ChatChannel):
                 current_time = int(time.time())
                 msg_time = int(xmsg.create_time)
                 if msg_time < current_time - 60 * 5:  # 5分钟过期
-                    logger.debug(f"[wxpad] ignore expired message from {xmsg.from_user_id}")
+                    logger.debug("[wxpad] ignore expired message from %s", xmsg.from_user_id)
                     return True
             except (ValueError, TypeError):
                 pass  # 时间格式无效时继续处理
 
         # 2. 非用户消息过滤
         if xmsg._is_non_user_message(xmsg.msg_source, xmsg.from_user_id):
-            logger.debug(f"[wxpad] ignore non-user/system message from {xmsg.from_user_id}")
+            logger.debug("[wxpad] ignore non-user/system message from %s", xmsg.from_user_id)
             return True
 
         # 3. 自己发送的消息过滤
         if hasattr(xmsg, 'from_user_id') and xmsg.from_user_id == self.wxid:
-            logger.debug(f"[wxpad] ignore message from myself: {xmsg.from_user_id}")
+            logger.debug("[wxpad] ignore message from myself: %s", xmsg.from_user_id)
             return True
 
         # 4. 语音消息配置检查
-        if xmsg.ctype == ContextType.VOICE and not conf().get("speech_recognition", False):
+        if xmsg.ctype == ContextType.VOICE and not conf_snapshot().speech_recognition:
             logger.debug(f"[wxpad] ignore voice message, speech_recognition disabled")
             return True
 
@@ -604,27 +596,28 @@ class WxpadChannel(ChatChannel):
         # 统一过滤检查
         if self._should_ignore_message(xmsg):
             # 简化过滤日志显示，避免重复API调用
-            logger.debug(f"[wxpad] 消息被过滤: from={xmsg.from_user_id}, reason=过滤规则")
+            logger.debug("[wxpad] 消息被过滤: from=%s, reason=过滤规则", xmsg.from_user_id)
             return
 
-        # 格式化有效消息日志显示
-        if xmsg.is_group:
-            # 直接使用消息对象中已获取的群名称，避免重复调用API
-            group_name = getattr(xmsg, 'other_user_nickname', None)  # 对于群聊，other_user_nickname就是群名称
-            group_info = _format_group_info(xmsg.from_user_id, self.client, group_name)
-
-            # 获取实际发言人信息（如果有的话）
-            actual_user_info = ""
-            if hasattr(xmsg, 'actual_user_id') and xmsg.actual_user_id and xmsg.actual_user_id != xmsg.from_user_id:
+        # 格式化有效消息日志显示，INFO级别关闭时不查询昵称
+        if logger.isEnabledFor(logging.INFO):
+            if xmsg.is_group:
+                # 直接使用消息对象中已获取的群名称，避免重复调用API
+                group_name = getattr(xmsg, 'other_user_nickname', None)  # 对于群聊，other_user_nickname就是群名称
+                group_info = _format_group_info(xmsg.from_user_id, self.client, group_name)
+
+                # 获取实际发言人信息（如果有的话）
+                actual_user_info = ""
+                if hasattr(xmsg, 'actual_user_id') and xmsg.actual_user_id and xmsg.actual_user_id != xmsg.from_user_id:
+                    # 直接使用消息对象中已获取的昵称，避免重复调用API
+                    actual_nickname = getattr(xmsg, 'actual_user_nickname', None)
+                    actual_user_info = f" 发言人: {_format_user_info(xmsg.actual_user_id, self.client, xmsg.from_user_id, actual_nickname)}"
+                logger.info("[wxpad] 📨 %s%s: %s", group_info, actual_user_info, truncate(xmsg.content))
+            else:
                 # 直接使用消息对象中已获取的昵称，避免重复调用API
-                actual_nickname = getattr(xmsg, 'actual_user_nickname', None)
-                actual_user_info = f" 发言人: {_format_user_info(xmsg.actual_user_id, self.client, xmsg.from_user_id, actual_nickname)}"
-            logger.info(f"[wxpad] 📨 {group_info}{actual_user_info}: {xmsg.content[:50] if xmsg.content else 'None'}")
-        else:
-            # 直接使用消息对象中已获取的昵称，避免重复调用API
-            user_nickname = getattr(xmsg, 'other_user_nickname', None)
-            user_info = _format_user_info(xmsg.from_user_id, self.client, None, user_nickname)
-            logger.info(f"[wxpad] 💬 {user_info}: {xmsg.content[:50] if xmsg.content else 'None'}")
+                user_nickname = getattr(xmsg, 'other_user_nickname', None)
+                user_info = _format_user_info(xmsg.from_user_id, self.client, None, user_nickname)
+                logger.info("[wxpad] 💬 %s: %s", user_info, truncate(xmsg.content))
 
         # 如果是图片、视频、文件、语音消息，需要立即处理下载（这些是主要内容）
         if xmsg.ctype == ContextType.IMAGE:
@@ -707,7 +700,7 @@ class WxpadChannel(ChatChannel):
                 # 如果获取失败，使用简化显示
                 receiver_info = f"{receiver}"
 
-        logger.debug(f"[wxpad] Sending {reply.type} to {receiver_info}")
+        logger.debug("[wxpad] Sending %s to %s", reply.type, receiver_info)
 
         try:
             if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
@@ -721,7 +714,7 @@ class WxpadChannel(ChatChannel):
                 }]
                 result = self.client.send_text_message(msg_item)
                 if result.get("Code") == 200:
-                    logger.info(f"[wxpad] ✅ 发送文本消息到 {receiver_info}: {reply.content[:50]}...")
+                    logger.info("[wxpad] ✅ 发送文本消息到 %s: %s", receiver_info, truncate(reply.content))
                 else:
                     logger.error(f"[wxpad] ❌ 发送文本消息失败到 {receiver_info}: {result}")
                     raise Exception(f"发送文本消息失败: {result}")
@@ -1447,24 +1440,9 @@ class WxpadChannel(ChatChannel):
                         logger.error(f"[send_image] 本地图片文件不存在 {image_data}")
                         return False
 
-                    # 预处理图片：确保格式兼容
+                    # 预处理图片：重新编码为JPEG确保格式兼容，同一张图片重复发送时直接使用缓存
                     try:
-                        from PIL import Image
-                        import io
-
-                        # 用PIL重新处理图片
-                        img = Image.open(image_data)
-
-                        # 转换为RGB模式（确保兼容性）
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-
-                        # 重新编码为JPEG格式（确保兼容性）
-                        output = io.BytesIO()
-                        img.save(output, format='JPEG', quality=85, optimize=True)
-                        processed_bytes = output.getvalue()
-
-                        image_base64 = base64.b64encode(processed_bytes).decode('utf-8')
+                        image_base64 = prepare_image(image_data, image_format="JPEG", quality=85, reencode=True).base64
 
                     except Exception as e:
                         # 如果格式转换失败，使用原始数据
@@ -1492,6 +1470,7 @@ class WxpadChannel(ChatChannel):
 
             elif hasattr(image_data, 'save') and hasattr(image_data, 'format'):
                 # PIL.Image对象 - 转换为BytesIO后再转base64
+                from PIL import Image
                 img_format = image_data.format or 'JPEG'
                 if img_format.upper() == 'JPEG' and image_data.mode in ('RGBA', 'LA', 'P'):
                     # JPEG不支持透明度，转换为RGB
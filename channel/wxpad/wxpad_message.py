@@ -5,6 +5,7 @@ from bridge.context import ContextType
 from channel.chat_message import ChatMessage
 from common.log import logger
 from common.tmp_dir import TmpDir
+from common.tmp_cleaner import register_tmp_file
 from config import conf
 from lib.wxpad.client import WxpadClient
 import requests
@@ -521,6 +522,7 @@ class WechatPadProMessage(ChatMessage):
                             os.remove(silk_file_path)  # 删除临时SILK文件
                             # 直接将self.content更新为MP3文件路径
                             self.content = mp3_file_path
+                            register_tmp_file(self.content)
                             logger.info(f"[wxpad] 语音处理完成: {mp3_file_path}, 时长: {target_duration}秒")
                         else:
                             logger.warning(f"[wxpad] MP3转换失败，使用SILK文件: {silk_file_path}")
@@ -702,7 +704,8 @@ class WechatPadProMessage(ChatMessage):
 
             with open(self.content, 'wb') as f:
                 f.write(image_bytes)
-            
+            register_tmp_file(self.content)
+
             return True
 
         except Exception as e:
@@ -782,6 +785,7 @@ class WechatPadProMessage(ChatMessage):
                         os.makedirs(os.path.dirname(self.content), exist_ok=True)
                         with open(self.content, 'wb') as f:
                             f.write(base64.b64decode(video_data))
+                        register_tmp_file(self.content)
                         logger.info(f"[wxpad] 视频下载成功: {self.content}")
                     except Exception as e:
                         logger.error(f"[wxpad] 保存视频失败: {e}")
@@ -836,6 +840,7 @@ class WechatPadProMessage(ChatMessage):
                         os.makedirs(os.path.dirname(self.content), exist_ok=True)
                         with open(self.content, 'wb') as f:
                             f.write(base64.b64decode(file_data))
+                        register_tmp_file(self.content)
                         logger.info(f"[wxpad] 文件下载成功: {self.content} ({file_info.get('title')})")
                     except Exception as e:
                         logger.error(f"[wxpad] 保存文件失败: {e}", exc_info=True)
@@ -1061,6 +1066,7 @@ class WechatPadProMessage(ChatMessage):
                     "file_info": refer_file_info,
                     "type": "file"  # 标记为文件类型
                 }
+                register_tmp_file(file_path, owner=session_id)
                 
                 logger.info(f"[wxpad] 引用文件已加入缓存: session_id={session_id}, file={refer_file_info.get('title')}")
             
@@ -0,0 +1,88 @@
+"""
+连续消息合并
+用户常常连续发送多条短消息，在一个短暂的窗口内把同一key的消息缓存起来，窗口结束后合并为一条再处理，
+从而减少模型调用次数和回复条数。所有key共用一个后台线程按到期时间触发
+"""
+
+import heapq
+import threading
+from time import monotonic as time
+
+from common.log import logger
+
+
+class BurstCoalescer:
+    def __init__(self, window, max_wait, merge_func, flush_func):
+        """
+        :param window: 等待后续消息的窗口，单位秒，每收到一条新消息窗口重新计时
+        :param max_wait: 从第一条消息开始最多等待的时间，单位秒
+        :param merge_func: merge_func(old_item, new_item)，返回合并后的item
+        :param flush_func: flush_func(item)，窗口结束后处理合并后的item
+        """
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.merge_func = merge_func
+        self.flush_func = flush_func
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.pending = {}  # key -> [item, first_time, deadline]
+        self.deadlines = []  # (deadline, key) 小顶堆，过时的条目在出堆时跳过
+        self._thread = threading.Thread(target=self._run, name="BurstCoalescer", daemon=True)
+        self._thread.start()
+
+    def put(self, key, item):
+        now = time()
+        with self.cond:
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = [item, now, now + self.window]
+                self.pending[key] = entry
+            else:
+                entry[0] = self.merge_func(entry[0], item)
+                entry[2] = min(now + self.window, entry[1] + self.max_wait)
+            heapq.heappush(self.deadlines, (entry[2], key))
+            self.cond.notify()
+
+    def flush(self, key):
+        """立即处理key对应的缓存消息，用于保证后续不可合并的消息不会插到前面"""
+        with self.flush_lock:
+            with self.cond:
+                entry = self.pending.pop(key, None)
+            if entry:
+                self._flush(entry[0])
+
+    def _flush(self, item):
+        try:
+            self.flush_func(item)
+        except Exception as e:
+            logger.exception("[BurstCoalescer] flush error: {}".format(e))
+
+    def _next_deadline(self):
+        """清理堆顶已处理或已延期的条目，返回最近的有效到期时间"""
+        while self.deadlines:
+            deadline, key = self.deadlines[0]
+            entry = self.pending.get(key)
+            if entry is None or entry[2] != deadline:
+                heapq.heappop(self.deadlines)
+                continue
+            return deadline
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    deadline = self._next_deadline()
+                    if deadline is not None and deadline <= time():
+                        break
+                    self.cond.wait(None if deadline is None else deadline - time())
+            # 与flush共用flush_lock，保证合并后的消息先于之后的不可合并消息进入队列
+            with self.flush_lock:
+                with self.cond:
+                    entry = None
+                    deadline = self._next_deadline()
+                    if deadline is not None and deadline <= time():
+                        _, key = heapq.heappop(self.deadlines)
+                        entry = self.pending.pop(key)
+                if entry:
+                    self._flush(entry[0])
@@ -0,0 +1,218 @@
+"""
+消息处理的截止时间和取消
+每条消息在produce时创建一个Deadline，随context传递；处理时通过activate绑定到当前执行上下文，
+Bridge、bot的HTTP请求和媒体下载通过current_deadline取得它，用于缩短超时时间和在取消时中止：
+- 超过截止时间或被取消后，check抛出DeadlineExceeded
+- 通过on_cancel注册的回调(如关闭进行中的流式响应)在取消或到期时立即执行
+"""
+
+import contextvars
+import heapq
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    def __init__(self, timeout=None):
+        """
+        :param timeout: 从现在开始的秒数，None或0表示不限时，只能被取消
+        """
+        self.expire_at = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """剩余秒数，不限时返回None"""
+        if self.expire_at is None:
+            return None
+        return max(0.0, self.expire_at - time.monotonic())
+
+    def done(self):
+        """已取消或已到期"""
+        if self.event.is_set():
+            return True
+        if self.expire_at is not None and time.monotonic() >= self.expire_at:
+            self.cancel("deadline exceeded")
+            return True
+        return False
+
+    def check(self):
+        if self.done():
+            raise DeadlineExceeded(self.reason)
+
+    def timeout(self, default=None):
+        """
+        用于网络请求的超时时间，取默认超时和剩余时间中较小的一个
+        已经到期时抛出DeadlineExceeded
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        if isinstance(default, tuple):
+            return tuple(min(t, remaining) if t is not None else remaining for t in default)
+        return min(default, remaining)
+
+    def wait(self, seconds):
+        """等待指定秒数，期间被取消或到期时提前返回并抛出DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            self.event.wait(remaining)
+        else:
+            self.event.wait(seconds)
+        self.check()
+
+    def cancel(self, reason="cancelled"):
+        """取消并执行注册的回调，返回是否是本次取消的"""
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+        return True
+
+    def on_cancel(self, callback):
+        """注册取消时执行的回调，已取消时立即执行"""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                if self.expire_at is not None:
+                    _watchdog.watch(self)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    @contextmanager
+    def guard(self, closeable):
+        """在代码块执行期间，取消时关闭closeable（如requests的流式响应）"""
+        callback = lambda: _abort(closeable)
+        self.on_cancel(callback)
+        try:
+            yield closeable
+        finally:
+            self.remove_callback(callback)
+
+    @contextmanager
+    def activate(self):
+        """绑定为当前执行上下文的截止时间"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def _abort(closeable):
+    """关闭响应；requests的响应先关闭底层socket，使其他线程中阻塞的读取立即返回"""
+    raw = getattr(closeable, "raw", None)
+    if raw is not None:
+        try:
+            if hasattr(raw, "shutdown"):
+                raw.shutdown()  # urllib3>=2.3
+            else:
+                raw._fp.fp.raw._sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+    closeable.close()
+
+
+def current_deadline():
+    return _current.get()
+
+
+def check_deadline():
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def deadline_timeout(default=None):
+    """当前截止时间下网络请求的超时时间，没有截止时间时返回default"""
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return deadline.timeout(default)
+
+
+def deadline_sleep(seconds):
+    """重试前的等待，在当前截止时间内被取消或到期时提前结束并抛出DeadlineExceeded"""
+    deadline = _current.get()
+    if deadline is None:
+        time.sleep(seconds)
+    else:
+        deadline.wait(seconds)
+
+
+@contextmanager
+def closing_on_cancel(closeable):
+    """当前截止时间到期或被取消时关闭closeable，没有截止时间时不做处理"""
+    deadline = _current.get()
+    if deadline is None:
+        yield closeable
+    else:
+        with deadline.guard(closeable):
+            yield closeable
+
+
+def bind_deadline(func):
+    """把当前的截止时间带到线程池中执行的函数里"""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(func, *args, **kwargs)
+
+
+class _Watchdog(object):
+    """只为注册了取消回调的截止时间计时，到期时执行回调"""
+
+    def __init__(self):
+        self.heap = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.seq = 0
+
+    def watch(self, deadline):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (deadline.expire_at, self.seq, deadline))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="deadline-watchdog", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                expire_at, _, deadline = self.heap[0]
+                delay = expire_at - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+            if deadline.callbacks:
+                deadline.cancel("deadline exceeded")
+
+
+_watchdog = _Watchdog()
@@ -1,22 +1,140 @@
-from datetime import datetime, timedelta
+import heapq
+import itertools
+import threading
+import weakref
+from time import monotonic as time
+from time import sleep as time_sleep
+
+
+class _Reaper(object):
+    """所有ExpiredDict共用的后台清理线程，定期回收长时间没有读写的字典中的过期条目"""
+
+    interval = 60
+
+    def __init__(self):
+        self.refs = {}  # id -> weakref，字典被回收后自动移除
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, d):
+        key = id(d)
+
+        def remove(_, key=key):
+            with self.lock:
+                self.refs.pop(key, None)
+
+        with self.lock:
+            self.refs[key] = weakref.ref(d, remove)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="ExpiredDictReaper", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time_sleep(self.interval)
+            with self.lock:
+                refs = list(self.refs.values())
+            for ref in refs:
+                d = ref()
+                if d is None:
+                    continue
+                try:
+                    d.purge()
+                except Exception:
+                    pass
+
+
+_reaper = _Reaper()
 
 
 class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
+    """
+    带过期时间的字典，读取时刷新过期时间
+    过期时间使用单调时钟，过期条目通过小顶堆按到期顺序回收，每次写入时顺带清理，另有后台线程定期清理；
+    设置max_size后超出容量时淘汰最久未使用的条目
+    """
+
+    def __init__(self, expires_in_seconds, max_size=0):
         super().__init__()
         self.expires_in_seconds = expires_in_seconds if expires_in_seconds else 3600
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self._heap = []  # (到期时间, 序号, key)，条目被刷新后堆中的到期时间可能早于实际到期时间
+        self._counter = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _reaper.register(self)
+
+    def _touch(self, key, entry):
+        """刷新过期时间，开启容量限制时同时移动到最近使用的位置"""
+        entry[1] = time() + self.expires_in_seconds
+        if self.max_size > 0:
+            super().__delitem__(key)
+            super().__setitem__(key, entry)
+
+    def _lookup(self, key):
+        """返回未过期的条目，不存在或已过期时返回None"""
+        entry = super().get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time():
+            super().__delitem__(key)
+            self.evictions += 1
+            return None
+        return entry
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            self._touch(key, entry)
+            return entry[0]
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self.lock:
+            expiry_time = time() + self.expires_in_seconds
+            entry = super().get(key)
+            if entry is not None:
+                entry[0] = value
+                self._touch(key, entry)
+            else:
+                super().__setitem__(key, [value, expiry_time])
+                heapq.heappush(self._heap, (expiry_time, next(self._counter), key))
+            self.purge()
+            if self.max_size > 0:
+                while super().__len__() > self.max_size:
+                    oldest = next(iter(super().keys()))
+                    super().__delitem__(oldest)
+                    self.evictions += 1
+
+    def __delitem__(self, key):
+        with self.lock:
+            super().__delitem__(key)
+
+    def purge(self):
+        """回收所有已到期的条目"""
+        with self.lock:
+            now = time()
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, _, key = heapq.heappop(heap)
+                entry = super().get(key)
+                if entry is None:
+                    continue  # 已被删除
+                if entry[1] <= now:
+                    super().__delitem__(key)
+                    self.evictions += 1
+                else:
+                    # 读取时刷新过，按新的到期时间重新入堆
+                    heapq.heappush(heap, (entry[1], next(self._counter), key))
+            # 删除过的条目留在堆中，堆过大时重建
+            if len(heap) > 2 * super().__len__() + 64:
+                self._heap = [(entry[1], next(self._counter), key) for key, entry in super().items()]
+                heapq.heapify(self._heap)
 
     def get(self, key, default=None):
         try:
@@ -25,18 +143,61 @@ class ExpiredDict(dict):
             return default
 
     def __contains__(self, key):
-        try:
-            self[key]
-            return True
-        except KeyError:
-            return False
+        with self.lock:
+            return self._lookup(key) is not None
+
+    def pop(self, key, *args):
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is None:
+                if args:
+                    return args[0]
+                raise KeyError(key)
+            super().__delitem__(key)
+            return entry[0]
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self._touch(key, entry)
+                return entry[0]
+            self[key] = default
+            return default
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self._heap = []
+
+    def __len__(self):
+        with self.lock:
+            self.purge()
+            return super().__len__()
 
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        with self.lock:
+            self.purge()
+            return list(super().keys())
+
+    def values(self):
+        with self.lock:
+            self.purge()
+            return [entry[0] for entry in super().values()]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        with self.lock:
+            self.purge()
+            return [(key, entry[0]) for key, entry in super().items()]
 
     def __iter__(self):
-        return self.keys().__iter__()
+        return iter(self.keys())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": super().__len__(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,250 @@
+"""
+跨会话的加权公平调度器
+- 管理员指令为最高优先级，总是优先调度，且不受会话并发上限限制（如 #reset 需要在生成进行中执行）
+- 私聊与群聊按权重分配处理机会（平滑加权轮询），同一优先级内各会话轮流出队
+- 每个会话、每个群同时处理的消息数都有上限
+- 会话队列与全局队列有长度上限，超出时按drop_oldest/drop_newest/merge策略处理，过载时平滑降级
+"""
+
+import threading
+from collections import deque
+from time import monotonic as time
+
+PRIORITY_ADMIN = "admin"
+PRIORITY_PRIVATE = "private"
+PRIORITY_GROUP = "group"
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_MERGE = "merge"
+
+
+class _SessionState:
+    __slots__ = ("session_id", "group_id", "priority", "admin_queue", "queue", "running")
+
+    def __init__(self, session_id, group_id, priority):
+        self.session_id = session_id
+        self.group_id = group_id
+        self.priority = priority
+        self.admin_queue = deque()
+        self.queue = deque()
+        self.running = 0
+
+    def pending(self):
+        return len(self.admin_queue) + len(self.queue)
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        weights=None,
+        session_max_running=1,
+        group_max_running=0,
+        session_max_queued=0,
+        max_queued=0,
+        overflow_policy=OVERFLOW_DROP_OLDEST,
+        merge_func=None,
+    ):
+        """
+        :param weights: 私聊和群聊的调度权重，如 {"private": 2, "group": 1}
+        :param session_max_running: 单个会话同时处理的消息数上限
+        :param group_max_running: 单个群同时处理的消息数上限，<=0表示不限制
+        :param session_max_queued: 单个会话排队消息数上限，<=0表示不限制
+        :param max_queued: 全局排队消息数上限，<=0表示不限制
+        :param overflow_policy: 会话队列满时的处理策略
+        :param merge_func: merge策略使用的合并函数 merge_func(old_item, new_item)，返回合并后的item，无法合并时返回None
+        """
+        self.weights = {PRIORITY_PRIVATE: 1, PRIORITY_GROUP: 1}
+        if weights:
+            self.weights.update({k: max(int(v), 1) for k, v in weights.items() if k in self.weights})
+        self.session_max_running = max(int(session_max_running), 1)
+        self.group_max_running = group_max_running
+        self.session_max_queued = session_max_queued
+        self.max_queued = max_queued
+        self.overflow_policy = overflow_policy
+        self.merge_func = merge_func
+
+        self.cond = threading.Condition()
+        self.sessions = {}  # session_id -> _SessionState
+        self.ready = {PRIORITY_ADMIN: deque(), PRIORITY_PRIVATE: deque(), PRIORITY_GROUP: deque()}  # 有待处理消息的会话
+        self.group_running = {}
+        self.current_weight = {PRIORITY_PRIVATE: 0, PRIORITY_GROUP: 0}
+        self.queued = 0
+        self.dropped = 0
+        self.merged = 0
+
+    def put(self, session_id, item, priority=PRIORITY_PRIVATE, group_id=None):
+        """
+        将消息放入会话队列
+        :return: 因队列已满被丢弃的消息，未丢弃时为None
+        """
+        with self.cond:
+            state = self.sessions.get(session_id)
+            if state is None:
+                state = _SessionState(session_id, group_id, PRIORITY_GROUP if group_id else PRIORITY_PRIVATE)
+                self.sessions[session_id] = state
+            elif group_id and state.group_id is None and not state.queue and state.running == 0:
+                # 会话由未带群id的消息创建，空闲时按群会话重新归类
+                state.group_id, state.priority = group_id, PRIORITY_GROUP
+            was_pending = state.pending() > 0
+            dropped = None
+            if priority == PRIORITY_ADMIN:
+                # 管理员指令不受队列长度限制
+                if not state.admin_queue:
+                    self.ready[PRIORITY_ADMIN].append(state)
+                state.admin_queue.append(item)
+                self.queued += 1
+            else:
+                # 队列非空时会话已在ready中，丢弃最旧的消息后队列可能暂时为空，不能据此再加入一次
+                was_empty = not state.queue
+                if self.session_max_queued > 0 and len(state.queue) >= self.session_max_queued:
+                    if self.overflow_policy == OVERFLOW_MERGE and self.merge_func:
+                        merged = self.merge_func(state.queue[-1], item)
+                        if merged is not None:
+                            state.queue[-1] = merged
+                            self.merged += 1
+                            return None
+                    if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                        self.dropped += 1
+                        return item
+                    dropped = state.queue.popleft()
+                    self.dropped += 1
+                    self.queued -= 1
+                elif self.max_queued > 0 and self.queued >= self.max_queued:
+                    self.dropped += 1
+                    if not was_pending and state.running == 0:
+                        del self.sessions[session_id]
+                    return item
+                if was_empty:
+                    self.ready[state.priority].append(state)
+                state.queue.append(item)
+                self.queued += 1
+            self.cond.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        """
+        取出下一条可处理的消息，没有可处理的消息时阻塞等待
+        :return: (session_id, item)，超时返回None
+        """
+        with self.cond:
+            endtime = None if timeout is None else time() + timeout
+            while True:
+                picked = self._pick()
+                if picked:
+                    return picked
+                if endtime is None:
+                    self.cond.wait()
+                else:
+                    remaining = endtime - time()
+                    if remaining <= 0:
+                        return None
+                    self.cond.wait(remaining)
+
+    def done(self, session_id):
+        """消息处理完毕，释放会话和群的并发名额"""
+        with self.cond:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return
+            state.running -= 1
+            if state.group_id:
+                self.group_running[state.group_id] -= 1
+                if self.group_running[state.group_id] <= 0:
+                    del self.group_running[state.group_id]
+            if state.running <= 0 and state.pending() == 0:
+                del self.sessions[session_id]
+            self.cond.notify_all()
+
+    def cancel(self, session_id):
+        """清空会话中排队的消息，返回被取消的消息数"""
+        with self.cond:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return 0
+            return self._clear(state)
+
+    def cancel_all(self):
+        with self.cond:
+            return {session_id: self._clear(state) for session_id, state in list(self.sessions.items())}
+
+    def qsize(self, session_id=None):
+        with self.cond:
+            if session_id is None:
+                return self.queued
+            state = self.sessions.get(session_id)
+            return state.pending() if state else 0
+
+    def stats(self):
+        with self.cond:
+            return {
+                "sessions": len(self.sessions),
+                "queued": self.queued,
+                "running": sum(state.running for state in self.sessions.values()),
+                "dropped": self.dropped,
+                "merged": self.merged,
+            }
+
+    def _clear(self, state):
+        cnt = state.pending()
+        state.admin_queue.clear()
+        state.queue.clear()
+        self.queued -= cnt
+        for ready in self.ready.values():
+            if state in ready:
+                ready.remove(state)
+        if state.running <= 0:
+            del self.sessions[state.session_id]
+        return cnt
+
+    def _runnable(self, state, check_group=True):
+        if state.running >= self.session_max_running:
+            return False
+        if check_group and state.group_id and self.group_max_running > 0:
+            return self.group_running.get(state.group_id, 0) < self.group_max_running
+        return True
+
+    def _pick_from(self, priority):
+        """在同一优先级内轮询会话，每个会话一次只出队一条消息"""
+        ready = self.ready[priority]
+        is_admin = priority == PRIORITY_ADMIN
+        for _ in range(len(ready)):
+            state = ready.popleft()
+            queue = state.admin_queue if is_admin else state.queue
+            if not queue:
+                continue  # 兜底：队列已被清空的会话不再留在ready中
+            if not is_admin and not self._runnable(state):
+                ready.append(state)
+                continue
+            item = queue.popleft()
+            if queue:
+                ready.append(state)
+            self.queued -= 1
+            state.running += 1
+            if state.group_id:
+                self.group_running[state.group_id] = self.group_running.get(state.group_id, 0) + 1
+            return state.session_id, item
+        return None
+
+    def _pick(self):
+        picked = self._pick_from(PRIORITY_ADMIN)
+        if picked:
+            return picked
+        # 平滑加权轮询选择私聊/群聊，选中的类别没有可运行会话时退而选择另一类
+        candidates = [p for p in self.current_weight if self.ready[p]]
+        if not candidates:
+            return None
+        total = 0
+        for p in candidates:
+            self.current_weight[p] += self.weights[p]
+            total += self.weights[p]
+        candidates.sort(key=lambda p: self.current_weight[p], reverse=True)
+        for p in candidates:
+            picked = self._pick_from(p)
+            if picked:
+                self.current_weight[p] -= total
+                return picked
+        # 没有可运行的会话，回退本轮累加的权重
+        for p in candidates:
+            self.current_weight[p] -= self.weights[p]
+        return None
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+import weakref
+
+from common.log import logger
+
+
+class FileWatcher(object):
+    """
+    轮询文件的修改时间，文件变化后在后台线程中回调
+    所有被监听的文件共用一个线程；回调为对象方法时只保存弱引用，插件重载后旧实例被回收即自动取消监听
+    """
+
+    def __init__(self, interval=5):
+        self.interval = interval
+        self.watches = {}  # path -> [mtime, [callback或WeakMethod]]
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, path, callback):
+        """监听文件，变化后以callback(path)回调"""
+        path = os.path.abspath(path)
+        ref = weakref.WeakMethod(callback) if hasattr(callback, "__self__") else callback
+        with self.lock:
+            if path not in self.watches:
+                self.watches[path] = [self._mtime(path), []]
+            self.watches[path][1].append(ref)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="FileWatcher", daemon=True)
+                self.thread.start()
+
+    def unwatch(self, path):
+        with self.lock:
+            self.watches.pop(os.path.abspath(path), None)
+
+    def mark_updated(self, path):
+        """程序自己写入文件后调用，记录最新的修改时间，避免再次触发回调"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if path in self.watches:
+                self.watches[path][0] = self._mtime(path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def check(self):
+        changed = []
+        with self.lock:
+            for path, watch in list(self.watches.items()):
+                mtime = self._mtime(path)
+                if mtime == watch[0]:
+                    continue
+                watch[0] = mtime
+                callbacks = []
+                for ref in watch[1]:
+                    callback = ref() if isinstance(ref, weakref.WeakMethod) else ref
+                    if callback is not None:
+                        callbacks.append(callback)
+                watch[1] = [ref for ref in watch[1] if not isinstance(ref, weakref.WeakMethod) or ref() is not None]
+                if not watch[1]:
+                    del self.watches[path]
+                changed.extend((path, callback) for callback in callbacks)
+        for path, callback in changed:
+            try:
+                callback(path)
+            except Exception as e:
+                logger.warning("[FileWatcher] callback for {} failed: {}".format(path, e))
+
+
+file_watcher = FileWatcher()
@@ -0,0 +1,126 @@
+"""
+按负载类型划分的消息处理线程池
+llm/media/voice/plugin 四类任务各自使用独立的线程池，慢任务不会占满其他类型的工作线程
+每个线程池记录排队深度与等待时间，便于观察拥塞情况
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from common.log import logger
+from config import conf
+
+WORKLOAD_LLM = "llm"  # 调用对话模型
+WORKLOAD_MEDIA = "media"  # 图片/视频/文件的下载与处理
+WORKLOAD_VOICE = "voice"  # 语音识别与合成
+WORKLOAD_PLUGIN = "plugin"  # 插件指令
+
+# 各类线程池的配置项及默认大小
+WORKLOAD_SETTINGS = {
+    WORKLOAD_LLM: ("llm_pool_workers", 8),
+    WORKLOAD_MEDIA: ("media_pool_workers", 4),
+    WORKLOAD_VOICE: ("voice_pool_workers", 4),
+    WORKLOAD_PLUGIN: ("plugin_pool_workers", 4),
+}
+
+
+class WorkloadPool:
+    """单一负载类型的线程池，附带排队深度和等待时间统计"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"handler-{name}")
+        self._lock = threading.Lock()
+        self.queued = 0  # 已提交但尚未开始执行的任务数
+        self.running = 0  # 正在执行的任务数
+        self.submitted = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        enqueue_time = time.monotonic()
+
+        def task():
+            wait = time.monotonic() - enqueue_time
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self._lock:
+            self.queued += 1
+            self.submitted += 1
+        future = self.executor.submit(task)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future):
+        # 排队中被取消的任务不会执行task，需要在这里修正排队计数
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self.submitted - self.queued
+            return {
+                "workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / started if started > 0 else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+class HandlerPools:
+    """按负载类型路由任务的线程池集合，线程池在首次使用时按配置创建"""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._initializer = None
+
+    def get(self, workload: str) -> WorkloadPool:
+        if workload not in WORKLOAD_SETTINGS:
+            workload = WORKLOAD_LLM
+        pool = self._pools.get(workload)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(workload)
+                if pool is None:
+                    key, default = WORKLOAD_SETTINGS[workload]
+                    max_workers = max(int(conf().get(key, default) or default), 1)
+                    pool = WorkloadPool(workload, max_workers)
+                    if self._initializer:
+                        pool.executor._initializer = self._initializer
+                    self._pools[workload] = pool
+                    logger.info("[HandlerPools] create {} pool, max_workers={}".format(workload, max_workers))
+        return pool
+
+    def submit(self, workload: str, fn, *args, **kwargs) -> Future:
+        return self.get(workload).submit(fn, *args, **kwargs)
+
+    def set_initializer(self, initializer):
+        """设置工作线程的初始化函数，对已创建和之后创建的线程池均生效"""
+        self._initializer = initializer
+        for pool in list(self._pools.values()):
+            pool.executor._initializer = initializer
+
+    def executors(self):
+        return [pool.executor for pool in list(self._pools.values())]
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in list(self._pools.items())}
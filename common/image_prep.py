@@ -0,0 +1,273 @@
+"""
+图片预处理：按最长边和字节上限缩放、重新编码，结果按内容哈希缓存
+识图请求和发送图片前调用，同一张图片多次使用时只处理一次，base64也只编码一次
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from common.log import logger
+from config import conf
+
+_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif", "BMP": "image/bmp"}
+_EXT = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif", "BMP": "bmp"}
+_ENCODE_FORMATS = ("JPEG", "WEBP")  # 重新编码支持的格式
+
+
+class PreparedImage(object):
+    """预处理后的图片，data为编码后的字节"""
+
+    __slots__ = ("data", "format", "width", "height", "_base64")
+
+    def __init__(self, data: bytes, format: str, width=0, height=0):
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        self._base64 = None
+
+    @property
+    def mime(self):
+        return _MIME.get(self.format, "image/" + self.format.lower())
+
+    @property
+    def ext(self):
+        return _EXT.get(self.format, self.format.lower())
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("utf-8")
+        return self._base64
+
+    @property
+    def data_url(self):
+        return "data:{};base64,{}".format(self.mime, self.base64)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ImagePreparer(object):
+    """
+    图片预处理和缓存
+    缓存的键为(内容哈希, 处理参数)，按占用字节数淘汰最久未使用的结果；
+    本地文件另按(路径, 修改时间, 大小)记录内容哈希，命中时不需要重新读取文件
+    """
+
+    def __init__(self, max_cache_bytes=64 * 1024 * 1024):
+        self.max_cache_bytes = max_cache_bytes
+        self.cache = OrderedDict()  # (哈希, 参数) -> PreparedImage
+        self.cache_bytes = 0
+        self.path_digests = OrderedDict()  # (路径, 修改时间, 大小) -> 哈希
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, source, max_edge=0, max_bytes=0, image_format="JPEG", quality=85, reencode=False) -> PreparedImage:
+        """
+        :param source: 本地文件路径、bytes或文件对象
+        :param max_edge: 最长边的像素上限，0为不限制
+        :param max_bytes: 编码后的字节上限，0为不限制；超出时先降低质量，再缩小尺寸
+        :param image_format: 需要重新编码时使用的格式，JPEG或WEBP
+        :param reencode: 尺寸和大小都满足要求时是否仍然重新编码，用于统一图片格式
+        """
+        image_format = image_format.upper()
+        if image_format not in _ENCODE_FORMATS:
+            raise ValueError("unsupported image format: {}, use one of {}".format(image_format, _ENCODE_FORMATS))
+        params = (max_edge, max_bytes, image_format, quality, reencode)
+        path_key = None
+        data = None
+        if isinstance(source, str):
+            stat = os.stat(source)
+            path_key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+            with self.lock:
+                digest = self.path_digests.get(path_key)
+                if digest is not None:
+                    cached = self._get((digest, params))
+                    if cached is not None:
+                        return cached
+            with open(source, "rb") as f:
+                data = f.read()
+        elif isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+        else:
+            source.seek(0)
+            data = source.read()
+
+        digest = hashlib.sha1(data).hexdigest()
+        with self.lock:
+            if path_key is not None:
+                self.path_digests[path_key] = digest
+                while len(self.path_digests) > 1024:
+                    self.path_digests.popitem(last=False)
+            cached = self._get((digest, params))
+            if cached is not None:
+                return cached
+            self.misses += 1
+
+        image = self._process(data, _sniff_format(data, source if isinstance(source, str) else None), *params)
+        with self.lock:
+            self._put((digest, params), image)
+        return image
+
+    def _get(self, key):
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        return image
+
+    def _put(self, key, image):
+        if key in self.cache:
+            return
+        self.cache[key] = image
+        self.cache_bytes += len(image.data)
+        while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old.data)
+
+    @staticmethod
+    def _process(data, src_format, max_edge, max_bytes, image_format, quality, reencode):
+        """src_format为按文件头或后缀判断的原图格式，无法处理时原图按该格式返回"""
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            logger.warning("[ImagePrep] import PIL failed, use original image")
+            return PreparedImage(data, src_format)
+        try:
+            img = Image.open(io.BytesIO(data))
+            src_format = (img.format or src_format).upper()
+            width, height = img.size
+            if getattr(img, "n_frames", 1) > 1:
+                # 动图重新编码会丢失动画，保持原样
+                return PreparedImage(data, src_format, width, height)
+            too_large = max_edge and max(width, height) > max_edge
+            too_heavy = max_bytes and len(data) > max_bytes
+            if not (too_large or too_heavy or reencode) and src_format in ("JPEG", "PNG", "WEBP"):
+                return PreparedImage(data, src_format, width, height)
+
+            img = ImageOps.exif_transpose(img)  # 手机照片的方向信息在重新编码后会丢失，先按方向旋转
+            if too_large:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if img.mode not in ("RGB", "L"):
+                # JPEG不支持透明度，使用白色背景
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.split()[-1])
+
+            encoded = _encode(img, image_format, quality)
+            while max_bytes and len(encoded) > max_bytes:
+                if quality > 50:
+                    quality -= 10
+                else:
+                    w, h = img.size
+                    if max(w, h) <= 256:
+                        break
+                    img = img.resize((max(1, int(w * 0.75)), max(1, int(h * 0.75))), Image.LANCZOS)
+                encoded = _encode(img, image_format, quality)
+            logger.debug("[ImagePrep] {}x{} {}B -> {}x{} {}B {}".format(
+                width, height, len(data), img.size[0], img.size[1], len(encoded), image_format))
+            return PreparedImage(encoded, image_format, img.size[0], img.size[1])
+        except Exception as e:
+            logger.warning("[ImagePrep] process image failed, use original image: {}".format(e))
+            return PreparedImage(data, src_format)
+
+    def stats(self):
+        with self.lock:
+            return {"items": len(self.cache), "bytes": self.cache_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def _sniff_format(data, path=None):
+    """按文件头判断图片格式，无法判断时按文件后缀，默认JPEG"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "JPEG"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if data[:2] == b"BM":
+        return "BMP"
+    if path:
+        ext = os.path.splitext(path)[1].lstrip(".").lower()
+        for fmt, fmt_ext in _EXT.items():
+            if ext == fmt_ext or ext == fmt.lower():
+                return fmt
+    return "JPEG"
+
+
+def _encode(img, image_format, quality):
+    out = io.BytesIO()
+    if image_format == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+_preparer = None
+_preparer_lock = threading.Lock()
+
+
+def get_image_preparer() -> ImagePreparer:
+    global _preparer
+    if _preparer is None:
+        with _preparer_lock:
+            if _preparer is None:
+                _preparer = ImagePreparer(int(conf().get("image_cache_mb", 64)) * 1024 * 1024)
+    return _preparer
+
+
+def prepare_image(source, **kwargs) -> PreparedImage:
+    """预处理图片，参数见ImagePreparer.prepare"""
+    return get_image_preparer().prepare(source, **kwargs)
+
+
+def prepare_vision_image(source) -> PreparedImage:
+    """按识图配置预处理图片，用于发送给识图模型"""
+    image_format = str(conf().get("vision_image_format") or "JPEG").upper()
+    if image_format not in _ENCODE_FORMATS:
+        logger.warning("[ImagePrep] unsupported vision_image_format: {}, use JPEG".format(image_format))
+        image_format = "JPEG"
+    return get_image_preparer().prepare(
+        source,
+        max_edge=conf().get("vision_image_max_edge", 2048),
+        max_bytes=int(conf().get("vision_image_max_kb", 1024)) * 1024,
+        image_format=image_format,
+    )
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from PIL import Image
+
+    # 生成一张手机照片大小的图片，对比原图直接编码和预处理后的大小与耗时
+    img = Image.effect_noise((4032, 3024), 40).convert("RGB")
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        img.save(f, format="JPEG", quality=95)
+        path = f.name
+    t = time.perf_counter()
+    with open(path, "rb") as f:
+        raw_b64 = base64.b64encode(f.read()).decode()
+    print("原图: {:.1f}KB, 读取并base64 {:.1f}ms".format(os.path.getsize(path) / 1024, (time.perf_counter() - t) * 1000))
+    preparer = ImagePreparer()
+    for fmt in ("JPEG", "WEBP"):
+        t = time.perf_counter()
+        prepared = preparer.prepare(path, max_edge=2048, max_bytes=1024 * 1024, image_format=fmt)
+        _ = prepared.base64
+        first = time.perf_counter() - t
+        t = time.perf_counter()
+        _ = preparer.prepare(path, max_edge=2048, max_bytes=1024 * 1024, image_format=fmt).base64
+        again = time.perf_counter() - t
+        print("{}: {}x{} {:.1f}KB, 首次{:.1f}ms, 缓存命中{:.3f}ms".format(
+            fmt, prepared.width, prepared.height, len(prepared) / 1024, first * 1000, again * 1000))
+    print(preparer.stats())
+    os.remove(path)
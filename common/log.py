@@ -1,72 +1,170 @@
+import atexit
+import json
 import logging
-import sys
+import logging.handlers
 import os
-import json
+import queue
+import sys
+
+LOG_FORMAT = "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 后台写日志的监听器，异步模式下才会创建
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行json，便于日志系统采集"""
 
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, LOG_DATE_FORMAT),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
 
-def _reset_logger(log):
+
+class _Lazy(object):
+    """在日志真正输出时才计算的参数"""
+
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def lazy(func, *args, **kwargs):
+    """
+    延迟计算日志参数，配合%s占位符使用，日志级别未开启时不会调用func
+    例: logger.debug("[wxpad] 收到消息: %s", lazy(json.dumps, data))
+    """
+    return _Lazy(func, *args, **kwargs)
+
+
+def truncate(text, limit=50):
+    """延迟截断日志中的长文本，如消息内容"""
+    return _Lazy(_truncate, text, limit)
+
+
+def _truncate(text, limit):
+    if text is None:
+        return "None"
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    只在业务线程中合并消息参数（此时才计算lazy参数），不复制record、不做完整格式化，
+    时间、文件名等格式化和写入都交给后台线程
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _read_log_config():
+    # 日志在配置加载前就要初始化，因此直接读取config.json
+    try:
+        config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"读取日志配置错误，使用默认配置: {e}")
+    return {}
+
+
+def _build_handlers(log_config):
+    console_handle = logging.StreamHandler(sys.stdout)
+    console_handle.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    # 按大小轮转，log_max_bytes为0时不轮转
+    file_handle = logging.handlers.RotatingFileHandler(
+        "run.log",
+        maxBytes=int(log_config.get("log_max_bytes", 50 * 1024 * 1024)),
+        backupCount=int(log_config.get("log_backup_count", 5)),
+        encoding="utf-8",
+    )
+    if log_config.get("log_json", False):
+        file_handle.setFormatter(JsonFormatter())
+    else:
+        file_handle.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    return [file_handle, console_handle]
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # 写完队列中剩余的日志
+        _listener = None
+
+
+def _reset_logger(log, log_config=None):
+    global _listener
+    if log_config is None:
+        log_config = {}
+    _stop_listener()
     for handler in log.handlers:
         handler.close()
         log.removeHandler(handler)
         del handler
     log.handlers.clear()
     log.propagate = False
-    console_handle = logging.StreamHandler(sys.stdout)
-    console_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    file_handle = logging.FileHandler("run.log", encoding="utf-8")
-    file_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    log.addHandler(file_handle)
-    log.addHandler(console_handle)
+    handlers = _build_handlers(log_config)
+    if log_config.get("log_async", True):
+        # 异步模式：业务线程只把日志放入队列，由后台线程完成格式化和写文件
+        log_queue = queue.SimpleQueue()
+        log.addHandler(_QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        for handler in handlers:
+            log.addHandler(handler)
 
 
 def _get_logger():
     log = logging.getLogger("log")
-    _reset_logger(log)
-    
+    log_config = _read_log_config()
+    _reset_logger(log, log_config)
+
     # 默认日志级别
     log_level = logging.INFO
-    
-    # 尝试从配置文件读取日志级别
-    try:
-        # 读取配置文件
-        config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                level_str = config.get("log_level", "INFO")
-                
-                # 将字符串日志级别转换为logging模块常量
-                if level_str == "DEBUG":
-                    log_level = logging.DEBUG
-                elif level_str == "INFO":
-                    log_level = logging.INFO
-                elif level_str == "WARNING":
-                    log_level = logging.WARNING
-                elif level_str == "ERROR":
-                    log_level = logging.ERROR
-                elif level_str == "CRITICAL":
-                    log_level = logging.CRITICAL
-                
-                print(f"设置日志级别为: {level_str}")
-    except Exception as e:
-        print(f"读取日志配置错误，使用默认INFO级别: {e}")
-    
+
+    # 将字符串日志级别转换为logging模块常量
+    level_str = log_config.get("log_level", "INFO")
+    if level_str == "DEBUG":
+        log_level = logging.DEBUG
+    elif level_str == "INFO":
+        log_level = logging.INFO
+    elif level_str == "WARNING":
+        log_level = logging.WARNING
+    elif level_str == "ERROR":
+        log_level = logging.ERROR
+    elif level_str == "CRITICAL":
+        log_level = logging.CRITICAL
+    if "log_level" in log_config:
+        print(f"设置日志级别为: {level_str}")
+
     log.setLevel(log_level)
     return log
 
 
 # 日志句柄
 logger = _get_logger()
+atexit.register(_stop_listener)
 
 
 # 允许动态设置日志级别的函数
@@ -77,14 +175,53 @@ def set_logger_level(level_str):
     """
     level_map = {
         "DEBUG": logging.DEBUG,
-        "INFO": logging.INFO, 
+        "INFO": logging.INFO,
         "WARNING": logging.WARNING,
         "ERROR": logging.ERROR,
         "CRITICAL": logging.CRITICAL
     }
-    
+
     if level_str in level_map:
         logger.setLevel(level_map[level_str])
         logger.info(f"日志级别已设置为: {level_str}")
     else:
         logger.warning(f"无效的日志级别: {level_str}，可用值: {', '.join(level_map.keys())}")
+
+
+if __name__ == "__main__":
+    # 基准测试：对比同步/异步写日志时，业务线程每条日志的耗时
+    import tempfile
+    import time
+
+    def bench(async_mode, level, count=20000):
+        log = logging.getLogger(f"bench-{async_mode}-{level}")
+        log.propagate = False
+        log.setLevel(level)
+        tmp = tempfile.NamedTemporaryFile(suffix=".log", delete=False)
+        tmp.close()
+        handler = logging.FileHandler(tmp.name, encoding="utf-8")
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        listener = None
+        if async_mode:
+            log_queue = queue.SimpleQueue()
+            log.addHandler(_QueueHandler(log_queue))
+            listener = logging.handlers.QueueListener(log_queue, handler)
+            listener.start()
+        else:
+            log.addHandler(handler)
+        message = {"from_user_name": "wxid_xxx", "content": "你好" * 50, "msg_type": 1}
+        start = time.perf_counter()
+        for i in range(count):
+            log.info("[wxpad] 📨 %s: %s", "wxid_xxx", truncate(message["content"]))
+            log.debug("[wxpad] 收到WebSocket消息: %s", lazy(json.dumps, message, ensure_ascii=False))
+        elapsed = time.perf_counter() - start
+        if listener:
+            listener.stop()
+        handler.close()
+        os.unlink(tmp.name)
+        mode = "async" if async_mode else "sync"
+        print(f"{mode:<5} level={logging.getLevelName(level):<5} {elapsed / count * 1e6:.2f}us/message")
+
+    for level in (logging.INFO, logging.DEBUG):
+        bench(False, level)
+        bench(True, level)
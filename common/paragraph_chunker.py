@@ -0,0 +1,79 @@
+"""
+把流式回复的增量文本切分为适合逐条发送的段落
+- 累计不少于min_chars后，在下一个换行处切分，太短的段落和后面的合并，避免刷屏
+- 超过max_chars仍没有换行时，在最后一个句末标点处切分，没有句末标点时在逗号等处切分
+- 不在```代码块内部切分，代码块过长时才在换行处切分
+"""
+
+_SENTENCE_ENDS = "。！？；!?;"
+_CLAUSE_ENDS = "，,、 "
+_FENCE = "```"
+
+
+class ParagraphChunker(object):
+    def __init__(self, min_chars=80, max_chars=600):
+        self.min_chars = max(1, min_chars)
+        self.max_chars = max(self.min_chars, max_chars)
+        self.buffer = ""
+        self.in_code = False  # 已发送的部分停在代码块内
+
+    def feed(self, delta: str) -> list:
+        """追加增量文本，返回已经完整的段落"""
+        self.buffer += delta
+        chunks = []
+        while len(self.buffer) >= self.min_chars:
+            cut = self._find_cut()
+            if cut <= 0:
+                break
+            chunk = self.buffer[:cut].lstrip("\n").rstrip()
+            self.buffer = self.buffer[cut:].lstrip("\n")
+            if chunk.count(_FENCE) % 2 == 1:
+                self.in_code = not self.in_code
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> str:
+        """返回剩余的文本"""
+        rest, self.buffer = self.buffer.lstrip("\n").rstrip(), ""
+        self.in_code = False
+        return rest
+
+    def _find_cut(self):
+        buf = self.buffer
+        pos = buf.find("\n", self.min_chars - 1)
+        while pos != -1:
+            if (self.in_code + buf.count(_FENCE, 0, pos)) % 2 == 0:
+                return pos + 1
+            pos = buf.find("\n", pos + 1)
+        if (self.in_code + buf.count(_FENCE)) % 2 == 1:
+            limit = self.max_chars * 2
+            if len(buf) <= limit:
+                return 0
+            return buf.rfind("\n", 0, limit) + 1 or limit
+        if len(buf) <= self.max_chars:
+            return 0
+        head = buf[:self.max_chars]
+        for marks in (_SENTENCE_ENDS, _CLAUSE_ENDS):
+            end = max(head.rfind(c) for c in marks)
+            if end >= self.min_chars // 2:
+                return end + 1
+        return self.max_chars
+
+
+if __name__ == "__main__":
+    import time
+
+    text = ("第一段比较短。\n" + "第二段" * 40 + "\n\n```python\n" + "print('hello')\n" * 10 + "```\n"
+            + "没有换行的长段落，" * 100 + "\n最后一段")
+    chunker = ParagraphChunker(min_chars=40, max_chars=300)
+    chunks = []
+    begin = time.perf_counter()
+    for i in range(0, len(text), 3):  # 模拟每次收到几个字
+        chunks.extend(chunker.feed(text[i:i + 3]))
+    chunks.append(chunker.flush())
+    elapsed = time.perf_counter() - begin
+    for chunk in chunks:
+        print("[{}] {}".format(len(chunk), chunk[:40].replace("\n", "\\n")))
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+    print("{}字，{}段，切分耗时{:.2f}ms".format(len(text), len(chunks), elapsed * 1000))
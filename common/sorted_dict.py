@@ -1,7 +1,13 @@
-import heapq
+from bisect import bisect_left, insort
 
 
 class SortedDict(dict):
+    """
+    按sort_func(key, value)排序的字典
+    内部维护一个按(priority, key)有序的列表和key到priority的索引，插入、更新、删除都通过二分查找定位，
+    不需要线性扫描或重建堆；有序的keys在变化后才重新生成
+    """
+
     def __init__(self, sort_func=lambda k, v: k, init_dict=None, reverse=False):
         if init_dict is None:
             init_dict = []
@@ -10,53 +16,80 @@ class SortedDict(dict):
         self.sort_func = sort_func
         self.sorted_keys = None
         self.reverse = reverse
-        self.heap = []
+        self._entries = []  # 升序的(priority, key)列表
+        self._priorities = {}  # key -> 当前在_entries中的priority
         for k, v in init_dict:
             self[k] = v
 
+    def _remove_entry(self, key):
+        priority = self._priorities.pop(key)
+        i = bisect_left(self._entries, (priority, key))
+        del self._entries[i]
+
+    def _insert_entry(self, key, priority):
+        self._priorities[key] = priority
+        insort(self._entries, (priority, key))
+        self.sorted_keys = None
+
     def __setitem__(self, key, value):
-        if key in self:
-            super().__setitem__(key, value)
-            for i, (priority, k) in enumerate(self.heap):
-                if k == key:
-                    self.heap[i] = (self.sort_func(key, value), key)
-                    heapq.heapify(self.heap)
-                    break
-            self.sorted_keys = None
-        else:
-            super().__setitem__(key, value)
-            heapq.heappush(self.heap, (self.sort_func(key, value), key))
-            self.sorted_keys = None
+        super().__setitem__(key, value)
+        self._update_heap(key)
 
     def __delitem__(self, key):
         super().__delitem__(key)
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                del self.heap[i]
-                heapq.heapify(self.heap)
-                break
+        self._remove_entry(key)
+        self.sorted_keys = None
+
+    def pop(self, key, *args):
+        if key not in self:
+            if args:
+                return args[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self):
+        super().clear()
+        self._entries = []
+        self._priorities = {}
         self.sorted_keys = None
 
     def keys(self):
         if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
+            entries = reversed(self._entries) if self.reverse else self._entries
+            self.sorted_keys = [k for _, k in entries]
         return self.sorted_keys
 
     def items(self):
-        if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
-        sorted_items = [(k, self[k]) for k in self.sorted_keys]
-        return sorted_items
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def peekitem(self, index=0):
+        """按排序返回第index个(key, value)，可用于排行榜或任务队列"""
+        key = self.keys()[index]
+        return key, self[key]
+
+    def index(self, key):
+        """返回key在排序中的位置"""
+        priority = self._priorities[key]
+        i = bisect_left(self._entries, (priority, key))
+        return len(self._entries) - 1 - i if self.reverse else i
 
     def _update_heap(self, key):
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                new_priority = self.sort_func(key, self[key])
-                if new_priority != priority:
-                    self.heap[i] = (new_priority, key)
-                    heapq.heapify(self.heap)
-                    self.sorted_keys = None
-                break
+        """value的排序依据发生变化时调用，重新定位key的位置"""
+        new_priority = self.sort_func(key, self[key])
+        if key in self._priorities:
+            if self._priorities[key] == new_priority:
+                return
+            self._remove_entry(key)
+        self._insert_entry(key, new_priority)
 
     def __iter__(self):
         return iter(self.keys())
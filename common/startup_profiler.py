@@ -0,0 +1,122 @@
+"""
+启动耗时分析，通过 python3 app.py --profile-startup 开启
+- 替换builtins.__import__，记录每个模块首次导入的耗时（包含它导入的子模块），输出导入树
+- 记录启动各阶段的时间点，收到第一条消息时输出从进程启动到第一条消息的耗时
+未开启时只有模块级的标志判断，不影响正常运行；本模块不导入项目中的其他模块，以便在最开始安装
+"""
+
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+_start = time.perf_counter()
+_original_import = builtins.__import__
+_enabled = False
+_local = threading.local()
+_roots = []  # 顶层导入节点
+_marks = []  # (阶段, 距启动的秒数)
+_reported = 0  # 已输出的顶层节点数
+_first_message = False
+
+
+class _Node(object):
+    __slots__ = ("name", "elapsed", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0.0
+        self.children = []
+
+
+def _resolve(name, globals, level):
+    if level == 0:
+        return name
+    try:
+        return importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+    except Exception:
+        return name
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    full_name = _resolve(name, globals, level)
+    if full_name in sys.modules and not fromlist:
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    node = _Node(full_name)
+    fresh = full_name not in sys.modules
+    stack.append(node)
+    begin = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        node.elapsed = time.perf_counter() - begin
+        stack.pop()
+        # 已导入过的模块只在from ... import触发了子模块导入时记录
+        if fresh or node.children:
+            (stack[-1].children if stack else _roots).append(node)
+
+
+def install():
+    """开始记录导入耗时，需在导入其他模块前调用"""
+    global _enabled
+    _enabled = True
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    builtins.__import__ = _original_import
+
+
+def enabled():
+    return _enabled
+
+
+def mark(stage):
+    """记录启动阶段的时间点"""
+    if _enabled:
+        _marks.append((stage, time.perf_counter() - _start))
+
+
+def _format_tree(nodes, threshold, depth=0, lines=None):
+    lines = [] if lines is None else lines
+    for node in sorted(nodes, key=lambda n: n.elapsed, reverse=True):
+        if node.elapsed < threshold:
+            break
+        own = node.elapsed - sum(child.elapsed for child in node.children)
+        lines.append("{:>9.1f}ms {:>9.1f}ms  {}{}".format(node.elapsed * 1000, own * 1000, "  " * depth, node.name))
+        _format_tree(node.children, threshold, depth + 1, lines)
+    return lines
+
+
+def report(threshold=0.005):
+    """输出上次输出之后的导入树，只列出耗时不小于threshold秒的模块"""
+    global _reported
+    if not _enabled:
+        return
+    nodes = _roots[_reported:]
+    _reported += len(nodes)
+    total = sum(node.elapsed for node in nodes)
+    lines = ["[StartupProfiler] 顶层导入{}个，耗时{:.1f}ms".format(len(nodes), total * 1000),
+             "{:>11} {:>11}  {}".format("cumulative", "self", "module")]
+    lines.extend(_format_tree(nodes, threshold))
+    lines.append("[StartupProfiler] 启动阶段:")
+    lines.extend("{:>9.1f}ms  {}".format(at * 1000, stage) for stage, at in _marks)
+    from common.log import logger
+    logger.info("\n".join(lines))
+
+
+def on_message():
+    """收到第一条消息时输出耗时并停止记录导入"""
+    global _first_message
+    if not _enabled or _first_message:
+        return
+    _first_message = True
+    mark("first message")
+    uninstall()
+    from common.log import logger
+    logger.info("[StartupProfiler] 从启动到收到第一条消息: {:.2f}s".format(_marks[-1][1]))
+    report()
@@ -1,12 +1,17 @@
 """
 临时文件清理模块
-定时清理tmp目录下的过期文件，防止磁盘空间浪费
+生产临时文件的地方登记文件的所有者和保留时间，清理线程按到期时间顺序删除过期文件，
+启动时全量扫描一次，接管上次运行遗留的文件；此后只以较低的频率遍历tmp目录，兜底删除未登记的过期文件。
+正在使用的文件通过引用计数保护，引用释放前不会被删除；开启磁盘配额后超出配额时优先淘汰最久未使用的文件。
 """
 
+import heapq
+import itertools
 import os
 import time
 import threading
 import logging
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
 
@@ -15,36 +20,222 @@ from config import conf
 logger = logging.getLogger(__name__)
 
 
+class _TmpFile(object):
+    __slots__ = ("path", "owner", "expire_at", "size", "refs", "delete_on_release")
+
+    def __init__(self, path, owner, expire_at, size, delete_on_release):
+        self.path = path
+        self.owner = owner
+        self.expire_at = expire_at
+        self.size = size
+        self.refs = 0
+        self.delete_on_release = delete_on_release
+
+
 class TmpCleaner:
-    """临时文件清理器"""
-    
+    """临时文件登记表和清理器"""
+
     def __init__(self):
         self.tmp_dir = Path("./tmp/")
         self.cleanup_enabled = conf().get("tmp_cleanup_enabled", True)
-        self.cleanup_interval = conf().get("tmp_cleanup_interval", 3600)  # 默认1小时
+        self.cleanup_interval = conf().get("tmp_cleanup_interval", 3600)  # 没有文件到期时，清理线程最长的等待时间
         self.file_max_age = conf().get("tmp_file_max_age", 3600)  # 默认1小时
+        self.sweep_interval = conf().get("tmp_sweep_interval", 21600)  # 兜底扫描间隔，默认6小时，0表示不扫描
+        self.disk_quota = int(conf().get("tmp_disk_quota_mb", 0)) * 1024 * 1024  # 0表示不限制
         self.cleanup_thread: Optional[threading.Thread] = None
         self.stop_event = threading.Event()
-        
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.files = OrderedDict()  # 绝对路径 -> _TmpFile，按最近使用排序，用于配额淘汰
+        self.owners = {}  # 所有者 -> 路径集合
+        self.expiry_heap = []  # (到期时间, 序号, 路径)，文件续期或删除后堆中的旧记录在弹出时跳过
+        self.counter = itertools.count()
+        self.total_size = 0
+        self.deleted_count = 0
+        self.deleted_size = 0
+
         logger.info(f"[TmpCleaner] 初始化临时文件清理器")
         logger.info(f"[TmpCleaner] 清理启用: {self.cleanup_enabled}")
-        logger.info(f"[TmpCleaner] 清理间隔: {self.cleanup_interval}秒")
         logger.info(f"[TmpCleaner] 文件最大保留时间: {self.file_max_age}秒")
+        logger.info(f"[TmpCleaner] 兜底扫描间隔: {self.sweep_interval}秒")
+        logger.info(f"[TmpCleaner] 磁盘配额: {self._format_size(self.disk_quota) if self.disk_quota else '不限制'}")
         logger.info(f"[TmpCleaner] 临时目录: {self.tmp_dir.absolute()}")
-    
+
+    # ---------- 文件登记 ----------
+
+    def register(self, path, owner=None, ttl=None, delete_on_release=False):
+        """
+        登记临时文件，已登记的文件会刷新到期时间
+        :param owner: 所有者，如会话id或插件名，可通过release_owner一次释放
+        :param ttl: 保留时间，默认使用tmp_file_max_age
+        :param delete_on_release: 引用全部释放后立即删除，用于只使用一次的文件
+        """
+        if not path or not self.cleanup_enabled:
+            return  # 清理关闭时没有清理线程，不登记，也不按配额删除文件
+        path = os.path.abspath(str(path))
+        expire_at = time.time() + (ttl if ttl is not None else self.file_max_age)
+        size = self._file_size(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None:
+                entry = _TmpFile(path, owner, expire_at, size, delete_on_release)
+                self.files[path] = entry
+                self.total_size += size
+            else:
+                self.files.move_to_end(path)
+                self.total_size += size - entry.size
+                entry.size = size
+                entry.expire_at = max(entry.expire_at, expire_at)
+                entry.delete_on_release = entry.delete_on_release or delete_on_release
+                if owner is not None and entry.owner is None:
+                    entry.owner = owner
+            if entry.owner is not None:
+                self.owners.setdefault(entry.owner, set()).add(path)
+            self._push_expiry(entry)
+            evict = self._over_quota()
+        self._delete(evict)
+
+    def acquire(self, path, owner=None, ttl=None):
+        """增加文件的引用，引用释放前文件不会被删除；未登记的文件会先登记"""
+        if not path or not self.cleanup_enabled:
+            return
+        path = os.path.abspath(str(path))
+        with self.lock:
+            entry = self.files.get(path)
+        if entry is None:
+            self.register(path, owner, ttl)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None:
+                entry.refs += 1
+                self.files.move_to_end(path)
+
+    def release(self, path):
+        """释放一次引用，如回复发送完成后；文件大小在此时更新，以便计入配额"""
+        if not path:
+            return
+        path = os.path.abspath(str(path))
+        size = self._file_size(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            self.total_size += size - entry.size
+            entry.size = size
+            remove = entry.refs == 0 and entry.delete_on_release
+            if remove:
+                self._forget(entry)
+            evict = self._over_quota()
+        if remove:
+            self._delete([entry])
+        self._delete(evict)
+
+    def release_owner(self, owner):
+        """释放某个所有者的全部文件的引用"""
+        with self.lock:
+            paths = list(self.owners.get(owner, ()))
+        for path in paths:
+            self.release(path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.files),
+                "size": self.total_size,
+                "pinned": sum(1 for entry in self.files.values() if entry.refs > 0),
+                "deleted": self.deleted_count,
+                "deleted_size": self.deleted_size,
+            }
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0  # 文件可能还没写入
+
+    def _push_expiry(self, entry):
+        heapq.heappush(self.expiry_heap, (entry.expire_at, next(self.counter), entry.path))
+        if self.expiry_heap[0][2] == entry.path:
+            self.wakeup.notify()
+
+    def _forget(self, entry):
+        """从登记表中移除，需持有锁"""
+        self.files.pop(entry.path, None)
+        self.total_size -= entry.size
+        if entry.owner is not None:
+            paths = self.owners.get(entry.owner)
+            if paths is not None:
+                paths.discard(entry.path)
+                if not paths:
+                    del self.owners[entry.owner]
+
+    def _over_quota(self):
+        """超出配额时按最久未使用的顺序选出要删除的文件，跳过仍被引用的文件，需持有锁"""
+        evict = []
+        if not self.disk_quota or self.total_size <= self.disk_quota:
+            return evict
+        for entry in list(self.files.values()):
+            if self.total_size <= self.disk_quota:
+                break
+            if entry.refs > 0:
+                continue
+            self._forget(entry)
+            evict.append(entry)
+        return evict
+
+    def _pop_expired(self, now):
+        """弹出所有已到期且未被引用的文件，需持有锁"""
+        expired = []
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expire_at, _, path = heapq.heappop(heap)
+            entry = self.files.get(path)
+            if entry is None or entry.expire_at != expire_at:
+                continue  # 已删除或已续期
+            if entry.refs > 0:
+                # 仍在使用，稍后再检查
+                entry.expire_at = now + min(self.file_max_age, 300)
+                heapq.heappush(heap, (entry.expire_at, next(self.counter), path))
+                continue
+            self._forget(entry)
+            expired.append(entry)
+        # 堆中的旧记录过多时重建
+        if len(heap) > 2 * len(self.files) + 1024:
+            self.expiry_heap = [(e.expire_at, next(self.counter), e.path) for e in self.files.values()]
+            heapq.heapify(self.expiry_heap)
+        return expired
+
+    def _delete(self, entries):
+        for entry in entries:
+            try:
+                os.remove(entry.path)
+                with self.lock:
+                    self.deleted_count += 1
+                    self.deleted_size += entry.size
+                logger.debug(f"[TmpCleaner] 已删除临时文件: {entry.path} (大小: {entry.size}字节)")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.debug(f"[TmpCleaner] 无法删除文件 {entry.path}: {e}")
+
+    # ---------- 清理线程 ----------
+
     def start(self):
         """启动清理器"""
         if not self.cleanup_enabled:
             logger.info("[TmpCleaner] 临时文件清理已禁用")
             return
-        
+
         if self.cleanup_thread and self.cleanup_thread.is_alive():
             logger.warning("[TmpCleaner] 清理线程已在运行")
             return
-        
+
         # 确保tmp目录存在
         self.tmp_dir.mkdir(exist_ok=True)
-        
+
         # 启动清理线程
         self.cleanup_thread = threading.Thread(
             target=self._cleanup_loop,
@@ -53,97 +244,120 @@ class TmpCleaner:
         )
         self.cleanup_thread.start()
         logger.info("[TmpCleaner] 临时文件清理器已启动")
-    
+
     def stop(self):
         """停止清理器"""
         if self.cleanup_thread and self.cleanup_thread.is_alive():
             logger.info("[TmpCleaner] 正在停止临时文件清理器...")
             self.stop_event.set()
+            with self.lock:
+                self.wakeup.notify()
             self.cleanup_thread.join(timeout=5)
             if self.cleanup_thread.is_alive():
                 logger.warning("[TmpCleaner] 清理线程未能正常停止")
             else:
                 logger.info("[TmpCleaner] 临时文件清理器已停止")
-    
+
     def _cleanup_loop(self):
-        """清理循环"""
+        """清理循环：启动时全量扫描一次，之后在最早的文件到期或到了兜底扫描时间时醒来"""
         logger.info("[TmpCleaner] 清理循环已启动")
-        
+        try:
+            self._initial_sweep()
+        except Exception as e:
+            logger.error(f"[TmpCleaner] 启动扫描时发生异常: {e}")
+        next_sweep = time.time() + self.sweep_interval if self.sweep_interval else None
+
         while not self.stop_event.is_set():
             try:
                 self._perform_cleanup()
             except Exception as e:
                 logger.error(f"[TmpCleaner] 清理过程中发生异常: {e}")
-            
-            # 等待下次清理，支持中断
-            if self.stop_event.wait(timeout=self.cleanup_interval):
-                break
-        
+
+            if next_sweep is not None and time.time() >= next_sweep:
+                try:
+                    self._fallback_sweep()
+                except Exception as e:
+                    logger.error(f"[TmpCleaner] 兜底扫描时发生异常: {e}")
+                next_sweep = time.time() + self.sweep_interval
+
+            with self.lock:
+                if self.stop_event.is_set():
+                    break
+                timeout = self.cleanup_interval
+                if next_sweep is not None:
+                    timeout = min(timeout, max(0.0, next_sweep - time.time()))
+                if self.expiry_heap:
+                    timeout = min(timeout, max(0.0, self.expiry_heap[0][0] - time.time()))
+                self.wakeup.wait(timeout=timeout)
+
         logger.info("[TmpCleaner] 清理循环已退出")
-    
+
     def _perform_cleanup(self):
-        """执行一次清理操作"""
+        """删除所有已到期的文件"""
+        with self.lock:
+            expired = self._pop_expired(time.time())
+        if not expired:
+            return
+        deleted_size = sum(entry.size for entry in expired)
+        self._delete(expired)
+        logger.info(f"[TmpCleaner] 清理完成 - 删除文件: {len(expired)}个, 释放空间: {self._format_size(deleted_size)}")
+
+    def _initial_sweep(self):
+        """
+        启动时扫描tmp目录：超过保留时间的文件直接删除，其余文件按修改时间登记，之后不再遍历目录
+        """
         if not self.tmp_dir.exists():
-            logger.debug("[TmpCleaner] 临时目录不存在，跳过清理")
             return
-        
-        current_time = time.time()
-        deleted_count = 0
-        deleted_size = 0
-        error_count = 0
-        
-        logger.debug(f"[TmpCleaner] 开始清理临时文件，当前时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(current_time))}")
-        
-        try:
-            # 遍历tmp目录下的所有文件
-            for file_path in self.tmp_dir.rglob("*"):
-                if self.stop_event.is_set():
-                    logger.info("[TmpCleaner] 收到停止信号，中断清理")
-                    break
-                
-                # 跳过目录
+        now = time.time()
+        deleted = []
+        registered = 0
+        for file_path in self.tmp_dir.rglob("*"):
+            if self.stop_event.is_set():
+                return
+            try:
                 if file_path.is_dir():
                     continue
-                
-                try:
-                    # 检查文件年龄
-                    file_mtime = file_path.stat().st_mtime
-                    file_age = current_time - file_mtime
-                    
-                    if file_age > self.file_max_age:
-                        # 文件过期，删除
-                        file_size = file_path.stat().st_size
-                        file_path.unlink()
-                        
-                        deleted_count += 1
-                        deleted_size += file_size
-                        
-                        logger.debug(f"[TmpCleaner] 已删除过期文件: {file_path.name} "
-                                   f"(年龄: {file_age:.1f}秒, 大小: {file_size}字节)")
-                    
-                except (OSError, FileNotFoundError) as e:
-                    # 文件可能已被其他进程删除或正在使用
-                    error_count += 1
-                    logger.debug(f"[TmpCleaner] 无法删除文件 {file_path.name}: {e}")
-                except Exception as e:
-                    error_count += 1
-                    logger.warning(f"[TmpCleaner] 处理文件 {file_path.name} 时发生异常: {e}")
-        
-        except Exception as e:
-            logger.error(f"[TmpCleaner] 遍历临时目录时发生异常: {e}")
+                stat = file_path.stat()
+                age = now - stat.st_mtime
+                if age > self.file_max_age:
+                    deleted.append(_TmpFile(str(file_path.absolute()), None, 0, stat.st_size, False))
+                else:
+                    self.register(file_path, ttl=self.file_max_age - age)
+                    registered += 1
+            except OSError as e:
+                logger.debug(f"[TmpCleaner] 无法处理文件 {file_path.name}: {e}")
+        self._delete(deleted)
+        self._cleanup_empty_dirs()
+        logger.info(f"[TmpCleaner] 启动扫描完成 - 删除过期文件: {len(deleted)}个, 登记文件: {registered}个")
+
+    def _fallback_sweep(self):
+        """
+        兜底扫描：没有登记的文件（如部分通道下载的图片、语音）超过保留时间后删除，已登记的文件由到期时间管理
+        """
+        if not self.tmp_dir.exists():
             return
-        
-        # 记录清理结果
-        if deleted_count > 0 or error_count > 0:
-            logger.info(f"[TmpCleaner] 清理完成 - 删除文件: {deleted_count}个, "
-                       f"释放空间: {self._format_size(deleted_size)}, "
-                       f"错误: {error_count}个")
-        else:
-            logger.debug("[TmpCleaner] 清理完成 - 无过期文件")
-        
-        # 清理空目录
+        now = time.time()
+        with self.lock:
+            registered = set(self.files)
+        deleted = []
+        for file_path in self.tmp_dir.rglob("*"):
+            if self.stop_event.is_set():
+                return
+            try:
+                path = str(file_path.absolute())
+                if path in registered or file_path.is_dir():
+                    continue
+                stat = file_path.stat()
+                if now - stat.st_mtime > self.file_max_age:
+                    deleted.append(_TmpFile(path, None, 0, stat.st_size, False))
+            except OSError as e:
+                logger.debug(f"[TmpCleaner] 无法处理文件 {file_path.name}: {e}")
+        self._delete(deleted)
         self._cleanup_empty_dirs()
-    
+        if deleted:
+            logger.info(f"[TmpCleaner] 兜底扫描完成 - 删除未登记的过期文件: {len(deleted)}个, "
+                        f"释放空间: {self._format_size(sum(entry.size for entry in deleted))}")
+
     def _cleanup_empty_dirs(self):
         """清理空目录"""
         try:
@@ -158,41 +372,45 @@ class TmpCleaner:
                         pass
         except Exception as e:
             logger.debug(f"[TmpCleaner] 清理空目录时发生异常: {e}")
-    
+
     def _format_size(self, size_bytes: int) -> str:
         """格式化文件大小"""
         if size_bytes == 0:
             return "0B"
-        
+
         units = ['B', 'KB', 'MB', 'GB']
         unit_index = 0
         size = float(size_bytes)
-        
+
         while size >= 1024 and unit_index < len(units) - 1:
             size /= 1024
             unit_index += 1
-        
+
         return f"{size:.1f}{units[unit_index]}"
-    
+
     def force_cleanup(self):
-        """强制执行一次清理（用于测试或手动触发）"""
+        """强制执行一次清理（用于测试或手动触发），会重新全量扫描tmp目录"""
         if not self.cleanup_enabled:
             logger.warning("[TmpCleaner] 清理功能已禁用，无法执行强制清理")
             return
-        
+
         logger.info("[TmpCleaner] 执行强制清理")
         self._perform_cleanup()
+        self._initial_sweep()
 
 
 # 全局清理器实例
 _tmp_cleaner: Optional[TmpCleaner] = None
+_tmp_cleaner_lock = threading.Lock()
 
 
 def get_tmp_cleaner() -> TmpCleaner:
     """获取全局清理器实例"""
     global _tmp_cleaner
     if _tmp_cleaner is None:
-        _tmp_cleaner = TmpCleaner()
+        with _tmp_cleaner_lock:
+            if _tmp_cleaner is None:
+                _tmp_cleaner = TmpCleaner()
     return _tmp_cleaner
 
 
@@ -206,4 +424,17 @@ def stop_tmp_cleaner():
     """停止临时文件清理器"""
     global _tmp_cleaner
     if _tmp_cleaner:
-        _tmp_cleaner.stop()
\ No newline at end of file
+        _tmp_cleaner.stop()
+
+
+def register_tmp_file(path, owner=None, ttl=None, delete_on_release=False):
+    """登记临时文件，参数见TmpCleaner.register"""
+    get_tmp_cleaner().register(path, owner, ttl, delete_on_release)
+
+
+def acquire_tmp_file(path, owner=None, ttl=None):
+    get_tmp_cleaner().acquire(path, owner, ttl)
+
+
+def release_tmp_file(path):
+    get_tmp_cleaner().release(path)
\ No newline at end of file
@@ -1,39 +1,115 @@
+import asyncio
 import threading
 import time
+from collections import OrderedDict
 
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
+    """
+    令牌桶限流器
+    不再使用后台线程生成令牌，而是在获取令牌时根据距上次补充经过的时间计算可用令牌数
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None):
         self.rate = int(tpm) / 60  # 令牌每秒生成速率
-        self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
-
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
+        self.capacity = int(capacity) if capacity else int(tpm)  # 令牌桶容量
+        self.tokens = float(self.capacity)  # 初始令牌数为满桶
+        self.timeout = timeout  # 等待令牌超时时间，None表示一直等待
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+
+    def try_get_token(self):
+        """
+        尝试获取令牌，不等待
+        :return: 获取成功返回0，失败返回需要等待的秒数
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            if self.rate <= 0:
+                return float("inf")
+            return (1 - self.tokens) / self.rate
+
+    def get_token(self, timeout=-1):
+        """
+        获取令牌，令牌不足时等待
+        :param timeout: 等待超时时间，默认使用创建时的timeout
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_get_token()
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
                     return False
-            self.tokens -= 1
-        return True
+            time.sleep(wait)
+
+    async def async_get_token(self, timeout=-1):
+        """获取令牌的协程版本，等待时不阻塞事件循环"""
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_get_token()
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            await asyncio.sleep(wait)
 
     def close(self):
-        self.is_running = False
+        # 没有后台线程需要停止，保留此方法兼容旧的调用方式
+        pass
+
+
+class KeyedTokenBucket:
+    """
+    按key区分的令牌桶，如按用户、群或api key分别限流
+    令牌桶保存在有容量上限的LRU中，长时间未使用的key会被淘汰，被淘汰的key再次使用时视为满桶
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None, max_keys=10000):
+        self.tpm = tpm
+        self.timeout = timeout
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def bucket(self, key) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.tpm, self.timeout, self.capacity)
+                self.buckets[key] = bucket
+                while len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket
+
+    def try_get_token(self, key):
+        return self.bucket(key).try_get_token()
+
+    def get_token(self, key, timeout=-1):
+        return self.bucket(key).get_token(timeout)
+
+    async def async_get_token(self, key, timeout=-1):
+        return await self.bucket(key).async_get_token(timeout)
 
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@
 import json
 import logging
 import os
-import pickle
 import copy
 
 from common.log import logger
@@ -56,6 +55,19 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "concurrency_in_group": 0,  # 同一群聊最多有多少条消息在处理中，0表示不限制
+    "private_chat_weight": 2,  # 私聊消息的调度权重，管理员指令始终优先
+    "group_chat_weight": 1,  # 群聊消息的调度权重
+    "session_queue_max_size": 0,  # 单个会话最多排队的消息数，0表示不限制
+    "queue_max_size": 0,  # 全部会话最多排队的消息数，0表示不限制
+    "queue_overflow_policy": "drop_oldest",  # 会话队列满时的处理策略，可选 drop_oldest, drop_newest, merge(合并文本消息)
+    "burst_merge_window": 0,  # 连续消息合并窗口，单位秒，同一用户在窗口内连续发送的文本消息合并为一条处理，0表示不合并
+    "burst_merge_max_wait": 5,  # 连续消息合并最长等待时间，单位秒
+    # 消息处理线程池配置，按负载类型拆分，避免慢任务阻塞其他消息
+    "llm_pool_workers": 8,  # 对话模型调用线程数
+    "media_pool_workers": 4,  # 图片/视频/文件处理线程数
+    "voice_pool_workers": 4,  # 语音识别与合成线程数
+    "plugin_pool_workers": 4,  # 插件指令线程数
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
@@ -65,9 +77,52 @@ available_setting = {
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
+    # 记忆压缩，会话接近上限时在后台把较早的对话总结成摘要附在人格描述之后，代替直接丢弃
+    "conversation_compact": False,
+    "conversation_compact_ratio": 0.8,  # 会话token数达到conversation_max_tokens的该比例时开始总结
+    "conversation_compact_keep_turns": 2,  # 保留最近几轮对话不参与总结
+    "conversation_compact_max_chars": 300,  # 摘要的最多字数
+    "conversation_compact_model": "gpt-4o-mini",  # 用于总结的模型，使用OpenAI兼容接口
+    "conversation_compact_api_base": "",  # 总结接口地址，默认使用open_ai_api_base
+    "conversation_compact_api_key": "",  # 总结接口的key，默认使用open_ai_api_key
+    "conversation_compact_workers": 2,  # 后台总结的线程数
     # chatgpt限流配置
     "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
+    # 对话限流配置，对所有bot生效，单位为每分钟次数，0表示不限制
+    "rate_limit_chat": 0,  # 全局对话频率限制，超出时排队等待
+    "rate_limit_wait_timeout": 10,  # 全局限流排队等待的最长时间，单位秒
+    "rate_limit_chat_per_user": 0,  # 单个用户的对话频率限制，超出时直接提示
+    "rate_limit_chat_per_group": 0,  # 单个群的对话频率限制，超出时直接提示
+    # 回复缓存，按应用开启，应用标识为"bot类型:模型"，dify为"dify:应用类型"，如 "dify:workflow"、"chatGPT:gpt-4o-mini"
+    "reply_cache_enabled": False,
+    "reply_cache_ttl": 3600,  # 缓存有效期，单位秒，可在规则中单独设置
+    "reply_cache_max_size": 1000,  # 最多缓存的回复数，超出后淘汰最久未使用的
+    # 应用标识(支持通配符) -> {"ttl": 秒, "similarity": 相似匹配阈值0~1，0为只精确匹配, "context": "none"不区分会话 / "session"包含会话历史}
+    # 有会话状态的应用需配置context才会缓存，dify:workflow默认为none
+    "reply_cache_rules": {},
+    # 流式回复，支持的bot边生成边按段落发送，需要语音回复时仍等待完整回复
+    "stream_reply": False,
+    "stream_reply_min_chars": 80,  # 每段的最少字数，较短的段落与下一段合并发送
+    "stream_reply_max_chars": 600,  # 超过该字数仍没有换行时在句末切分
+    # 对话接口的公共HTTP传输层，provider为 openai、linkai、moonshot、minimax、siliconflow
+    "http_pool_size": 10,  # 每个接口地址保持的keep-alive连接数
+    "http_max_retries": 2,  # 连接失败、超时、429和5xx时的重试次数
+    "http_backoff_base": 1.0,  # 重试等待的初始秒数，每次翻倍并加随机抖动
+    "http_backoff_max": 20,  # 重试等待的最长秒数，Retry-After超过该值时不再重试
+    "http_provider_concurrency": {},  # provider -> 最大并发请求数，如 {"moonshot": 4}
+    "http_hedge_after": {},  # provider -> 秒数，超时未返回时再发一个相同的请求，会增加调用量，如 {"linkai": 15}
+    # 对话bot的故障转移，首选bot为bot_type/model对应的bot，出错或超时时依次尝试备用bot
+    "chat_fallback_bots": [],  # 备用的bot，如 [{"bot_type": "moonshot", "model": "moonshot-v1-32k"}]，bot类型见common/const.py；与首选bot类型不同时需指定model，只写bot类型时沿用全局的model
+    "chat_route_rules": {},  # 按群名或会话指定bot列表，写法同chat_fallback_bots，如 {"group:技术交流*": [{"bot_type": "zhipuai", "model": "glm-4-flash"}], "session:wxid_xxx": ["dify"]}
+    "chat_failover_timeout": 0,  # 首选bot超过该秒数未返回时同时请求下一个bot，取先返回的结果，0表示只在出错时转移
+    "chat_race_max_chars": 0,  # 不超过该字数的问题同时请求排名前两位的bot，取先返回的结果，0表示不开启
+    "chat_route_by_latency": False,  # 是否按最近的延迟中位数排序可用的bot，否则按配置顺序
+    "chat_circuit_failures": 3,  # 连续失败该次数后暂时把bot降到最后
+    "chat_circuit_cooldown": 60,  # 降级持续的秒数
+    "chat_router_workers": 8,  # 故障转移和并发请求使用的线程数
+    # 每条消息从收到起的处理时限(秒)，到期后中止进行中的请求和流式回复，不再发送回复，0表示不限时(#reset仍可取消进行中的回复)
+    "reply_deadline": 0,
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
     "top_p": 1,
@@ -129,6 +184,11 @@ available_setting = {
     "text_to_voice": "openai",  # 语音合成引擎，支持openai,baidu,google,azure,xunfei,ali,pytts(offline),elevenlabs,edge(online)
     "text_to_voice_model": "tts-1",
     "tts_voice_id": "alloy",
+    "voice_cache_enabled": True,  # 缓存语音合成和语音识别的结果，相同的文本和语音不重复请求
+    "voice_cache_max_mb": 32,  # 合成和识别缓存各自占用的内存上限
+    "voice_provider_concurrency": {},  # 语音服务商 -> 最大并发请求数，如 {"azure": 4}
+    "voice_tts_chunk_chars": 0,  # 超过该字数的文本按句子切分后并行合成再拼接，0表示不切分
+    "voice_tts_workers": 4,  # 分段合成使用的线程数
     # baidu 语音api配置， 使用百度语音识别和语音合成时需要
     "baidu_app_id": "",
     "baidu_api_key": "",
@@ -143,6 +203,10 @@ available_setting = {
     "xi_voice_id": "",   #ElevenLabs提供了9种英式、美式等英语发音id，分别是"Adam/Antoni/Arnold/Bella/Domi/Elli/Josh/Rachel/Sam"
     # 图像模型设置
     "image_recognition": False, # 是否开启图片识别
+    "vision_image_max_edge": 2048,  # 识图时图片最长边的像素上限，超出后等比缩小，0为不限制
+    "vision_image_max_kb": 1024,  # 识图时图片大小上限，单位KB，超出后降低质量或缩小尺寸，0为不限制
+    "vision_image_format": "JPEG",  # 识图时图片重新编码的格式，可选 JPEG, WEBP
+    "image_cache_mb": 64,  # 预处理后图片缓存的大小上限，单位MB
     # 服务时间限制，目前支持itchat
     "chat_time_module": False,  # 是否开启服务时间限制
     "chat_start_time": "00:00",  # 服务开始时间
@@ -152,6 +216,11 @@ available_setting = {
     # baidu翻译api的配置
     "baidu_translate_app_id": "",  # 百度翻译api的appid
     "baidu_translate_app_key": "",  # 百度翻译api的秘钥
+    "baidu_translate_qps": 1,  # 百度翻译的QPS限制，标准版为1，高级版为10，超出时在本地排队等待
+    "baidu_translate_max_bytes": 5000,  # 批量翻译时每次请求的文本字节数上限
+    "translate_cache_enabled": True,  # 缓存翻译结果，保存在database/translate_cache.db
+    "translate_cache_max_size": 10000,  # 缓存的最多条数，超出后淘汰最久未使用的
+    "translate_cache_memory_size": 1000,  # 内存中保留的最近使用的条数
     # itchat的配置
     "hot_reload": False,  # 是否开启热重载
     # wechaty的配置
@@ -192,11 +261,18 @@ available_setting = {
     "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk,wxpad}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    # 日志配置，在程序启动时从config.json读取
+    "log_level": "INFO",  # 日志级别，可选 DEBUG, INFO, WARNING, ERROR, CRITICAL
+    "log_async": True,  # 是否异步写日志，开启后由后台线程写文件和控制台，不阻塞消息处理
+    "log_json": False,  # 日志文件是否使用json lines格式
+    "log_max_bytes": 52428800,  # 单个日志文件的最大字节数，超过后轮转，0表示不轮转
+    "log_backup_count": 5,  # 保留的轮转日志文件个数
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
+    "plugin_lazy_activation": False,  # 插件延迟激活，已记录监听事件的插件在第一次收到对应事件时才初始化，加快启动
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
     # 智谱AI 平台配置
@@ -225,20 +301,101 @@ available_setting = {
     
     # 临时文件清理配置
     "tmp_cleanup_enabled": True,  # 是否启用临时文件自动清理
-    "tmp_cleanup_interval": 3600,  # 清理检查间隔，单位秒（默认1小时）
+    "tmp_cleanup_interval": 3600,  # 没有文件到期时清理线程的最长等待时间，单位秒（默认1小时）
     "tmp_file_max_age": 3600,  # 临时文件最大保留时间，单位秒（默认1小时）
+    "tmp_sweep_interval": 21600,  # 兜底扫描tmp目录的间隔，单位秒（默认6小时），删除未登记且超过保留时间的文件，0为不扫描
+    "tmp_disk_quota_mb": 0,  # 临时文件占用空间上限，单位MB，超出后删除最久未使用的文件，0为不限制
 }
 
 
+class ConfigSnapshot(object):
+    """
+    配置的只读快照，热路径直接读取属性，避免每次get都经过available_setting校验
+    配置被修改或重载时整体替换为新的快照，处理中的消息继续使用旧快照，读取结果保持一致
+    """
+
+    __slots__ = (
+        "_values",
+        "single_chat_prefix",
+        "single_chat_reply_prefix",
+        "single_chat_reply_suffix",
+        "group_chat_prefix",
+        "group_chat_keyword",
+        "group_chat_reply_prefix",
+        "group_chat_reply_suffix",
+        "group_name_white_list",
+        "group_name_keyword_white_list",
+        "group_chat_in_one_session",
+        "all_group_white_listed",
+        "all_group_in_one_session",
+        "nick_name_black_list",
+        "image_create_prefix",
+        "plugin_trigger_prefix",
+        "accept_friend_commands",
+        "trigger_by_self",
+        "group_at_off",
+        "no_need_at",
+        "always_reply_voice",
+        "voice_reply_voice",
+        "speech_recognition",
+        "dify_conversation_max_messages",
+    )
+
+    def __init__(self, config: dict):
+        values = dict(config)
+        self.single_chat_prefix = tuple(values.get("single_chat_prefix", [""]) or ())
+        self.single_chat_reply_prefix = values.get("single_chat_reply_prefix", "")
+        self.single_chat_reply_suffix = values.get("single_chat_reply_suffix", "")
+        self.group_chat_prefix = tuple(values.get("group_chat_prefix") or ())
+        self.group_chat_keyword = tuple(values.get("group_chat_keyword") or ())
+        self.group_chat_reply_prefix = values.get("group_chat_reply_prefix", "")
+        self.group_chat_reply_suffix = values.get("group_chat_reply_suffix", "")
+        self.group_name_white_list = frozenset(values.get("group_name_white_list") or ())
+        self.group_name_keyword_white_list = tuple(values.get("group_name_keyword_white_list") or ())
+        self.group_chat_in_one_session = frozenset(values.get("group_chat_in_one_session") or ())
+        self.all_group_white_listed = "ALL_GROUP" in self.group_name_white_list
+        self.all_group_in_one_session = "ALL_GROUP" in self.group_chat_in_one_session
+        self.nick_name_black_list = frozenset(values.get("nick_name_black_list") or ())
+        self.image_create_prefix = tuple(values.get("image_create_prefix", [""]) or ())
+        self.plugin_trigger_prefix = values.get("plugin_trigger_prefix", "$")
+        self.accept_friend_commands = frozenset(values.get("accept_friend_commands") or ())
+        self.trigger_by_self = values.get("trigger_by_self", True)
+        self.group_at_off = values.get("group_at_off", False)
+        self.no_need_at = values.get("no_need_at", False)
+        self.always_reply_voice = values.get("always_reply_voice", False)
+        self.voice_reply_voice = values.get("voice_reply_voice", False)
+        self.speech_recognition = values.get("speech_recognition", False)
+        self.dify_conversation_max_messages = values.get("dify_conversation_max_messages", 5)
+        self._values = values  # 最后赋值，此后快照不可修改
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __setattr__(self, key, value):
+        if hasattr(self, "_values"):
+            raise AttributeError("ConfigSnapshot is read-only")
+        super().__setattr__(key, value)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "ConfigSnapshot({} keys)".format(len(self._values))
+
+
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        self._snapshot = None
         if d is None:
             d = {}
         for k, v in d.items():
             self[k] = v
-        # user_datas: 用户数据，key为用户名，value为用户数据，也是dict
-        self.user_datas = {}
+        # user_datas: 用户数据存储，key为用户名，value为用户数据，也是dict，在load_user_datas时打开
+        self.user_datas = None
 
     def __getitem__(self, key):
         if key not in available_setting:
@@ -248,46 +405,56 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self._snapshot = None  # 配置变化，下次读取时重建快照
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError as e:
-            return default
-        except Exception as e:
-            raise e
-            
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return super().get(key, default)
+
     def set(self, key, value):
         try:
             self[key] = value
         except Exception as e:
             raise e
 
-    # Make sure to return a dictionary to ensure atomic
+    def snapshot(self) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = ConfigSnapshot(self)
+            self._snapshot = snapshot
+        return snapshot
+
+    # 返回的dict修改后会立即写入存储；用户不存在时返回空dict，不会为其创建记录
     def get_user_data(self, user) -> dict:
-        if self.user_datas.get(user) is None:
-            self.user_datas[user] = {}
-        return self.user_datas[user]
+        if self.user_datas is None:
+            self.load_user_datas()  # 在load_user_datas之前调用时打开存储
+        return self.user_datas.get(user)
 
     def load_user_datas(self):
+        from database.user_data_db import MemoryUserDataStore, get_user_data_store
+
+        previous = self.user_datas
         try:
-            with open(os.path.join(get_appdata_dir(), "user_datas.pkl"), "rb") as f:
-                self.user_datas = pickle.load(f)
-                logger.info("[Config] User datas loaded.")
-        except FileNotFoundError as e:
-            logger.info("[Config] User datas file not found, ignore.")
+            self.user_datas = get_user_data_store(get_appdata_dir())
+            logger.info("[Config] User datas loaded, users={}.".format(self.user_datas.count()))
         except Exception as e:
-            logger.info("[Config] User datas error: {}".format(e))
-            self.user_datas = {}
+            if isinstance(previous, MemoryUserDataStore):
+                return
+            logger.error("[Config] User datas error, use memory store and datas will be lost on exit: {}".format(e))
+            self.user_datas = MemoryUserDataStore()
+            return
+        if isinstance(previous, MemoryUserDataStore):
+            # 之前打开失败期间写入内存的数据转存到数据库
+            for user, data in previous.items():
+                self.user_datas.save(user, data)
 
     def save_user_datas(self):
-        try:
-            with open(os.path.join(get_appdata_dir(), "user_datas.pkl"), "wb") as f:
-                pickle.dump(self.user_datas, f)
-                logger.info("[Config] User datas saved.")
-        except Exception as e:
-            logger.info("[Config] User datas error: {}".format(e))
+        # 用户数据在修改时已写入，这里只需合并日志文件
+        if self.user_datas is not None:
+            self.user_datas.flush()
+            logger.info("[Config] User datas saved.")
 
 
 config = Config()
@@ -381,6 +548,13 @@ def conf():
     return config
 
 
+def conf_snapshot() -> ConfigSnapshot:
+    """
+    获取当前配置的只读快照，用于消息处理等热路径
+    """
+    return config.snapshot()
+
+
 def get_appdata_dir():
     data_path = os.path.join(get_root(), conf().get("appdata_dir", ""))
     if not os.path.exists(data_path):
@@ -0,0 +1,193 @@
+"""
+用户数据存储
+每个用户一条记录保存在sqlite中，修改时立即写入，进程异常退出也不会丢失；
+内存中用LRU缓存最近访问的用户，查询不存在的用户不会创建任何记录
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from common.log import logger
+
+_MISSING = object()
+
+
+class UserData(dict):
+    """单个用户的数据，修改后自动写回存储"""
+
+    def __init__(self, store, user, data=None):
+        super().__init__(data or {})
+        self._store = store
+        self._user = user
+
+    def _save(self):
+        self._store.save(self._user, self)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._save()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._save()
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self._save()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._save()
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def clear(self):
+        super().clear()
+        self._save()
+
+
+class UserDataStore(object):
+    def __init__(self, db_path, cache_size=1024):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # user -> dict或_MISSING，_MISSING表示数据库中没有该用户
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS user_datas (user TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.commit()
+
+    def _cache_put(self, user, value):
+        self.cache[user] = value
+        self.cache.move_to_end(user)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def load(self, user):
+        """
+        读取用户数据
+        :return: 用户数据的dict，用户不存在时返回None
+        """
+        with self.lock:
+            value = self.cache.get(user)
+            if value is not None:
+                self.cache.move_to_end(user)
+                return None if value is _MISSING else value
+            row = self.conn.execute("SELECT data FROM user_datas WHERE user=?", (str(user),)).fetchone()
+            value = json.loads(row[0]) if row else _MISSING
+            self._cache_put(user, value)
+            return None if value is _MISSING else value
+
+    def get(self, user) -> UserData:
+        """获取用户数据，用户不存在时返回一个空的UserData，只有写入后才会保存"""
+        data = self.load(user)
+        return UserData(self, user, data)
+
+    def save(self, user, data: dict):
+        with self.lock:
+            try:
+                if data:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO user_datas (user, data) VALUES (?, ?)",
+                        (str(user), json.dumps(dict(data), ensure_ascii=False)),
+                    )
+                    self._cache_put(user, dict(data))
+                else:
+                    self.conn.execute("DELETE FROM user_datas WHERE user=?", (str(user),))
+                    self._cache_put(user, _MISSING)
+                self.conn.commit()
+            except Exception as e:
+                logger.error("[UserDataStore] save user data error: {}".format(e))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM user_datas").fetchone()[0]
+
+    def import_pickle(self, pkl_path):
+        """导入旧版本的user_datas.pkl，导入成功后重命名为.bak"""
+        if not os.path.exists(pkl_path):
+            return
+        try:
+            with open(pkl_path, "rb") as f:
+                user_datas = pickle.load(f)
+            for user, data in user_datas.items():
+                if data:
+                    self.save(user, data)
+            os.replace(pkl_path, pkl_path + ".bak")
+            logger.info("[UserDataStore] imported {} users from {}".format(len(user_datas), pkl_path))
+        except Exception as e:
+            logger.error("[UserDataStore] import {} error: {}".format(pkl_path, e))
+
+    def flush(self):
+        """把WAL日志合并到数据库文件，数据在每次写入时已提交，这里只是减小日志文件"""
+        with self.lock:
+            try:
+                self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            except Exception as e:
+                logger.warning("[UserDataStore] checkpoint error: {}".format(e))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class MemoryUserDataStore(object):
+    """数据库无法打开时使用的内存存储，接口与UserDataStore相同，数据在进程退出后丢失"""
+
+    def __init__(self):
+        self.datas = {}
+        self.lock = threading.Lock()
+
+    def load(self, user):
+        with self.lock:
+            data = self.datas.get(user)
+            return dict(data) if data is not None else None
+
+    def get(self, user) -> UserData:
+        return UserData(self, user, self.load(user))
+
+    def save(self, user, data: dict):
+        with self.lock:
+            if data:
+                self.datas[user] = dict(data)
+            else:
+                self.datas.pop(user, None)
+
+    def items(self):
+        with self.lock:
+            return list(self.datas.items())
+
+    def count(self):
+        return len(self.datas)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_user_data_store(appdata_dir) -> UserDataStore:
+    """同一数据目录共用一个存储实例，重载配置时不会重复打开数据库"""
+    db_path = os.path.join(appdata_dir, "user_datas.db")
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = UserDataStore(db_path)
+            store.import_pickle(os.path.join(appdata_dir, "user_datas.pkl"))
+            _stores[db_path] = store
+        return store
@@ -1,6 +1,12 @@
 import requests
 
 
+def _timeout():
+    """在消息的截止时间内请求时，超时时间不超过剩余时间；否则与原来一样不设超时"""
+    from common.deadline import deadline_timeout
+    return deadline_timeout(None)
+
+
 class DifyClient:
     def __init__(self, api_key, base_url: str = 'https://api.dify.ai/v1'):
         self.api_key = api_key
@@ -13,7 +19,8 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, json=json, params=params, headers=headers, stream=stream)
+        response = requests.request(method, url, json=json, params=params, headers=headers, stream=stream,
+                                    timeout=_timeout())
 
         return response
 
@@ -23,7 +30,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, data=data, headers=headers, files=files)
+        response = requests.request(method, url, data=data, headers=headers, files=files, timeout=_timeout())
 
         return response
 
@@ -11,6 +11,7 @@ from plugins import register
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_message import ChatMessage
+from common.tmp_cleaner import acquire_tmp_file, register_tmp_file, release_tmp_file
 from .module.video_parser import VideoParser
 from .module.audio_transcriber import AudioTranscriber
 from .module.video_analyzer import VideoAnalyzer
@@ -104,6 +105,8 @@ class TongyiPlugin(Plugin):
             self.last_cleanup_time = time.time()
             self.cleanup_interval = 3600  # 每小时清理一次
             self.file_max_age = 7200  # 文件最大保存时间（2小时）
+            # 只在启动时清理一次上次运行遗留的文件，之后新产生的文件登记到临时文件清理器，到期或用完后删除
+            self._cleanup_files(force=True)
             
             # 初始化图片识别相关变量
             self.waiting_for_image = {}
@@ -286,9 +289,6 @@ class TongyiPlugin(Plugin):
         """处理视频分享"""
         video_path = None
         try:
-            # 定期清理文件
-            self._cleanup_files()
-            
             # 发送处理提示
             process_reply = Reply(ReplyType.TEXT, "正在处理视频，请稍候...")
             e_context["channel"].send(process_reply, e_context["context"])
@@ -352,6 +352,10 @@ class TongyiPlugin(Plugin):
             e_context["channel"].send(info_reply, e_context["context"])
             
             video_path = video_info.get("video_path", "")
+            if video_path:
+                # 分析完成后立即删除；处理异常中断时由清理器在保存时间到期后删除
+                register_tmp_file(video_path, owner="TongyiPlugin", ttl=self.file_max_age, delete_on_release=True)
+                acquire_tmp_file(video_path)
             
             try:
                 # 提取音频并转写
@@ -530,6 +534,7 @@ class TongyiPlugin(Plugin):
 
     def _cleanup_video_file(self, video_path):
         """清理单个视频文件"""
+        release_tmp_file(video_path)
         if video_path and os.path.exists(video_path):
             try:
                 os.remove(video_path)
@@ -602,6 +607,7 @@ class TongyiPlugin(Plugin):
                 if response.status_code == 200:
                     with open(temp_path, 'wb') as f:
                         f.write(response.content)
+                    register_tmp_file(temp_path, owner="TongyiPlugin", ttl=self.file_max_age)
                     return temp_path
             
             logger.error(f"[TongyiPlugin] 未找到图片文件: {content}")
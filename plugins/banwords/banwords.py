@@ -2,14 +2,19 @@
 
 import json
 import os
+import threading
+import time
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.file_watcher import file_watcher
 from common.log import logger
 from plugins import *
+from plugins.plugin_utils import get_trigger_prefix, is_admin, set_reply_text
 
-from .lib.WordsSearch import WordsSearch
+from .lib.CompactWordsSearch import CompactWordsSearch
+from .lib.DynamicWordsSearch import DynamicWordsSearch
 
 
 @plugins.register(
@@ -35,16 +40,23 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
             self.action = conf["action"]
-            banwords_path = os.path.join(curdir, "banwords.txt")
-            with open(banwords_path, "r", encoding="utf-8") as f:
-                words = []
-                for line in f:
-                    word = line.strip()
-                    if word:
-                        words.append(word)
-            self.searchr.SetKeywords(words)
+            self.options = {
+                "ignore_case": conf.get("ignore_case", False),
+                "ignore_fullwidth": conf.get("ignore_fullwidth", False),
+                "ignore_symbols": conf.get("ignore_symbols", False),
+            }
+            self.banwords_path = os.path.join(curdir, "banwords.txt")
+            self.cache_path = os.path.join(curdir, "banwords.dat")
+            # 增删的词超过该数量后在后台重建主自动机
+            self.max_pending_changes = conf.get("max_pending_changes", 500)
+            self.lock = threading.Lock()
+            self.rebuilding = False
+            self.rebuild_again = False
+            data, words = self._read_words()
+            self.searchr = DynamicWordsSearch(self._build_base(data, words), words, self.options)
+            if conf.get("hot_reload", True):
+                file_watcher.watch(self.banwords_path, self._on_file_changed)
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
@@ -54,6 +66,92 @@ class Banwords(Plugin):
             logger.warn("[Banwords] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/banwords .")
             raise e
 
+    def _read_words(self):
+        with open(self.banwords_path, "rb") as f:
+            data = f.read()
+        words = []
+        for line in data.decode("utf-8").splitlines():
+            word = line.strip()
+            if word:
+                words.append(word)
+        return data, words
+
+    def _build_base(self, data, words):
+        """优先加载缓存的自动机，词库或匹配选项变化后重新构建并保存"""
+        base = CompactWordsSearch.Load(self.cache_path, data, **self.options)
+        if base:
+            logger.debug("[Banwords] loaded automaton from {}".format(self.cache_path))
+            return base
+        base = CompactWordsSearch(**self.options)
+        base.SetKeywords(words)
+        try:
+            base.Save(self.cache_path, data)
+        except Exception as e:
+            logger.warning("[Banwords] save automaton failed: {}".format(e))
+        return base
+
+    def _on_file_changed(self, path):
+        logger.info("[Banwords] {} changed, reloading".format(path))
+        self.rebuild_async()
+
+    def rebuild_async(self):
+        """在后台线程中按banwords.txt重建主自动机，完成后替换；重建期间的再次请求合并为一次"""
+        with self.lock:
+            if self.rebuilding:
+                self.rebuild_again = True
+                return
+            self.rebuilding = True
+        threading.Thread(target=self._rebuild, name="BanwordsRebuild", daemon=True).start()
+
+    def _rebuild(self):
+        while True:
+            try:
+                start = time.time()
+                since = self.searchr
+                data, words = self._read_words()
+                base = self._build_base(data, words)
+                with self.lock:
+                    self.searchr = self.searchr.rebase(base, words, since)
+                logger.info("[Banwords] rebuilt {} words in {:.2f}s".format(len(words), time.time() - start))
+            except Exception as e:
+                logger.error("[Banwords] rebuild failed: {}".format(e))
+            with self.lock:
+                if not self.rebuild_again:
+                    self.rebuilding = False
+                    return
+                self.rebuild_again = False
+
+    def update_words(self, add=(), remove=()):
+        """
+        增删敏感词，立即生效并写回banwords.txt
+        只重建增量自动机，累计变更较多时再在后台重建主自动机
+        """
+        with self.lock:
+            self.searchr = self.searchr.with_changes(add, remove)
+            self._edit_words_file(add, remove)
+            file_watcher.mark_updated(self.banwords_path)
+            pending = self.searchr.pending
+        if pending > self.max_pending_changes:
+            self.rebuild_async()
+
+    def _edit_words_file(self, add, remove):
+        """在banwords.txt中原地删除和追加词，其余行（空行、顺序、换行符）保持不变"""
+        with open(self.banwords_path, "r", encoding="utf-8", newline="") as f:
+            lines = f.readlines()
+        remove = set(w.strip() for w in remove)
+        lines = [line for line in lines if line.strip() not in remove]
+        existing = set(line.strip() for line in lines)
+        newline = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            lines[-1] += newline
+        for word in add:
+            word = word.strip()
+            if word and word not in existing:
+                lines.append(word + newline)
+                existing.add(word)
+        with open(self.banwords_path, "w", encoding="utf-8", newline="") as f:
+            f.writelines(lines)
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type not in [
             ContextType.TEXT,
@@ -63,15 +161,19 @@ class Banwords(Plugin):
 
         content = e_context["context"].content
         logger.debug("[Banwords] on_handle_context. content: %s" % content)
+        if e_context["context"].type == ContextType.TEXT and content.startswith(get_trigger_prefix() + "banwords"):
+            self._process_admin_cmd(e_context)
+            return
+        searchr = self.searchr
         if self.action == "ignore":
-            f = self.searchr.FindFirst(content)
+            f = searchr.FindFirst(content)
             if f:
                 logger.info("[Banwords] %s in message" % f["Keyword"])
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + self.searchr.Replace(content))
+            if searchr.ContainsAny(content):
+                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + searchr.Replace(content))
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
                 return
@@ -82,19 +184,50 @@ class Banwords(Plugin):
 
         reply = e_context["reply"]
         content = reply.content
+        searchr = self.searchr
         if self.reply_action == "ignore":
-            f = self.searchr.FindFirst(content)
+            f = searchr.FindFirst(content)
             if f:
                 logger.info("[Banwords] %s in reply" % f["Keyword"])
                 e_context["reply"] = None
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.reply_action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + self.searchr.Replace(content))
+            if searchr.ContainsAny(content):
+                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + searchr.Replace(content))
                 e_context["reply"] = reply
                 e_context.action = EventAction.CONTINUE
                 return
 
-    def get_help_text(self, **kwargs):
-        return "过滤消息中的敏感词。"
+    def _process_admin_cmd(self, e_context: EventContext):
+        cmd = e_context["context"].content.split()
+        if not is_admin(e_context):
+            set_reply_text("需要管理员权限执行", e_context, level=ReplyType.ERROR)
+            return
+        if len(cmd) >= 3 and cmd[1] in ("add", "del"):
+            words = cmd[2:]
+            if cmd[1] == "add":
+                self.update_words(add=words)
+                set_reply_text("已添加{}个敏感词".format(len(words)), e_context, level=ReplyType.INFO)
+            else:
+                self.update_words(remove=words)
+                set_reply_text("已删除{}个敏感词".format(len(words)), e_context, level=ReplyType.INFO)
+            return
+        if len(cmd) == 2 and cmd[1] == "reload":
+            self.rebuild_async()
+            set_reply_text("正在后台重新加载敏感词库", e_context, level=ReplyType.INFO)
+            return
+        set_reply_text(self.get_help_text(verbose=True), e_context, level=ReplyType.INFO)
+
+    def get_help_text(self, verbose=False, **kwargs):
+        help_text = "过滤消息中的敏感词。"
+        if not verbose:
+            return help_text
+        trigger_prefix = get_trigger_prefix()
+        stats = self.searchr.stats()
+        help_text += "\n当前词库: {}个词，待合并变更{}个".format(stats["keywords"] + stats["added"] - stats["removed"], stats["added"] + stats["removed"])
+        help_text += "\n\n管理员指令：\n"
+        help_text += f"{trigger_prefix}banwords add 词1 词2: 添加敏感词\n"
+        help_text += f"{trigger_prefix}banwords del 词1 词2: 删除敏感词\n"
+        help_text += f"{trigger_prefix}banwords reload: 重新加载banwords.txt"
+        return help_text
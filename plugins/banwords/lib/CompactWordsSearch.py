@@ -0,0 +1,420 @@
+# -*- coding:utf-8 -*-
+"""
+紧凑的AC自动机，接口与WordsSearch保持一致
+
+- 字符先映射为连续的小整数编码，每个状态的转移按编码排序后连续存放在两个int数组中，通过二分查找转移，
+  所有数据都在几个array中，不再为每个节点创建对象和dict
+- 没有使用双数组trie：敏感词的后继字符分布很散，双数组为避免冲突需要大量空位，纯python下构建也很慢
+- 构建结果可以保存为二进制文件，启动时通过mmap直接加载，不需要重新构建
+- 支持忽略大小写、全角/半角、词中间穿插的符号（如"敏*感*词"）
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+__all__ = ["CompactWordsSearch"]
+
+_MAGIC = b"CWS1"
+# magic, 字节序, 选项, 状态数, 转移数, 字符数, 关键词数, 关键词文本字节数, 签名(sha1)
+_HEADER = struct.Struct("<4sBBxxIIIII20s")
+
+_OPT_IGNORE_CASE = 1
+_OPT_IGNORE_FULLWIDTH = 2
+_OPT_IGNORE_SYMBOLS = 4
+
+
+def _fullwidth_table():
+    # 全角ASCII字符和全角空格转为半角
+    table = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+    table[0x3000] = 0x20
+    return table
+
+
+@lru_cache(maxsize=4096)
+def _is_symbol(ch):
+    # 标点、符号、空白和零宽字符等控制字符
+    return unicodedata.category(ch)[0] in "PSZC"
+
+
+def _int_array(size, value=0):
+    return array("i", [value]) * size
+
+
+class CompactWordsSearch(object):
+    def __init__(self, ignore_case=False, ignore_fullwidth=False, ignore_symbols=False):
+        self.ignore_case = ignore_case
+        self.ignore_fullwidth = ignore_fullwidth
+        self.ignore_symbols = ignore_symbols
+        self._table = _fullwidth_table() if ignore_fullwidth else None
+        self._cmap = {}  # 字符 -> 编码
+        self._start = self._labels = self._targets = None  # 状态state的转移为labels/targets[start[state]:start[state + 1]]
+        self._fail = None
+        self._own = None  # 状态自身对应的关键词序号，-1表示不是词尾
+        self._out = None  # 自身或失败链上最近的词尾状态，-1表示没有
+        self._root_next = None  # 根状态的转移直接按编码索引
+        self._klen = None  # 关键词归一化后的长度
+        self._kw_offsets = None
+        self._kw_blob = b""
+        self._mmap = None
+
+    # ---------- 构建 ----------
+
+    def _options(self):
+        return (
+            (_OPT_IGNORE_CASE if self.ignore_case else 0)
+            | (_OPT_IGNORE_FULLWIDTH if self.ignore_fullwidth else 0)
+            | (_OPT_IGNORE_SYMBOLS if self.ignore_symbols else 0)
+        )
+
+    def _normalize(self, text):
+        """按选项归一化文本，不改变长度，保证匹配位置可以对应回原文"""
+        if self._table:
+            text = text.translate(self._table)
+        if self.ignore_case:
+            lowered = text.lower()
+            if len(lowered) == len(text):
+                text = lowered
+        return text
+
+    def _normalize_keyword(self, word):
+        word = self._normalize(word)
+        if self.ignore_symbols:
+            word = "".join(ch for ch in word if not _is_symbol(ch))
+        return word
+
+    def SetKeywords(self, keywords):
+        keywords = list(keywords)
+        normalized = [self._normalize_keyword(w) for w in keywords]
+
+        # 出现次数多的字符分配小编码
+        freq = {}
+        for w in normalized:
+            for ch in w:
+                freq[ch] = freq.get(ch, 0) + 1
+        cmap = {ch: i + 1 for i, ch in enumerate(sorted(freq, key=lambda c: (-freq[c], c)))}
+
+        # 先构建临时的dict trie
+        children = [{}]
+        own = [-1]
+        for index, w in enumerate(normalized):
+            if not w:
+                continue
+            node = 0
+            for ch in w:
+                code = cmap[ch]
+                nxt = children[node].get(code)
+                if nxt is None:
+                    nxt = len(children)
+                    children[node][code] = nxt
+                    children.append({})
+                    own.append(-1)
+                node = nxt
+            if own[node] < 0:
+                own[node] = index
+
+        # 按层序重新编号，每个状态的转移按编码排序后连续存放在labels/targets中
+        order = [0]
+        state_of = [0] * len(children)  # trie节点 -> 状态
+        for node in order:
+            for code in sorted(children[node]):
+                kid = children[node][code]
+                state_of[kid] = len(order)
+                order.append(kid)
+        size = len(order)
+        start = array("i", [0])
+        labels = array("i")
+        targets = array("i")
+        for node in order:
+            kids = children[node]
+            for code in sorted(kids):
+                labels.append(code)
+                targets.append(state_of[kids[code]])
+            start.append(len(labels))
+
+        # 失败链和输出链，层序保证较浅状态的失败链先计算好
+        fail = _int_array(size)
+        own_arr = array("i", (own[node] for node in order))
+        out = _int_array(size, -1)
+        for state in range(1, size):
+            for i in range(start[state], start[state + 1]):
+                code, child = labels[i], targets[i]
+                f = fail[state]
+                while True:
+                    lo, hi = start[f], start[f + 1]
+                    j = bisect_left(labels, code, lo, hi)
+                    if j < hi and labels[j] == code:
+                        f = targets[j]
+                        break
+                    if f == 0:
+                        break
+                    f = fail[f]
+                fail[child] = f
+        for state in range(1, size):
+            out[state] = state if own_arr[state] >= 0 else out[fail[state]]
+
+        self._cmap = cmap
+        self._start, self._labels, self._targets = start, labels, targets
+        self._fail, self._own, self._out = fail, own_arr, out
+        self._root_next = self._build_root_next()
+        self._klen = array("i", (len(w) for w in normalized))
+        self._set_keywords_blob(keywords)
+        self._mmap = None
+
+    def _build_root_next(self):
+        root_next = _int_array(len(self._cmap) + 1)
+        for i in range(self._start[0], self._start[1]):
+            root_next[self._labels[i]] = self._targets[i]
+        return root_next
+
+    def _set_keywords_blob(self, keywords):
+        offsets = array("i", [0])
+        parts = []
+        total = 0
+        for w in keywords:
+            data = w.encode("utf-8")
+            parts.append(data)
+            total += len(data)
+            offsets.append(total)
+        self._kw_offsets = offsets
+        self._kw_blob = b"".join(parts)
+
+    def _keyword(self, index):
+        return bytes(self._kw_blob[self._kw_offsets[index]:self._kw_offsets[index + 1]]).decode("utf-8")
+
+    # ---------- 保存和加载 ----------
+
+    def Save(self, path, signature=b""):
+        """保存为二进制文件，signature用于加载时判断词库和选项是否变化"""
+        cmap_arr = array("i")
+        for ch, code in self._cmap.items():
+            cmap_arr.append(ord(ch))
+            cmap_arr.append(code)
+        blob = bytes(self._kw_blob)
+        header = _HEADER.pack(
+            _MAGIC,
+            0 if sys.byteorder == "little" else 1,
+            self._options(),
+            len(self._fail),
+            len(self._labels),
+            len(self._cmap),
+            len(self._klen),
+            len(blob),
+            hashlib.sha1(signature).digest(),
+        )
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            for arr in (self._start, self._labels, self._targets, self._fail, self._own, self._out, cmap_arr, self._klen, self._kw_offsets):
+                f.write(arr.tobytes() if isinstance(arr, array) else bytes(arr))
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def Load(cls, path, signature=b"", ignore_case=False, ignore_fullwidth=False, ignore_symbols=False):
+        """
+        通过mmap加载Save保存的文件，状态数组直接引用文件内容
+        :return: 文件不存在、格式不符或签名、选项不一致时返回None
+        """
+        if not os.path.exists(path):
+            return None
+        searcher = cls(ignore_case, ignore_fullwidth, ignore_symbols)
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, byteorder, options, states, edges, chars, words, blob_size, digest = _HEADER.unpack_from(mm, 0)
+            if (
+                magic != _MAGIC
+                or byteorder != (0 if sys.byteorder == "little" else 1)
+                or options != searcher._options()
+                or digest != hashlib.sha1(signature).digest()
+            ):
+                mm.close()
+                return None
+            view = memoryview(mm)
+            offset = _HEADER.size
+
+            def take(count):
+                nonlocal offset
+                part = view[offset:offset + count * 4].cast("i")
+                offset += count * 4
+                return part
+
+            searcher._start = take(states + 1)
+            searcher._labels = take(edges)
+            searcher._targets = take(edges)
+            searcher._fail = take(states)
+            searcher._own = take(states)
+            searcher._out = take(states)
+            cmap_arr = take(chars * 2)
+            searcher._cmap = {chr(cmap_arr[i]): cmap_arr[i + 1] for i in range(0, chars * 2, 2)}
+            searcher._klen = take(words)
+            searcher._kw_offsets = take(words + 1)
+            searcher._kw_blob = view[offset:offset + blob_size]
+            searcher._root_next = searcher._build_root_next()
+            searcher._mmap = mm
+            return searcher
+        except Exception:
+            mm.close()
+            return None
+
+    # ---------- 查找 ----------
+
+    def _scan(self, text, first_only):
+        """
+        逐字符匹配，返回[(关键词序号, 起始位置, 结束位置)]
+        开启ignore_symbols时，符号不改变状态，起始位置需要根据实际消费的字符位置计算
+        """
+        results = []
+        if not text or self._fail is None:
+            return results
+        norm = self._normalize(text)
+        cmap_get = self._cmap.get
+        start, labels, targets, fail = self._start, self._labels, self._targets, self._fail
+        own, out, klen, root_next = self._own, self._out, self._klen, self._root_next
+        skip_symbols = self.ignore_symbols
+        positions = [] if skip_symbols else None
+        state = 0
+        for i, ch in enumerate(norm):
+            code = cmap_get(ch)
+            if code is None:
+                if skip_symbols and _is_symbol(ch):
+                    continue
+                state = 0
+                continue
+            if skip_symbols:
+                positions.append(i)
+            # 沿失败链查找转移，回到根状态时直接按编码索引
+            while state:
+                lo, hi = start[state], start[state + 1]
+                if lo != hi:
+                    j = bisect_left(labels, code, lo, hi)
+                    if j < hi and labels[j] == code:
+                        state = targets[j]
+                        break
+                state = fail[state]
+            else:
+                state = root_next[code]
+            hit = out[state]
+            while hit >= 0:
+                index = own[hit]
+                length = klen[index]
+                begin = positions[len(positions) - length] if skip_symbols else i + 1 - length
+                results.append((index, begin, i))
+                if first_only:
+                    return results
+                hit = out[fail[hit]]
+        return results
+
+    def _result(self, match):
+        index, start, end = match
+        return {"Keyword": self._keyword(index), "Success": True, "End": end, "Start": start, "Index": index}
+
+    def FindFirst(self, text):
+        matches = self._scan(text, True)
+        return self._result(matches[0]) if matches else None
+
+    def FindAll(self, text):
+        return [self._result(m) for m in self._scan(text, False)]
+
+    def ContainsAny(self, text):
+        return bool(self._scan(text, True))
+
+    def Replace(self, text, replaceChar="*"):
+        matches = self._scan(text, False)
+        if not matches:
+            return text
+        result = list(text)
+        for _, start, end in matches:
+            for j in range(start, end + 1):
+                result[j] = replaceChar
+        return "".join(result)
+
+    def FindFirstBatch(self, texts):
+        """批量查找，返回与texts一一对应的结果列表"""
+        return [self.FindFirst(text) for text in texts]
+
+    def ContainsAnyBatch(self, texts):
+        return [bool(self._scan(text, True)) for text in texts]
+
+    def stats(self):
+        return {
+            "states": len(self._fail) if self._fail is not None else 0,
+            "chars": len(self._cmap),
+            "keywords": len(self._klen) if self._klen is not None else 0,
+            "mmap": self._mmap is not None,
+        }
+
+    def close(self):
+        if self._mmap is not None:
+            self._start = self._labels = self._targets = None
+            self._fail = self._own = self._out = self._root_next = None
+            self._klen = self._kw_offsets = None
+            self._kw_blob = b""
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # 仍有memoryview引用时由gc回收
+            self._mmap = None
+
+
+if __name__ == "__main__":
+    # 基准测试：与WordsSearch对比构建耗时、内存和扫描吞吐
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+
+    from WordsSearch import WordsSearch
+
+    random.seed(1)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    words = list({"".join(random.choices(chars, k=random.randint(2, 6))) for _ in range(50000)})
+    texts = ["".join(random.choices(chars, k=200)) for _ in range(2000)]
+    total_chars = sum(len(t) for t in texts)
+
+    def measure(name, build):
+        # tracemalloc会显著拖慢构建，耗时和内存分开测量
+        start = time.perf_counter()
+        searcher = build()
+        build_time = time.perf_counter() - start
+        del searcher
+        tracemalloc.start()
+        searcher = build()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        scan_time = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            found = sum(1 for t in texts if searcher.FindFirst(t))
+            scan_time = min(scan_time, time.perf_counter() - start)
+        print(
+            f"{name:<18} build {build_time:6.2f}s  memory {memory / 1024 / 1024:7.1f}MB  "
+            f"scan {total_chars / scan_time / 1e6:5.2f}M chars/s  hits {found}"
+        )
+        return searcher
+
+    def build_old():
+        s = WordsSearch()
+        s.SetKeywords(words)
+        return s
+
+    def build_new():
+        s = CompactWordsSearch()
+        s.SetKeywords(words)
+        return s
+
+    print(f"{len(words)} keywords, {len(texts)} texts, {total_chars} chars")
+    measure("WordsSearch", build_old)
+    compact = measure("CompactWordsSearch", build_new)
+    path = os.path.join(tempfile.gettempdir(), "banwords_bench.dat")
+    compact.Save(path, b"bench")
+    measure("Compact(mmap)", lambda: CompactWordsSearch.Load(path, b"bench")).close()
+    print(f"binary file size {os.path.getsize(path) / 1024 / 1024:.1f}MB")
+    os.unlink(path)
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+"""
+可增量更新的敏感词查找
+
+由一个完整构建的主自动机和一个只包含新增词的小自动机组成，删除的词在匹配结果中过滤。
+增删少量词时只重建很小的增量自动机，立即生效；词库整体变化时由调用方在后台重新构建主自动机后替换。
+对象创建后不再修改，每次增删都返回新对象，调用方直接替换引用即可，匹配中的线程不受影响。
+"""
+
+from .CompactWordsSearch import CompactWordsSearch
+
+__all__ = ["DynamicWordsSearch"]
+
+
+class DynamicWordsSearch(object):
+    def __init__(self, base: CompactWordsSearch, words, options=None, added=(), removed=(), word_set=None):
+        self.base = base
+        self.words = tuple(words)  # 主自动机中的词
+        self.word_set = word_set if word_set is not None else frozenset(self.words)
+        self.options = options or {}
+        self.added = tuple(added)  # 不在主自动机中的新增词
+        self.removed = frozenset(removed)  # 从主自动机中删除的词
+        self.delta = None
+        if self.added:
+            self.delta = CompactWordsSearch(**self.options)
+            self.delta.SetKeywords(self.added)
+
+    @property
+    def pending(self):
+        """尚未合并进主自动机的变更数"""
+        return len(self.added) + len(self.removed)
+
+    def all_words(self):
+        words = [w for w in self.words if w not in self.removed] if self.removed else list(self.words)
+        words.extend(self.added)
+        return words
+
+    def with_changes(self, add=(), remove=()):
+        added = list(self.added)
+        removed = set(self.removed)
+        for w in add:
+            if w in removed:
+                removed.discard(w)
+            elif w not in self.word_set and w not in added:
+                added.append(w)
+        for w in remove:
+            if w in added:
+                added.remove(w)
+            elif w in self.word_set:
+                removed.add(w)
+        return DynamicWordsSearch(self.base, self.words, self.options, added, removed, self.word_set)
+
+    def rebase(self, base: CompactWordsSearch, words, since):
+        """
+        换上新构建的主自动机，words为构建时使用的词表，since为开始构建时的对象
+        构建期间（since之后）发生的增删继续保留在增量中
+        """
+        new = DynamicWordsSearch(base, words, self.options)
+        if since is self:
+            return new
+        before = set(since.all_words())
+        current = self.all_words()
+        current_set = set(current)
+        added = [w for w in current if w not in before]
+        removed = [w for w in before if w not in current_set]
+        return new.with_changes(added, removed)
+
+    # ---------- 查找 ----------
+
+    def _base_matches(self, text):
+        if not self.removed:
+            return self.base.FindAll(text)
+        return [m for m in self.base.FindAll(text) if m["Keyword"] not in self.removed]
+
+    def FindFirst(self, text):
+        if self.removed:
+            matches = self._base_matches(text)
+            first = matches[0] if matches else None
+        else:
+            first = self.base.FindFirst(text)
+        if self.delta is not None:
+            found = self.delta.FindFirst(text)
+            if found and (first is None or found["End"] < first["End"]):
+                first = found
+        return first
+
+    def FindAll(self, text):
+        matches = self._base_matches(text)
+        if self.delta is not None:
+            matches.extend(self.delta.FindAll(text))
+            matches.sort(key=lambda m: m["End"])
+        return matches
+
+    def ContainsAny(self, text):
+        if not self.removed and self.base.ContainsAny(text):
+            return True
+        if self.removed and self._base_matches(text):
+            return True
+        return self.delta is not None and self.delta.ContainsAny(text)
+
+    def Replace(self, text, replaceChar="*"):
+        if not self.removed and self.delta is None:
+            return self.base.Replace(text, replaceChar)
+        matches = self.FindAll(text)
+        if not matches:
+            return text
+        result = list(text)
+        for m in matches:
+            for j in range(m["Start"], m["End"] + 1):
+                result[j] = replaceChar
+        return "".join(result)
+
+    def stats(self):
+        stats = self.base.stats()
+        stats.update({"added": len(self.added), "removed": len(self.removed)})
+        return stats
@@ -131,6 +131,10 @@ ADMIN_COMMANDS = {
         "alias": ["debug", "调试模式", "DEBUG"],
         "desc": "开启机器调试日志",
     },
+    "stats": {
+        "alias": ["stats", "运行状态"],
+        "desc": "查看消息处理线程池等运行指标",
+    },
 }
 
 def generate_temporary_password(length=12):
@@ -392,6 +396,50 @@ class Godcmd(Plugin):
                             else:
                                 logger.setLevel(logging.DEBUG)
                                 ok, result = True, "DEBUG模式已开启"
+                        elif cmd == "stats":
+                            from channel import chat_channel
+                            ok = True
+                            result = "线程池状态：\n"
+                            for name, stat in chat_channel.handler_pools.stats().items():
+                                result += (f"{name}: 线程{stat['workers']} 排队{stat['queued']} 执行中{stat['running']} "
+                                           f"平均等待{stat['avg_wait']:.2f}s 最长等待{stat['max_wait']:.2f}s\n")
+                            if hasattr(channel, "scheduler"):
+                                stat = channel.scheduler.stats()
+                                result += (f"调度队列：会话{stat['sessions']} 排队{stat['queued']} 执行中{stat['running']} "
+                                           f"丢弃{stat['dropped']} 合并{stat['merged']}\n")
+                            reply_cache = Bridge().reply_cache
+                            if reply_cache is not None:
+                                stat = reply_cache.stats()
+                                result += f"回复缓存：{stat['size']}条\n"
+                                for app, app_stat in stat["apps"].items():
+                                    result += (f"{app}: 命中{app_stat['hits']} 相似命中{app_stat['similar_hits']} "
+                                               f"未命中{app_stat['misses']} 命中率{app_stat['hit_rate']:.1%}\n")
+                            chat_router = Bridge().chat_router
+                            if chat_router is not None:
+                                for bot_type, stat in chat_router.stats().items():
+                                    result += (f"{bot_type}: 调用{stat['calls']} 错误率{stat['error_rate']:.1%} 超时{stat['timeouts']} "
+                                               f"采用{stat['wins']} p50 {stat['p50']:.2f}s p95 {stat['p95']:.2f}s"
+                                               f"{' 已降级' if stat['degraded'] else ''}\n")
+                            from bot.http_transport import get_transport
+                            for provider, stat in get_transport().stats().items():
+                                result += (f"{provider}: 请求{stat['requests']} 错误{stat['errors']} 重试{stat['retries']} "
+                                           f"对冲{stat['hedged']}/{stat['hedge_wins']} 进行中{stat['inflight']} "
+                                           f"p50 {stat['p50']:.2f}s p95 {stat['p95']:.2f}s\n")
+                            for typename in ("voice_to_text", "text_to_voice"):
+                                voice = Bridge().bots.get(typename)
+                                if voice is not None and hasattr(voice, "stats"):
+                                    stat = voice.stats()
+                                    result += (f"{typename}({stat['provider']}): 合成缓存命中{stat['tts_hits']}/{stat['tts_hits'] + stat['tts_misses']} "
+                                               f"识别缓存命中{stat['asr_hits']}/{stat['asr_hits'] + stat['asr_misses']}\n")
+                            translator = Bridge().bots.get("translate")
+                            if translator is not None and hasattr(translator, "stats"):
+                                stat = translator.stats()
+                                result += (f"翻译缓存({stat['provider']}): 命中{stat['hits']} 未命中{stat['misses']} "
+                                           f"命中率{stat['hit_rate']:.1%}\n")
+                            if conf().get("conversation_compact", False):
+                                from bot.session_compactor import get_compactor
+                                stat = get_compactor().stats()
+                                result += f"记忆压缩：完成{stat['compacted']} 失败{stat['failed']}\n"
                         elif cmd == "plist":
                             plugins = PluginManager().list_plugins()
                             ok = True
@@ -6,21 +6,9 @@ import re
 from urllib.parse import urlparse
 import time
 import random
-import asyncio
-import nest_asyncio
 import requests
-from newspaper import Article
-import newspaper
-from bs4 import BeautifulSoup
 
-# 导入requests_html用于动态内容提取
-from requests_html import HTMLSession
-
-# 应用nest_asyncio以解决事件循环问题
-try:
-    nest_asyncio.apply()
-except Exception as e:
-    logger.warning(f"[JinaSum] 无法应用nest_asyncio: {str(e)}")
+# newspaper、bs4、requests_html导入较慢，在首次使用时才导入，不影响启动和插件重载
 
 import plugins
 from bridge.context import ContextType
@@ -193,6 +181,10 @@ class JinaSum(Plugin):
             str: 文章内容,失败返回None
         """
         try:
+            import newspaper
+            from newspaper import Article
+            from bs4 import BeautifulSoup
+
             # 处理B站短链接
             if "b23.tv" in url:
                 # 先获取重定向后的真实URL
@@ -530,6 +522,17 @@ class JinaSum(Plugin):
             str: 提取的内容，失败返回None
         """
         try:
+            from bs4 import BeautifulSoup
+            # 导入requests_html用于动态内容提取
+            from requests_html import HTMLSession
+            import nest_asyncio
+
+            # 应用nest_asyncio以解决事件循环问题
+            try:
+                nest_asyncio.apply()
+            except Exception as e:
+                logger.warning(f"[JinaSum] 无法应用nest_asyncio: {str(e)}")
+
             logger.debug(f"[JinaSum] 开始动态提取内容: {url}")
             
             # 创建会话并设置超时
@@ -2,14 +2,19 @@
 
 import json
 import os
+import threading
 import requests
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.file_watcher import file_watcher
 from common.log import logger
 from plugins import *
+from plugins.plugin_utils import get_trigger_prefix, is_admin, set_reply_text
 import random
 
+from .keyword_trie import KeywordTrie
+
 
 @plugins.register(
     name="Keyword",
@@ -25,6 +30,7 @@ class Keyword(Plugin):
         try:
             curdir = os.path.dirname(__file__)
             config_path = os.path.join(curdir, "config.json")
+            self.config_path = config_path
             conf = None
             if not os.path.exists(config_path):
                 logger.debug(f"[keyword]不存在配置文件{config_path}")
@@ -37,8 +43,14 @@ class Keyword(Plugin):
                     conf = json.load(f)
             # 加载关键词
             self.keyword = conf["keyword"]
+            self.fuzzy_distance = conf.get("fuzzy_distance", 1)
+            self.patterns = conf.get("keyword_patterns", False)  # 开启后以*结尾为前缀匹配，以~开头为模糊匹配
+            self.trie = KeywordTrie(self.keyword, self.fuzzy_distance, patterns=self.patterns)
+            self.lock = threading.Lock()
+            if conf.get("hot_reload", True):
+                file_watcher.watch(config_path, self._on_config_changed)
 
-            logger.info("[keyword] {}".format(self.keyword))
+            logger.info("[keyword] {} keywords loaded".format(len(self.trie)))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[keyword] inited.")
         except Exception as e:
@@ -51,9 +63,13 @@ class Keyword(Plugin):
 
         content = e_context["context"].content.strip()
         logger.debug("[keyword] on_handle_context. content: %s" % content)
-        if content in self.keyword:
-            logger.info(f"[keyword] 匹配到关键字【{content}】")
-            reply_text = self.keyword[content]
+        if content.startswith(get_trigger_prefix() + "keyword"):
+            self._process_admin_cmd(e_context)
+            return
+        matched = self.trie.match(content)
+        if matched:
+            key, reply_text = matched
+            logger.info(f"[keyword] 匹配到关键字【{key}】")
 
             if isinstance(reply_text, list):
                 # 如果关键词对应的是一个列表，则随机选择列表中的一个元素
@@ -96,6 +112,76 @@ class Keyword(Plugin):
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
             
-    def get_help_text(self, **kwargs):
+    def _on_config_changed(self, path):
+        # 在文件监听的后台线程中重建，不影响消息处理
+        logger.info("[keyword] {} changed, reloading".format(path))
+        self.reload()
+
+    def reload(self):
+        """重新读取config.json，构建新的字典树后整体替换"""
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                conf = json.load(f)
+            keyword = conf.get("keyword", {})
+            fuzzy_distance = conf.get("fuzzy_distance", 1)
+            patterns = conf.get("keyword_patterns", False)
+            trie = KeywordTrie(keyword, fuzzy_distance, patterns=patterns)
+            with self.lock:
+                self.keyword = keyword
+                self.fuzzy_distance = fuzzy_distance
+                self.patterns = patterns
+                self.trie = trie
+            logger.info("[keyword] reloaded {} keywords".format(len(trie)))
+        except Exception as e:
+            logger.error("[keyword] reload failed: {}".format(e))
+
+    def _save_keywords(self):
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        conf["keyword"] = self.keyword
+        with open(self.config_path, "w", encoding="utf-8") as f:
+            json.dump(conf, f, indent=4, ensure_ascii=False)
+        file_watcher.mark_updated(self.config_path)
+
+    def _process_admin_cmd(self, e_context: EventContext):
+        cmd = e_context["context"].content.split(maxsplit=3)
+        if not is_admin(e_context):
+            set_reply_text("需要管理员权限执行", e_context, level=ReplyType.ERROR)
+            return
+        if len(cmd) == 4 and cmd[1] == "add":
+            # 只修改当前字典树中的一个关键词，不重建整棵树
+            with self.lock:
+                self.keyword[cmd[2]] = cmd[3]
+                self.trie.add(cmd[2], cmd[3])
+                self._save_keywords()
+            set_reply_text(f"已添加关键词【{cmd[2]}】", e_context, level=ReplyType.INFO)
+            return
+        if len(cmd) == 3 and cmd[1] == "del":
+            with self.lock:
+                if cmd[2] not in self.keyword:
+                    set_reply_text(f"关键词【{cmd[2]}】不存在", e_context, level=ReplyType.ERROR)
+                    return
+                del self.keyword[cmd[2]]
+                self.trie.remove(cmd[2])
+                self._save_keywords()
+            set_reply_text(f"已删除关键词【{cmd[2]}】", e_context, level=ReplyType.INFO)
+            return
+        if len(cmd) == 2 and cmd[1] == "reload":
+            threading.Thread(target=self.reload, name="KeywordReload", daemon=True).start()
+            set_reply_text("正在后台重新加载关键词", e_context, level=ReplyType.INFO)
+            return
+        set_reply_text(self.get_help_text(verbose=True), e_context, level=ReplyType.INFO)
+
+    def get_help_text(self, verbose=False, **kwargs):
         help_text = "关键词过滤"
+        if not verbose:
+            return help_text
+        trigger_prefix = get_trigger_prefix()
+        help_text += f"\n当前共{len(self.trie)}个关键词"
+        if self.patterns:
+            help_text += "，以*结尾为前缀匹配，以~开头为模糊匹配"
+        help_text += "\n\n管理员指令：\n"
+        help_text += f"{trigger_prefix}keyword add 关键词 回复: 添加关键词\n"
+        help_text += f"{trigger_prefix}keyword del 关键词: 删除关键词\n"
+        help_text += f"{trigger_prefix}keyword reload: 重新加载config.json"
         return help_text
@@ -0,0 +1,146 @@
+# encoding:utf-8
+"""
+关键词字典树，支持三种关键词：
+- 精确匹配: "关键词"，消息内容与关键词完全相同
+- 前缀匹配: "关键词*"，消息内容以关键词开头，多个前缀同时命中时取最长的
+- 模糊匹配: "~关键词"，消息内容与关键词的编辑距离不超过max_distance
+前缀和模糊匹配需要开启patterns，否则所有关键词都按精确匹配，以*结尾或以~开头的关键词保持原样
+查找只沿消息内容在树上走，不需要遍历所有关键词
+"""
+
+_EXACT = 0
+_PREFIX = 1
+_FUZZY = 2
+
+
+def parse_key(key, patterns=True):
+    """解析配置中的关键词，返回(匹配方式, 关键词)"""
+    if not patterns:
+        return _EXACT, key
+    if len(key) > 1 and key.endswith("*"):
+        return _PREFIX, key[:-1]
+    if len(key) > 1 and key.startswith("~"):
+        return _FUZZY, key[1:]
+    return _EXACT, key
+
+
+class _Node(object):
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = None  # 匹配方式 -> (配置中的关键词, 回复)
+
+
+class KeywordTrie(object):
+    def __init__(self, keywords=None, max_distance=1, max_fuzzy_length=64, patterns=False):
+        self.root = _Node()
+        self.patterns = patterns  # 是否按*和~解析前缀、模糊关键词
+        # 模糊关键词按长度分别建树，只搜索长度与消息相差不超过max_distance的树
+        self.fuzzy_roots = {}
+        self.max_distance = max_distance
+        self.max_fuzzy_length = max_fuzzy_length  # 超过该长度的消息不做模糊匹配
+        self.size = 0
+        for key, value in (keywords or {}).items():
+            self.add(key, value)
+
+    def _find_node(self, root, word, create=False):
+        node = root
+        for ch in word:
+            child = node.children.get(ch)
+            if child is None:
+                if not create:
+                    return None
+                child = _Node()
+                node.children[ch] = child
+            node = child
+        return node
+
+    def _root_of(self, mode, word, create=False):
+        if mode != _FUZZY:
+            return self.root
+        root = self.fuzzy_roots.get(len(word))
+        if root is None and create:
+            root = self.fuzzy_roots[len(word)] = _Node()
+        return root
+
+    def add(self, key, value):
+        mode, word = parse_key(key, self.patterns)
+        node = self._find_node(self._root_of(mode, word, create=True), word, create=True)
+        # 先生成新的dict再替换，查找中的线程不会看到修改了一半的数据
+        values = dict(node.values or {})
+        if mode not in values:
+            self.size += 1
+        values[mode] = (key, value)
+        node.values = values
+
+    def remove(self, key):
+        mode, word = parse_key(key, self.patterns)
+        root = self._root_of(mode, word)
+        node = self._find_node(root, word) if root is not None else None
+        if node is None or not node.values or mode not in node.values:
+            return False
+        values = dict(node.values)
+        del values[mode]
+        node.values = values or None
+        self.size -= 1
+        return True
+
+    def match(self, content):
+        """
+        按精确、最长前缀、模糊的顺序查找
+        :return: (配置中的关键词, 回复)，没有匹配时返回None
+        """
+        node = self.root
+        prefix = None
+        for ch in content:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.values and _PREFIX in node.values:
+                prefix = node.values[_PREFIX]
+        else:
+            if node.values and _EXACT in node.values:
+                return node.values[_EXACT]
+        if prefix:
+            return prefix
+        if self.fuzzy_roots and len(content) <= self.max_fuzzy_length:
+            return self._fuzzy_match(content)
+        return None
+
+    def _fuzzy_match(self, content):
+        """
+        在树上逐层计算编辑距离，每层只计算与当前深度相差不超过max_distance的格子
+        同一棵树中关键词长度相同，剩余长度已知，据此估计最终距离的下界，下界不小于当前最优值时剪掉整个分支
+        """
+        n = len(content)
+        k = self.max_distance
+        limit = k + 1  # 超过上限的格子都记为k + 1
+        best = None
+        best_distance = limit
+        first_row = [min(i, limit) for i in range(n + 1)]
+        stack = []
+        for length in range(n - k, n + k + 1):
+            root = self.fuzzy_roots.get(length)
+            if root is not None:
+                stack.extend((child, ch, first_row, 1, length - 1) for ch, child in list(root.children.items()))
+        while stack:
+            node, ch, prev_row, depth, remaining = stack.pop()
+            lo, hi = max(1, depth - k), min(n, depth + k)
+            row = [limit] * (n + 1)
+            row[0] = min(depth, limit)
+            for i in range(lo, hi + 1):
+                cost = 0 if content[i - 1] == ch else 1
+                row[i] = min(row[i - 1] + 1, prev_row[i] + 1, prev_row[i - 1] + cost, limit)
+            if remaining == 0:
+                if node.values and _FUZZY in node.values and row[n] < best_distance:
+                    best = node.values[_FUZZY]
+                    best_distance = row[n]
+                continue
+            bound = min(row[i] + abs(n - i - remaining) for i in range(lo - 1, hi + 1))
+            if bound < best_distance:
+                stack.extend((child, c, row, depth + 1, remaining - 1) for c, child in list(node.children.items()))
+        return best
+
+    def __len__(self):
+        return self.size
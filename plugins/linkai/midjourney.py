@@ -6,6 +6,7 @@ import threading
 import time
 from bridge.reply import Reply, ReplyType
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from bridge.context import ContextType
 from plugins import EventContext, EventAction
 from .utils import Util
@@ -15,6 +16,13 @@ INVALID_REQUEST = 410
 NOT_FOUND_ORIGIN_IMAGE = 461
 NOT_FOUND_TASK = 462
 
+# 任务状态轮询：首次查询前等待的秒数，之后按任务已进行的时间逐渐拉长查询间隔
+POLL_FIRST_DELAY = 10
+POLL_MIN_INTERVAL = 5
+POLL_MAX_INTERVAL = 30
+POLL_MAX_SECONDS = 15 * 60  # 超过该时间仍未完成的任务不再查询
+POLL_MAX_ERRORS = 5  # 查询连续出错该次数后不再查询
+
 
 class TaskType(Enum):
     GENERATE = "generate"
@@ -76,7 +84,10 @@ class MJBot:
         self.tasks = {}
         self.temp_dict = {}
         self.tasks_lock = threading.Lock()
+        # 所有任务的状态轮询都在同一个事件循环中以协程执行，等待时不占用线程，只有查询请求在线程池中进行
         self.event_loop = asyncio.new_event_loop()
+        self.loop_thread = None
+        self.poll_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mj-poll")
 
     def judge_mj_task_type(self, e_context: EventContext):
         """
@@ -220,7 +231,6 @@ class MJBot:
                               task_type=TaskType.GENERATE)
                 # put to memory dict
                 self.tasks[task.id] = task
-                # asyncio.run_coroutine_threadsafe(self.check_task(task, e_context), self.event_loop)
                 self._do_check_task(task, e_context)
                 return reply
         else:
@@ -255,7 +265,6 @@ class MJBot:
                 self.tasks[task.id] = task
                 key = f"{task_type.name}_{img_id}_{index}"
                 self.temp_dict[key] = True
-                # asyncio.run_coroutine_threadsafe(self.check_task(task, e_context), self.event_loop)
                 self._do_check_task(task, e_context)
                 return reply
         else:
@@ -267,38 +276,61 @@ class MJBot:
             reply = Reply(ReplyType.ERROR, error_msg or "图片生成失败，请稍后再试")
             return reply
 
-    def check_task_sync(self, task: MJTask, e_context: EventContext):
+    async def check_task(self, task: MJTask, e_context: EventContext):
+        """轮询任务状态直到完成、失败或超时，任务越久未完成查询间隔越长"""
         logger.debug(f"[MJ] start check task status, {task}")
-        max_retry_times = 90
-        while max_retry_times > 0:
-            time.sleep(10)
-            url = f"{self.base_url}/tasks/{task.id}"
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        delay = POLL_FIRST_DELAY
+        errors = 0
+        polls = 0
+        while errors < POLL_MAX_ERRORS:
+            await asyncio.sleep(delay)
+            age = time.time() - start
+            if age > POLL_MAX_SECONDS:
+                break
+            delay = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, age / 4))
+            polls += 1
             try:
-                res = requests.get(url, headers=self.headers, timeout=8)
-                if res.status_code == 200:
-                    res_json = res.json()
-                    logger.debug(f"[MJ] task check res sync, task_id={task.id}, status={res.status_code}, "
-                                 f"data={res_json.get('data')}, thread={threading.current_thread().name}")
-                    if res_json.get("data") and res_json.get("data").get("status") == Status.FINISHED.name:
-                        # process success res
-                        if self.tasks.get(task.id):
-                            self.tasks[task.id].status = Status.FINISHED
-                        self._process_success_task(task, res_json.get("data"), e_context)
-                        return
-                    max_retry_times -= 1
-                else:
-                    res_json = res.json()
-                    logger.warn(f"[MJ] image check error, status_code={res.status_code}, res={res_json}")
-                    max_retry_times -= 20
+                res = await loop.run_in_executor(self.poll_executor, self._fetch_task, task.id)
             except Exception as e:
-                max_retry_times -= 20
-                logger.warn(e)
-        logger.warn("[MJ] end from poll")
+                errors += 1
+                logger.warn(f"[MJ] task check error, task_id={task.id}, error={e}")
+                continue
+            if res.status_code != 200:
+                errors += 1
+                logger.warn(f"[MJ] image check error, status_code={res.status_code}, res={res.text[:200]}")
+                continue
+            errors = 0
+            data = res.json().get("data") or {}
+            logger.debug(f"[MJ] task check res, task_id={task.id}, age={int(age)}s, polls={polls}, data={data}")
+            status = data.get("status")
+            if status == Status.FINISHED.name:
+                # process success res
+                if self.tasks.get(task.id):
+                    self.tasks[task.id].status = Status.FINISHED
+                await loop.run_in_executor(self.poll_executor, self._process_success_task, task, data, e_context)
+                return
+            if status in (Status.EXPIRED.name, Status.ABORTED.name):
+                logger.warn(f"[MJ] task {status.lower()}, task_id={task.id}")
+                task.status = Status[status]
+                return
+        logger.warn(f"[MJ] end from poll, task_id={task.id}, polls={polls}, errors={errors}")
         if self.tasks.get(task.id):
             self.tasks[task.id].status = Status.EXPIRED
 
+    def _fetch_task(self, task_id):
+        return requests.get(f"{self.base_url}/tasks/{task_id}", headers=self.headers, timeout=8)
+
     def _do_check_task(self, task: MJTask, e_context: EventContext):
-        threading.Thread(target=self.check_task_sync, args=(task, e_context)).start()
+        if self.loop_thread is None:
+            with self.tasks_lock:
+                if self.loop_thread is None:
+                    self.loop_thread = threading.Thread(target=self._run_loop, args=(self.event_loop,),
+                                                        name="mj-poll-loop", daemon=True)
+                    self.loop_thread.start()
+        future = asyncio.run_coroutine_threadsafe(self.check_task(task, e_context), self.event_loop)
+        future.add_done_callback(_log_poll_exception)
 
     def _process_success_task(self, task: MJTask, res: dict, e_context: EventContext):
         """
@@ -431,6 +463,11 @@ class MJBot:
 
         return base_enabled or remote_enabled
 
+def _log_poll_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"[MJ] check task failed: {future.exception()}")
+
+
 def _send(channel, reply: Reply, context, retry_cnt=0):
     try:
         channel.send(reply, context)
@@ -5,6 +5,7 @@ import importlib.util
 import json
 import os
 import sys
+import threading
 
 from common.log import logger
 from common.singleton import singleton
@@ -14,12 +15,28 @@ from config import conf, remove_plugin_config, write_plugin_config
 from .event import *
 
 
+class _Instances(dict):
+    """插件实例表，访问尚未激活的延迟插件时先激活"""
+
+    def __init__(self, activate):
+        super().__init__()
+        self._activate = activate
+
+    def __missing__(self, name):
+        instance = self._activate(name)
+        if instance is None:
+            raise KeyError(name)
+        return instance
+
+
 @singleton
 class PluginManager:
     def __init__(self):
         self.plugins = SortedDict(lambda k, v: v.priority, reverse=True)
         self.listening_plugins = {}
-        self.instances = {}
+        self.instances = _Instances(self._activate_deferred)
+        self.deferred = {}  # 延迟激活的插件 -> 上次激活时监听的事件
+        self.activate_lock = threading.RLock()
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
@@ -137,13 +154,47 @@ class PluginManager:
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
 
+    def _listen(self, name, events):
+        for event in events:
+            listeners = self.listening_plugins.setdefault(event, [])
+            if name not in listeners:
+                listeners.append(name)
+
+    def _cached_events(self, plugincls):
+        """上次激活时记录在plugins.json中的监听事件，插件版本变化后失效"""
+        pconf = self.pconf["plugins"].get(plugincls.name) or {}
+        if "events" not in pconf or pconf.get("version") != plugincls.version:
+            return None
+        return [Event[event] for event in pconf["events"] if event in Event.__members__]
+
+    def _record_events(self, plugincls, instance):
+        pconf = self.pconf["plugins"].get(plugincls.name)
+        if pconf is None:
+            return
+        events = sorted(event.name for event in instance.handlers)
+        if pconf.get("events") != events or pconf.get("version") != plugincls.version:
+            pconf["events"] = events
+            pconf["version"] = plugincls.version
+            self.save_config()
+
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
         self._load_all_config() # 重新读取全局插件配置，支持使用#reloadp命令对插件配置热更新
+        # 开启延迟激活后，已记录监听事件的插件在第一次收到对应事件时才创建实例
+        lazy = conf().get("plugin_lazy_activation", False)
         for name, plugincls in self.plugins.items():
             if plugincls.enabled:
                 if 'GODCMD' in self.instances and name == 'GODCMD':
                     continue
+                if name in self.deferred:
+                    continue
+                if lazy and name != "GODCMD" and name not in self.instances:
+                    events = self._cached_events(plugincls)
+                    if events is not None:
+                        self.deferred[name] = events
+                        self._listen(name, events)
+                        logger.debug("Plugin %s deferred until first event" % name)
+                        continue
                 # if name not in self.instances:
                 try:
                     instance = plugincls()
@@ -155,16 +206,46 @@ class PluginManager:
                 if name in self.instances:
                     self.instances[name].handlers.clear()
                 self.instances[name] = instance
-                for event in instance.handlers:
-                    if event not in self.listening_plugins:
-                        self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
+                self._listen(name, instance.handlers)
+                self._record_events(plugincls, instance)
         self.refresh_order()
         return failed_plugins
 
+    def _activate_deferred(self, name: str):
+        """创建延迟激活的插件实例，返回None表示插件不存在或初始化失败"""
+        with self.activate_lock:
+            instance = self.instances.get(name)
+            if instance is not None:
+                return instance
+            events = self.deferred.pop(name, None)
+            if events is None:
+                return None
+            plugincls = self.plugins[name]
+            try:
+                instance = plugincls()
+            except Exception as e:
+                logger.warn("Failed to init %s, diabled. %s" % (name, e))
+                self.disable_plugin(name)
+                events = []
+                instance = None
+            else:
+                self.instances[name] = instance
+                self._listen(name, instance.handlers)
+                self._record_events(plugincls, instance)
+                logger.info("Plugin %s activated on first use" % name)
+            # 插件实际监听的事件与记录不一致时以实际为准
+            for event in events:
+                if instance is None or event not in instance.handlers:
+                    self.listening_plugins[event].remove(name)
+            self.refresh_order()
+            return instance
+
     def reload_plugin(self, name: str):
         name = name.upper()
         remove_plugin_config(name)
+        if name in self.deferred:
+            # 尚未激活，下次激活时会读取新的配置
+            return True
         if name in self.instances:
             for event in self.listening_plugins:
                 if name in self.listening_plugins[event]:
@@ -190,10 +271,12 @@ class PluginManager:
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
         if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
+            for name in list(self.listening_plugins[e_context.event]):
                 if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
                     logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
+                    instance = self.instances.get(name) or self._activate_deferred(name)
+                    if instance is None or e_context.event not in instance.handlers:
+                        continue
                     instance.handlers[e_context.event](e_context, *args, **kwargs)
                     if e_context.is_break():
                         e_context["breaked_by"] = name
@@ -336,6 +419,7 @@ class PluginManager:
             for event in self.listening_plugins:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
+            self.deferred.pop(name, None)
             del self.plugins[name]
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
@@ -0,0 +1,26 @@
+"""
+插件通用的辅助函数：管理员判断、设置回复、获取插件指令前缀
+"""
+
+from bridge.reply import Reply, ReplyType
+from config import conf, global_config
+from plugins.event import EventAction, EventContext
+
+
+def get_trigger_prefix():
+    return conf().get("plugin_trigger_prefix", "$")
+
+
+def is_admin(e_context: EventContext) -> bool:
+    """私聊按对方id、群聊按实际发言人id判断是否为管理员"""
+    context = e_context["context"]
+    if context["isgroup"]:
+        actual_user_id = context.kwargs.get("msg").actual_user_id
+        return bool(actual_user_id) and actual_user_id in global_config["admin_users"]
+    return context["receiver"] in global_config["admin_users"]
+
+
+def set_reply_text(content: str, e_context: EventContext, level: ReplyType = ReplyType.ERROR):
+    """设置回复并结束事件，跳过处理context的默认逻辑"""
+    e_context["reply"] = Reply(level, content)
+    e_context.action = EventAction.BREAK_PASS
@@ -12,6 +12,8 @@ from common.log import logger
 from config import conf
 from plugins import *
 
+from .role_index import RoleIndex
+
 
 class RolePlay:
     def __init__(self, bot, sessionid, desc, wrapper=None):
@@ -51,13 +53,9 @@ class Role(Plugin):
                 config = json.load(f)
                 self.tags = {tag: (desc, []) for tag, desc in config["tags"].items()}
                 self.roles = {}
+                self.role_index = RoleIndex()
                 for role in config["roles"]:
-                    self.roles[role["title"].lower()] = role
-                    for tag in role["tags"]:
-                        if tag not in self.tags:
-                            logger.warning(f"[Role] unknown tag {tag} ")
-                            self.tags[tag] = (tag, [])
-                        self.tags[tag][1].append(role)
+                    self.add_role(role)
                 for tag in list(self.tags.keys()):
                     if len(self.tags[tag][1]) == 0:
                         logger.debug(f"[Role] no role found for tag {tag} ")
@@ -75,27 +73,37 @@ class Role(Plugin):
                 logger.warn("[Role] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/role .")
             raise e
 
+    def add_role(self, role):
+        """添加或更新角色，只更新该角色的索引项"""
+        key = role["title"].lower()
+        old = self.roles.get(key)
+        if old is not None:
+            for tag in old["tags"]:
+                if tag in self.tags and old in self.tags[tag][1]:
+                    self.tags[tag][1].remove(old)
+        self.roles[key] = role
+        self.role_index.add(key, role)
+        for tag in role["tags"]:
+            if tag not in self.tags:
+                logger.warning(f"[Role] unknown tag {tag} ")
+                self.tags[tag] = (tag, [])
+            self.tags[tag][1].append(role)
+
     def get_role(self, name, find_closest=True, min_sim=0.35):
         name = name.lower()
         found_role = None
         if name in self.roles:
             found_role = name
         elif find_closest:
-            import difflib
-
-            def str_simularity(a, b):
-                return difflib.SequenceMatcher(None, a, b).ratio()
-
-            max_sim = min_sim
-            max_role = None
-            for role in self.roles:
-                sim = str_simularity(name, role)
-                if sim >= max_sim:
-                    max_sim = sim
-                    max_role = role
-            found_role = max_role
+            matched = self.role_index.search(name, k=1, min_score=min_sim)
+            if matched:
+                found_role = matched[0][0]
         return found_role
 
+    def suggest_roles(self, name, k=3, min_sim=0.2):
+        """返回与name最相近的k个角色名"""
+        return [self.roles[key]["title"] for key, _ in self.role_index.search(name, k=k, min_score=min_sim)]
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type != ContextType.TEXT:
             return
@@ -164,7 +172,11 @@ class Role(Plugin):
                 return
             role = self.get_role(clist[1])
             if role is None:
-                reply = Reply(ReplyType.ERROR, "角色不存在")
+                suggestions = self.suggest_roles(clist[1])
+                reply_text = "角色不存在"
+                if suggestions:
+                    reply_text += "，你可能想找: " + "、".join(suggestions)
+                reply = Reply(ReplyType.ERROR, reply_text)
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
                 return
@@ -0,0 +1,103 @@
+# encoding:utf-8
+"""
+角色名的n-gram倒排索引，用于模糊查找角色
+查找时只给与输入有相同n-gram的角色打分，不需要和每个角色逐一比较
+"""
+
+import heapq
+
+_SHORT = (1, 2, 3)
+_LONG = (2, 3)  # 长文本中单字几乎出现在每个角色里，不建索引
+
+# (字段, 权重, n-gram长度)
+# 标题综合考虑输入被包含的比例和Dice系数；其余字段只看输入的n-gram被包含的比例
+_FIELDS = (
+    ("title", 1.0, _SHORT),
+    ("remark", 0.6, _SHORT),
+    ("descn", 0.4, _LONG),
+    ("description", 0.4, _LONG),
+)
+
+
+def ngrams(text, sizes=_SHORT):
+    text = text.lower().strip()
+    grams = set()
+    for n in sizes:
+        for i in range(len(text) - n + 1):
+            grams.add(text[i:i + n])
+    return grams
+
+
+class RoleIndex(object):
+    def __init__(self):
+        self.postings = {}  # n-gram -> {角色key: 出现该n-gram的字段位掩码}
+        self.role_grams = {}  # 角色key -> {n-gram: 字段位掩码}，用于删除
+        self.title_sizes = {}  # 角色key -> 标题的n-gram数
+
+    def add(self, key, role: dict):
+        """添加或更新一个角色，只修改该角色相关的倒排项"""
+        if key in self.role_grams:
+            self.remove(key)
+        masks = {}
+        for i, (field, _, sizes) in enumerate(_FIELDS):
+            value = role.get(field)
+            if not value:
+                continue
+            for gram in ngrams(value, sizes):
+                masks[gram] = masks.get(gram, 0) | (1 << i)
+        for gram, mask in masks.items():
+            self.postings.setdefault(gram, {})[key] = mask
+        self.role_grams[key] = masks
+        self.title_sizes[key] = len(ngrams(role.get("title", "")))
+
+    def remove(self, key):
+        masks = self.role_grams.pop(key, None)
+        if masks is None:
+            return
+        for gram in masks:
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[gram]
+        self.title_sizes.pop(key, None)
+
+    def search(self, query, k=5, min_score=0.0):
+        """
+        :return: 按相似度从高到低排列的[(角色key, 相似度)]，最多k个
+        """
+        grams = ngrams(query)
+        if not grams:
+            return []
+        long_size = len(ngrams(query, _LONG))
+        shared = {}  # 角色key -> 每个字段命中的n-gram数
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                continue
+            for key, mask in posting.items():
+                counts = shared.get(key)
+                if counts is None:
+                    counts = shared[key] = [0] * len(_FIELDS)
+                for i in range(len(_FIELDS)):
+                    if mask & (1 << i):
+                        counts[i] += 1
+        scores = []
+        for key, counts in shared.items():
+            score = 0.0
+            for i, (_, weight, sizes) in enumerate(_FIELDS):
+                if not counts[i]:
+                    continue
+                contained = counts[i] / (len(grams) if sizes is _SHORT else long_size)
+                if i == 0:
+                    dice = 2 * counts[i] / (len(grams) + self.title_sizes[key])
+                    sim = 0.7 * contained + 0.3 * dice
+                else:
+                    sim = contained
+                score = max(score, weight * sim)
+            if score >= min_score:
+                scores.append((score, key))
+        return [(key, score) for score, key in heapq.nlargest(k, scores)]
+
+    def __len__(self):
+        return len(self.role_grams)
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import random
+import time
 from hashlib import md5
 
 import requests
 
+from common.log import logger
+from common.token_bucket import TokenBucket
 from config import conf
 from translate.translator import Translator
 
+# 请求过于频繁(54003)和服务端超时/错误(52001/52002)时等待后重试
+RETRY_CODES = ("52001", "52002", "54003")
+
 
 class BaiduTranslator(Translator):
     def __init__(self) -> None:
@@ -19,31 +25,65 @@ class BaiduTranslator(Translator):
         self.appkey = conf().get("baidu_translate_app_key")
         if not self.appid or not self.appkey:
             raise Exception("baidu translate appid or appkey not set")
+        # 标准版QPS为1，高级版为10，超出时接口返回54003，这里在本地排队等待
+        qps = conf().get("baidu_translate_qps", 1)
+        self.bucket = TokenBucket(qps * 60, capacity=qps)
+        self.max_bytes = conf().get("baidu_translate_max_bytes", 5000)  # 每次请求的文本字节数上限，接口建议不超过6000
 
     # For list of language codes, please refer to `https://api.fanyi.baidu.com/doc/21`, need to convert to ISO 639-1 codes
     def translate(self, query: str, from_lang: str = "", to_lang: str = "en") -> str:
+        return self.translate_batch([query], from_lang, to_lang)[0]
+
+    def translate_batch(self, queries: list, from_lang: str = "", to_lang: str = "en") -> list:
+        """
+        接口按换行分别翻译每一行，把多条文本按行拼接，在字节数上限内合并成尽量少的请求
+        """
         if not from_lang:
             from_lang = "auto"  # baidu suppport auto detect
+        # 每条文本拆成非空行，翻译后再按原来的行数重新组合
+        lines_per_query = [[line for line in query.split("\n") if line.strip()] for query in queries]
+        results = []
+        batch, batch_bytes = [], 0
+        for lines in lines_per_query:
+            for line in lines:
+                size = len(line.encode("utf-8")) + 1
+                if batch and batch_bytes + size > self.max_bytes:
+                    results.extend(self._request(batch, from_lang, to_lang))
+                    batch, batch_bytes = [], 0
+                batch.append(line)
+                batch_bytes += size
+        if batch:
+            results.extend(self._request(batch, from_lang, to_lang))
+        texts, offset = [], 0
+        for lines in lines_per_query:
+            texts.append("\n".join(results[offset:offset + len(lines)]))
+            offset += len(lines)
+        return texts
+
+    def _request(self, lines, from_lang, to_lang):
+        query = "\n".join(lines)
         salt = random.randint(32768, 65536)
         sign = self.make_md5("{}{}{}{}".format(self.appid, query, salt, self.appkey))
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         payload = {"appid": self.appid, "q": query, "from": from_lang, "to": to_lang, "salt": salt, "sign": sign}
 
         retry_cnt = 3
-        while retry_cnt:
-            r = requests.post(self.url, params=payload, headers=headers)
+        while True:
+            self.bucket.get_token()
+            r = requests.post(self.url, params=payload, headers=headers, timeout=30)
             result = r.json()
-            errcode = result.get("error_code", "52000")
-            if errcode != "52000":
-                if errcode == "52001" or errcode == "52002":
-                    retry_cnt -= 1
-                    continue
-                else:
-                    raise Exception(result["error_msg"])
-            else:
+            errcode = str(result.get("error_code", "52000"))
+            if errcode == "52000":
                 break
-        text = "\n".join([item["dst"] for item in result["trans_result"]])
-        return text
+            if errcode not in RETRY_CODES or not retry_cnt:
+                raise Exception(result.get("error_msg", errcode))
+            retry_cnt -= 1
+            logger.warning("[BaiduTranslator] error_code={}, retry {}".format(errcode, 3 - retry_cnt))
+            time.sleep(1)
+        dst = [item["dst"] for item in result["trans_result"]]
+        if len(dst) != len(lines):
+            raise Exception("baidu translate returned {} lines for {} lines".format(len(dst), len(lines)))
+        return dst
 
     def make_md5(self, s, encoding="utf-8"):
         return md5(s.encode(encoding)).hexdigest()
@@ -0,0 +1,141 @@
+"""
+翻译结果缓存，包装translate/factory.create_translator创建的翻译实现
+按(源语言, 目标语言, 文本)缓存翻译结果：内存中保留最近使用的结果，同时写入sqlite，重启后仍然有效；
+批量翻译时只把未命中的文本交给翻译实现，由其合并成尽量少的请求
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from common.log import logger
+from config import conf
+from translate.translator import Translator
+
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "translate_cache.db")
+
+
+class CachedTranslator(Translator):
+    def __init__(self, translator: Translator, provider: str, db_path=None):
+        self.translator = translator
+        self.provider = provider
+        self.max_size = conf().get("translate_cache_max_size", 10000)  # sqlite中保留的条数
+        self.memory_size = min(self.max_size, conf().get("translate_cache_memory_size", 1000))
+        self.memory = OrderedDict()  # (from, to, text) -> 译文
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(db_path or DB_PATH, check_same_thread=False)
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translate_cache (
+                    provider TEXT,
+                    from_lang TEXT,
+                    to_lang TEXT,
+                    query TEXT,
+                    result TEXT,
+                    used_at REAL,
+                    PRIMARY KEY (provider, from_lang, to_lang, query)
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_translate_cache_used_at ON translate_cache (used_at)")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("[TranslateCache] open db failed, use memory cache only: {}".format(e))
+            self.conn = None
+
+    def translate(self, query: str, from_lang: str = "", to_lang: str = "en") -> str:
+        return self.translate_batch([query], from_lang, to_lang)[0]
+
+    def translate_batch(self, queries: list, from_lang: str = "", to_lang: str = "en") -> list:
+        results = [None] * len(queries)
+        missing = OrderedDict()  # 未命中的文本 -> 在queries中的位置，相同的文本只翻译一次
+        for i, query in enumerate(queries):
+            result = self._get((from_lang, to_lang, query))
+            if result is None:
+                missing.setdefault(query, []).append(i)
+            else:
+                results[i] = result
+        self.hits += len(queries) - sum(len(v) for v in missing.values())
+        self.misses += len(missing)
+        if missing:
+            texts = list(missing)
+            translated = self.translator.translate_batch(texts, from_lang, to_lang)
+            self._put_many([((from_lang, to_lang, text), result) for text, result in zip(texts, translated)])
+            for text, result in zip(texts, translated):
+                for i in missing[text]:
+                    results[i] = result
+        return results
+
+    def _get(self, key):
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                return result
+            if self.conn is None:
+                return None
+            try:
+                row = self.conn.execute(
+                    "SELECT result FROM translate_cache WHERE provider=? AND from_lang=? AND to_lang=? AND query=?",
+                    (self.provider,) + key,
+                ).fetchone()
+                if row is None:
+                    return None
+                self.conn.execute(
+                    "UPDATE translate_cache SET used_at=? WHERE provider=? AND from_lang=? AND to_lang=? AND query=?",
+                    (time.time(), self.provider) + key,
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("[TranslateCache] read failed: {}".format(e))
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def _put_many(self, items):
+        with self.lock:
+            for key, result in items:
+                self._remember(key, result)
+            if self.conn is None:
+                return
+            now = time.time()
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO translate_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.provider,) + key + (result, now) for key, result in items],
+                )
+                self.writes += len(items)
+                if self.writes >= max(self.max_size // 10, 1):
+                    # 超出条数上限时淘汰最久未使用的，每写入一定条数检查一次
+                    self.writes = 0
+                    self.conn.execute(
+                        "DELETE FROM translate_cache WHERE rowid IN (SELECT rowid FROM translate_cache "
+                        "ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_size,),
+                    )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("[TranslateCache] write failed: {}".format(e))
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "provider": self.provider,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_size": len(self.memory),
+        }
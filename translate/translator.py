@@ -1,5 +1,5 @@
 """
-Voice service abstract class
+Translator service abstract class
 """
 
 
@@ -10,3 +10,10 @@ class Translator(object):
         Translate text from one language to another
         """
         raise NotImplementedError
+
+    def translate_batch(self, queries: list, from_lang: str = "", to_lang: str = "en") -> list:
+        """
+        Translate a list of texts, results are in the same order as queries
+        Providers supporting multiple texts per request should override this
+        """
+        return [self.translate(query, from_lang, to_lang) for query in queries]
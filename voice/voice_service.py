@@ -0,0 +1,244 @@
+"""
+语音服务层，包装voice/factory.create_voice创建的语音实现
+- 语音合成结果按(服务商, 音色配置, 文本)的哈希缓存，常用的问候语、帮助信息和错误提示只合成一次
+- 语音识别结果按(服务商, 音频内容)的哈希缓存，转发的相同语音不重复识别
+- 按服务商限制同时进行的请求数
+- 长文本按句子切分成多段并行合成，再按顺序拼接成一个音频文件
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.tmp_dir import TmpDir
+from common.tmp_cleaner import register_tmp_file
+from config import conf
+from voice.voice import Voice
+
+# 影响合成结果的配置，变化后不再命中之前的缓存
+_TTS_CONF_KEYS = ("text_to_voice_model", "tts_voice_id", "xi_voice_id")
+# 本地引擎不支持多线程同时合成
+_SERIAL_PROVIDERS = ("pytts",)
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]*[。！？!?；;\n]+|[^。！？!?；;\n]+")
+
+
+def split_sentences(text, max_chars):
+    """按句子切分文本，相邻的短句合并，每段不超过max_chars（单句超长时单独成段）"""
+    chunks, current = [], ""
+    for sentence in _SENTENCE_RE.findall(text):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class _LRUCache(object):
+    """按占用字节数淘汰最久未使用的条目"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            self.items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.items.popitem(last=False)
+                self.size -= evicted
+
+
+class VoiceService(Voice):
+    def __init__(self, voice: Voice, provider: str):
+        self.voice = voice
+        self.provider = provider
+        self.cache_enabled = conf().get("voice_cache_enabled", True)
+        self.tts_cache = _LRUCache(conf().get("voice_cache_max_mb", 32) * 1024 * 1024)  # 哈希 -> (扩展名, 音频)
+        self.asr_cache = _LRUCache(conf().get("voice_cache_max_mb", 32) * 1024 * 1024)  # 哈希 -> 文本
+        limit = (conf().get("voice_provider_concurrency") or {}).get(provider, 0)
+        if provider in _SERIAL_PROVIDERS:
+            limit = 1
+        self.semaphore = threading.BoundedSemaphore(limit) if limit else None
+        self.chunk_chars = conf().get("voice_tts_chunk_chars", 0) if provider not in _SERIAL_PROVIDERS else 0
+        self.executor = None
+        self.lock = threading.Lock()
+        self.hits = {"tts": 0, "asr": 0}
+        self.misses = {"tts": 0, "asr": 0}
+
+    def _call(self, func, *args):
+        if self.semaphore is None:
+            return func(*args)
+        with self.semaphore:
+            return func(*args)
+
+    def voiceToText(self, voice_file):
+        key = None
+        if self.cache_enabled:
+            try:
+                with open(voice_file, "rb") as f:
+                    key = hashlib.sha1(self.provider.encode("utf-8") + b"\0" + f.read()).hexdigest()
+            except OSError as e:
+                logger.warning("[VoiceService] read voice file failed: {}".format(e))
+            text = self.asr_cache.get(key) if key else None
+            if text is not None:
+                self.hits["asr"] += 1
+                logger.info("[VoiceService] asr cache hit, text={}".format(text))
+                return Reply(ReplyType.TEXT, text)
+            self.misses["asr"] += 1
+        reply = self._call(self.voice.voiceToText, voice_file)
+        if key and reply is not None and reply.type == ReplyType.TEXT and reply.content:
+            self.asr_cache.put(key, reply.content, len(reply.content.encode("utf-8")))
+        return reply
+
+    def textToVoice(self, text):
+        key = None
+        if self.cache_enabled and text:
+            parts = [self.provider] + [str(conf().get(k, "")) for k in _TTS_CONF_KEYS] + [text]
+            key = hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+            cached = self.tts_cache.get(key)
+            if cached is not None:
+                self.hits["tts"] += 1
+                ext, data = cached
+                logger.info("[VoiceService] tts cache hit, text={}".format(text[:50]))
+                return Reply(ReplyType.VOICE, self._write_tmp(data, ext))
+            self.misses["tts"] += 1
+        reply = None
+        if self.chunk_chars and len(text) > self.chunk_chars:
+            reply = self._text_to_voice_chunked(text)
+        if reply is None:
+            reply = self._call(self.voice.textToVoice, text)
+        if key and reply is not None and reply.type == ReplyType.VOICE and reply.content and os.path.isfile(reply.content):
+            # 发送语音时通道可能转换或删除该文件，缓存中保存一份内容，命中时写出新文件
+            with open(reply.content, "rb") as f:
+                data = f.read()
+            self.tts_cache.put(key, (os.path.splitext(reply.content)[1], data), len(data))
+        return reply
+
+    def _text_to_voice_chunked(self, text):
+        """分段并行合成后按顺序拼接，失败时返回None，由调用方整段合成"""
+        chunks = split_sentences(text, self.chunk_chars)
+        if len(chunks) < 2:
+            return None
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=conf().get("voice_tts_workers", 4),
+                                                       thread_name_prefix="voice-tts")
+        futures = [self.executor.submit(self._call, self.voice.textToVoice, chunk) for chunk in chunks]
+        replies = []
+        for future in futures:
+            # 等待全部分段完成，已合成的分段即使其他分段失败也要清理
+            try:
+                replies.append(future.result())
+            except Exception as e:
+                logger.warning("[VoiceService] tts chunk failed: {}".format(e))
+        files = [r.content for r in replies if r is not None and r.type == ReplyType.VOICE and r.content]
+        try:
+            if len(files) != len(chunks) or not all(os.path.isfile(f) for f in files):
+                logger.warning("[VoiceService] chunked tts failed, fallback to whole text")
+                return None
+            try:
+                path = self._concat(files)
+            except Exception as e:
+                logger.warning("[VoiceService] concat voice failed, fallback to whole text: {}".format(e))
+                return None
+        finally:
+            # 分段文件只用于拼接，成功或失败都不再需要
+            self._remove(files)
+        logger.info("[VoiceService] tts {} chunks in parallel, file={}".format(len(chunks), path))
+        return Reply(ReplyType.VOICE, path)
+
+    @staticmethod
+    def _concat(files):
+        ext = os.path.splitext(files[0])[1].lower()
+        path = TmpDir().path() + "reply-" + uuid.uuid4().hex + (ext or ".mp3")
+        if all(os.path.splitext(f)[1].lower() == ".mp3" for f in files):
+            # mp3由独立的帧组成，直接按顺序拼接即可播放
+            with open(path, "wb") as out:
+                for f in files:
+                    with open(f, "rb") as src:
+                        shutil.copyfileobj(src, out)
+        else:
+            from pydub import AudioSegment
+
+            audio = sum((AudioSegment.from_file(f) for f in files[1:]), AudioSegment.from_file(files[0]))
+            audio.export(path, format=ext.lstrip(".") or "mp3")
+        register_tmp_file(path)
+        return path
+
+    @staticmethod
+    def _remove(files):
+        for f in files:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write_tmp(data, ext):
+        path = TmpDir().path() + "reply-" + uuid.uuid4().hex + (ext or ".mp3")
+        with open(path, "wb") as f:
+            f.write(data)
+        register_tmp_file(path)
+        return path
+
+    def stats(self):
+        return {
+            "provider": self.provider,
+            "tts_hits": self.hits["tts"],
+            "tts_misses": self.misses["tts"],
+            "asr_hits": self.hits["asr"],
+            "asr_misses": self.misses["asr"],
+            "cache_bytes": self.tts_cache.size + self.asr_cache.size,
+        }
+
+
+if __name__ == "__main__":
+    # 微基准：模拟合成耗时随文本长度增加的服务商，对比缓存命中、整段合成和分段并行合成的耗时
+    import tempfile
+    import time
+
+    class _FakeVoice(Voice):
+        def textToVoice(self, text):
+            time.sleep(0.05 + len(text) * 0.002)  # 耗时随文本长度增加
+            fd, path = tempfile.mkstemp(suffix=".mp3")
+            os.write(fd, text.encode("utf-8"))
+            os.close(fd)
+            return Reply(ReplyType.VOICE, path)
+
+    text = "这是一段用于测试的长文本。" * 40
+    service = VoiceService(_FakeVoice(), "fake")
+    for name, chunk_chars in (("whole", 0), ("chunked", 100)):
+        service.chunk_chars = chunk_chars
+        service.tts_cache = _LRUCache(1024 * 1024)
+        begin = time.perf_counter()
+        service.textToVoice(text)
+        first = time.perf_counter() - begin
+        begin = time.perf_counter()
+        service.textToVoice(text)
+        print("{:<8} first={:.3f}s cached={:.4f}s".format(name, first, time.perf_counter() - begin))